@@ -53,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'player.middleware.ConditionalContentMiddleware', # Strong ETags and 304s for pages and JSON (player/middleware.py)
+    'player.middleware.ClientHintsMiddleware', # Accept-CH on pages, for picking transcoded variants
 ]
 
 ROOT_URLCONF = 'musicplayer.urls'
@@ -82,10 +84,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Ingest workers write concurrently, wait for locks instead of failing right away
+        'OPTIONS': {'timeout': 20},
     }
 }
 
 
+# Caches
+# The 'spotify' cache keeps Spotify API responses on disk between runs (see player/spotify_metadata.py),
+# in Redis instead when REDIS_URL is set (below)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'spotify': {
+        'BACKEND': 'player.spotify_metadata.SpotifyFileCache',
+        'LOCATION': os.getenv('SPOTIFY_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'spotify')),
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+}
+SPOTIFY_CACHE_TTL = int(os.getenv('SPOTIFY_CACHE_TTL', str(7 * 24 * 3600))) # Seconds to keep track/album responses
+SPOTIFY_CACHE_CULL_INTERVAL = int(os.getenv('SPOTIFY_CACHE_CULL_INTERVAL', '600')) # Seconds between scans of the file cache for culling
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -124,6 +145,17 @@ SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET')
 # Keep the redirect URI loading as before, or move it to .env as well
 SPOTIPY_REDIRECT_URI = os.getenv('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:8000/callback') # Default if not in .env
 
+# Spotify API rate limiting (player/spotify_client.py)
+# With REDIS_URL set, all web/ingest worker processes share one request budget
+REDIS_URL = os.getenv('REDIS_URL') # e.g. redis://localhost:6379/0
+if REDIS_URL:
+    # Bounded by the Redis server's maxmemory policy, no scans on write
+    CACHES['spotify'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL, 'KEY_PREFIX': 'spotify'}
+SPOTIFY_RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', '5')) # Sustained requests per second
+SPOTIFY_RATE_BURST = int(os.getenv('SPOTIFY_RATE_BURST', '10')) # Bucket size
+SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', '5')) # Retries after a 429
+SPOTIFY_MAX_RETRY_AFTER = float(os.getenv('SPOTIFY_MAX_RETRY_AFTER', '120')) # Longer Retry-After values fail the call instead
+
 # Add a check to warn if credentials are not loaded
 if not SPOTIPY_CLIENT_ID or not SPOTIPY_CLIENT_SECRET:
     print("WARNING: Spotify Client ID or Secret not found in environment variables (.env file).")
@@ -138,6 +170,76 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # This should be within MEDIA_ROOT if you want Django to potentially serve them
 # or if you move them into the final Song.file path later.
 SPOTDL_DOWNLOAD_PATH = os.path.join(MEDIA_ROOT, 'songs') # spotdl will create subdirs here
+SPOTDL_BATCH_SIZE = int(os.getenv('SPOTDL_BATCH_SIZE', '100')) # Max tracks passed to a single spotdl process
+SPOTDL_THREADS = int(os.getenv('SPOTDL_THREADS', '4')) # Parallel downloads inside one spotdl process
+SPOTDL_TIMEOUT = int(os.getenv('SPOTDL_TIMEOUT', '1500')) # Seconds before a spotdl process is killed, keep below INGEST_STALE_AFTER
+# manage.py import_folder links (or with --copy, copies) files from outside MEDIA_ROOT to MEDIA_ROOT/IMPORT_DIR/<folder name>/
+IMPORT_DIR = 'imports'
+# Content-addressed audio (player/audio_store.py): downloads are stored once per content as MEDIA_ROOT/AUDIO_STORAGE_DIR/ab/cd/<sha256>.<ext>
+# instead of songs/{artist}/{album}/... Existing files are moved over with manage.py migrate_audio_storage
+AUDIO_CONTENT_ADDRESSED = os.getenv('AUDIO_CONTENT_ADDRESSED', 'False') == 'True'
+AUDIO_STORAGE_DIR = 'audio'
+
+# Cover art downloads (player/covers.py), stored by content hash under MEDIA_ROOT/COVER_STORAGE_DIR
+COVER_STORAGE_DIR = 'covers'
+COVER_FETCH_WORKERS = int(os.getenv('COVER_FETCH_WORKERS', '8')) # Concurrent image downloads
+COVER_FETCH_TIMEOUT = float(os.getenv('COVER_FETCH_TIMEOUT', '15')) # Seconds (connect/read)
+# Resized WebP/JPEG copies of every cover (covers/ab/<sha256>_<size>.webp|.jpg), used for srcset in the templates
+COVER_THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv('COVER_THUMBNAIL_SIZES', '64,160,300').split(','))
+COVER_WEBP_QUALITY = int(os.getenv('COVER_WEBP_QUALITY', '80'))
+COVER_JPEG_QUALITY = int(os.getenv('COVER_JPEG_QUALITY', '85'))
+
+# Lyrics lookups (player/lyrics.py), run in their own thread pool so they never hold up audio ingest
+LYRICS_PROVIDERS = os.getenv('LYRICS_PROVIDERS', 'Musixmatch,Lrclib,NetEase,Megalobiz,Genius').split(',') # Asked in this order
+LYRICS_WORKERS = int(os.getenv('LYRICS_WORKERS', '4')) # Songs looked up concurrently
+LYRICS_PROVIDER_TIMEOUT = float(os.getenv('LYRICS_PROVIDER_TIMEOUT', '8')) # Seconds before moving on to the next provider
+LYRICS_CACHE_TTL = int(os.getenv('LYRICS_CACHE_TTL', '0')) or None # Seconds a cached hit is trusted, 0 = forever
+LYRICS_NEGATIVE_CACHE_TTL = int(os.getenv('LYRICS_NEGATIVE_CACHE_TTL', str(7 * 24 * 3600))) # Seconds before a miss is searched again, 0 = don't cache misses
+
+# Background ingest workers (manage.py run_ingest_worker)
+INGEST_WORKER_CONCURRENCY = int(os.getenv('INGEST_WORKER_CONCURRENCY', '2')) # Jobs per worker process
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '2')) # Seconds between queue checks when idle
+INGEST_STALE_AFTER = int(os.getenv('INGEST_STALE_AFTER', '1800')) # Seconds without a heartbeat before a running job counts as crashed and is resumed
+INGEST_HEARTBEAT_INTERVAL = int(os.getenv('INGEST_HEARTBEAT_INTERVAL', '60')) # Seconds between heartbeats of a running job, well below INGEST_STALE_AFTER
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3')) # Crashed jobs are resumed this many times at most
+ARTIST_RELEASE_CONCURRENCY = int(os.getenv('ARTIST_RELEASE_CONCURRENCY', '3')) # Releases of one artist ingested in parallel
+
+# Audio streaming (player/streaming.py, /stream/<song_id>/)
+# '' = Django sends the file itself (sendfile() for whole files and ranges only where the WSGI server's wsgi.file_wrapper does it, e.g. gunicorn),
+# 'x-accel-redirect' = nginx sends it, 'x-sendfile' = Apache/lighttpd send it
+AUDIO_STREAM_OFFLOAD = os.getenv('AUDIO_STREAM_OFFLOAD', '')
+AUDIO_STREAM_ACCEL_PREFIX = os.getenv('AUDIO_STREAM_ACCEL_PREFIX', '/protected-media/') # nginx `internal` location aliased to MEDIA_ROOT
+
+# Songs after the next one returned by queue/next/ (?lookahead=N), so the player can preload them for gapless playback
+QUEUE_LOOKAHEAD = int(os.getenv('QUEUE_LOOKAHEAD', '2'))
+QUEUE_LOOKAHEAD_MAX = 10
+
+# Transcoded variants (player/transcode.py), picked by the stream endpoint from ?quality= or the Save-Data/ECT hints
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+TRANSCODE_DIR = 'transcodes' # Under MEDIA_ROOT
+TRANSCODE_LADDER = {
+    'opus': {'low': '48k', 'medium': '96k', 'high': '160k'},
+    'aac': {'low': '64k', 'medium': '128k', 'high': '256k'},
+}
+TRANSCODE_DEFAULT_CODEC = os.getenv('TRANSCODE_DEFAULT_CODEC', 'opus') # 'aac' for clients without Opus (older Safari)
+TRANSCODE_DEFAULT_QUALITY = os.getenv('TRANSCODE_DEFAULT_QUALITY', 'original') # Used without a hint: 'original', 'low', 'medium' or 'high'
+TRANSCODE_ON_DEMAND = os.getenv('TRANSCODE_ON_DEMAND', 'True') == 'True' # Encode missing variants in the background when first requested
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', '2')) # ffmpeg processes run at the same time
+TRANSCODE_TIMEOUT = int(os.getenv('TRANSCODE_TIMEOUT', '600')) # Seconds per encode
+TRANSCODE_CACHE_MAX_BYTES = int(os.getenv('TRANSCODE_CACHE_MAX_MB', '2048')) * 1024 * 1024 # Least recently used variants are deleted above this
+TRANSCODE_EVICT_INTERVAL = int(os.getenv('TRANSCODE_EVICT_INTERVAL', '300')) # Seconds between cache scans while under the limit
+# HLS streams (player/hls.py), each quality is segmented by one background ffmpeg run on first request and kept in the transcode cache
+HLS_ENABLED = os.getenv('HLS_ENABLED', 'False') == 'True'
+HLS_SEGMENT_SECONDS = float(os.getenv('HLS_SEGMENT_SECONDS', '6')) # Target length, ffmpeg cuts at the nearest audio frame
+HLS_SEGMENT_WAIT = float(os.getenv('HLS_SEGMENT_WAIT', '5')) # Seconds a request waits for a running encode's next segment
+
+# Waveform peaks for the seek bar (player/waveform.py, needs NumPy and ffmpeg)
+WAVEFORM_BUCKETS = int(os.getenv('WAVEFORM_BUCKETS', '1000')) # min/max pairs per song
+WAVEFORM_SAMPLE_RATE = int(os.getenv('WAVEFORM_SAMPLE_RATE', '8000')) # Hz the audio is decoded at, plenty for peaks
+WAVEFORM_ON_INGEST = os.getenv('WAVEFORM_ON_INGEST', 'True') == 'True' # Compute peaks right after a download
+
+# Loudness normalization (manage.py analyze_loudness, player/loudness.py)
+LOUDNESS_TARGET_LUFS = float(os.getenv('LOUDNESS_TARGET_LUFS', '-18')) # ReplayGain 2.0 reference level
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
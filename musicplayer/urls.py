@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include # Make sure include is imported
 from django.conf import settings # Added
 from django.conf.urls.static import static # Added
+from player.streaming import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,4 +27,4 @@ urlpatterns = [
 
 # Add this block to serve media files during development (DEBUG=True)
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT) # Immutable caching for content-hashed covers
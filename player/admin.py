@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Artist, Album, EP, Single, Song, Playlist, Library # Import models
+from .models import Artist, Album, EP, Single, Song, Playlist, Library, IngestJob # Import models
 
 # Register your models here.
 admin.site.register(Artist)
@@ -9,3 +9,4 @@ admin.site.register(Single)
 admin.site.register(Song)
 admin.site.register(Playlist)
 admin.site.register(Library)
+admin.site.register(IngestJob)
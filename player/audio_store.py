@@ -0,0 +1,79 @@
+"""Content-addressed audio storage.
+
+With AUDIO_CONTENT_ADDRESSED on, downloaded audio is stored by the sha256 of
+its content as AUDIO_STORAGE_DIR/ab/cd/<sha256>.<ext> instead of spotdl's
+songs/{artist}/{album}/{title} tree: directories stay small (two levels of
+256 shards), names never change when metadata is corrected, and a file
+downloaded twice is stored once. Song.file simply holds the stored path.
+
+Files are put in place with a hard link when possible (or copied to a temp
+file and renamed), so a path either doesn't exist yet or has its full content.
+Moving an existing library over is done by manage.py migrate_audio_storage.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+
+STORED_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+def audio_path_for_hash(digest, extension):
+    """Path relative to MEDIA_ROOT for audio content with the given sha256 hex digest."""
+    return '/'.join([settings.AUDIO_STORAGE_DIR, digest[:2], digest[2:4], digest + extension.lower()])
+
+
+def is_stored(name):
+    """True if `name` (relative to MEDIA_ROOT, like Song.file) is already a content-addressed path."""
+    prefix = settings.AUDIO_STORAGE_DIR + '/'
+    return bool(name) and name.startswith(prefix) and bool(STORED_NAME_RE.match(name[len(prefix):]))
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file(path, move=False):
+    """Stores the file at `path` by content and returns its path relative to MEDIA_ROOT.
+    With move=True the source is removed afterwards; otherwise it's left where it is."""
+    relative_path = audio_path_for_hash(hash_file(path), os.path.splitext(path)[1])
+    final_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    if not os.path.exists(final_path):
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        try:
+            os.link(path, final_path) # Same file system: no copy, keeps mtime so derived data stays valid
+        except FileExistsError:
+            pass # Stored by someone else in the meantime
+        except OSError:
+            # Another file system (or no hard links): copy next to the final location, then rename
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(final_path), suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, final_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    if move and os.path.realpath(path) != os.path.realpath(final_path):
+        os.remove(path)
+    return relative_path
+
+
+def remove_empty_parents(path, stop_at):
+    """Removes the now empty directories above `path`, up to (not including) `stop_at`."""
+    stop_at = os.path.realpath(stop_at)
+    directory = os.path.dirname(os.path.realpath(path))
+    while directory != stop_at and directory.startswith(stop_at + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return # Not empty
+        directory = os.path.dirname(directory)
@@ -0,0 +1,184 @@
+"""Cover art downloads.
+
+Covers are fetched through one pooled requests.Session by a bounded thread pool,
+streamed to disk and stored by content hash (covers/ab/<sha256>.<ext>), so the
+same artwork used by an album, its singles and EPs is stored once.
+Right after a download each cover is also resized into small WebP and JPEG
+copies (COVER_THUMBNAIL_SIZES) stored next to it, which the templates use
+through srcset instead of sending full size artwork to a 40px list item.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from PIL import Image, ImageOps
+
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared session so connections to the image CDN are reused across downloads and threads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=settings.COVER_FETCH_WORKERS,
+                max_retries=2,
+            )
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def cover_path_for_hash(digest, extension):
+    """Path relative to MEDIA_ROOT for cover content with the given sha256 hex digest."""
+    return os.path.join(settings.COVER_STORAGE_DIR, digest[:2], digest + extension)
+
+
+def fetch_cover(url):
+    """Downloads one image and returns its content-addressed path relative to MEDIA_ROOT.
+    Raises requests.RequestException on failure."""
+    tmp_dir = os.path.join(settings.MEDIA_ROOT, settings.COVER_STORAGE_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    with get_session().get(url, stream=True, timeout=settings.COVER_FETCH_TIMEOUT) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type, '.jpg')
+        # Stream into a temp file next to the final location, hashing as we go
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+            relative_path = cover_path_for_hash(digest.hexdigest(), extension)
+            final_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+            if os.path.exists(final_path):
+                os.remove(tmp_path) # Same artwork already stored
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return relative_path
+
+
+# --- Thumbnails ---
+THUMBNAIL_FORMATS = (('.jpg', 'JPEG'), ('.webp', 'WEBP')) # WebP last, see thumbnails_ready()
+
+_ready_covers = set() # Cover paths known to have all their thumbnails, saves a stat per render
+
+
+def thumbnail_path(cover_path, size, extension):
+    """Path relative to MEDIA_ROOT of one resized copy of `cover_path` (also relative)."""
+    return f"{os.path.splitext(cover_path)[0]}_{size}{extension}"
+
+
+def thumbnails_ready(cover_path):
+    """True when every thumbnail of the cover exists. They are written in a fixed order,
+    so checking the last one (largest WebP) is enough."""
+    if not cover_path:
+        return False
+    if cover_path in _ready_covers:
+        return True
+    last = thumbnail_path(cover_path, max(settings.COVER_THUMBNAIL_SIZES), THUMBNAIL_FORMATS[-1][0])
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, last)):
+        _ready_covers.add(cover_path)
+        return True
+    return False
+
+
+def generate_thumbnails(cover_path, force=False):
+    """Writes the WebP and JPEG thumbnails of a stored cover. Returns True on success.
+    Files are written to a temp name and renamed, so a half written thumbnail is never served."""
+    if not force and thumbnails_ready(cover_path):
+        return True
+    source = os.path.join(settings.MEDIA_ROOT, cover_path)
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size in sorted(settings.COVER_THUMBNAIL_SIZES):
+                resized = image.copy()
+                resized.thumbnail((size, size), Image.LANCZOS) # Never upscales
+                for extension, image_format in THUMBNAIL_FORMATS:
+                    target = os.path.join(settings.MEDIA_ROOT, thumbnail_path(cover_path, size, extension))
+                    tmp_path = f"{target}.{threading.get_ident()}.tmp" # Two URLs may share one image
+                    if image_format == 'JPEG':
+                        resized.save(tmp_path, image_format, quality=settings.COVER_JPEG_QUALITY, optimize=True, progressive=True)
+                    else:
+                        resized.save(tmp_path, image_format, quality=settings.COVER_WEBP_QUALITY, method=4)
+                    os.replace(tmp_path, target)
+    except (OSError, ValueError) as e: # UnidentifiedImageError is an OSError
+        print(f"Error creating thumbnails for {cover_path}: {e}")
+        return False
+    _ready_covers.add(cover_path)
+    return True
+
+
+def cover_sources(release, size):
+    """URLs for showing a release's cover at roughly `size` CSS pixels.
+    Returns a dict with 'src' (JPEG closest to size, or the original image/URL),
+    'webp_srcset' and 'jpeg_srcset' (empty until thumbnails exist), or None without any cover."""
+    if release is None:
+        return None
+    if release.cover_image:
+        cover_path = release.cover_image.name
+        if thumbnails_ready(cover_path):
+            sizes = sorted(settings.COVER_THUMBNAIL_SIZES)
+            storage = release.cover_image.storage
+            srcsets = {
+                extension: ', '.join(f"{storage.url(thumbnail_path(cover_path, s, extension))} {s}w" for s in sizes)
+                for extension, _ in THUMBNAIL_FORMATS
+            }
+            best = next((s for s in sizes if s >= size), sizes[-1])
+            return {
+                'src': storage.url(thumbnail_path(cover_path, best, '.jpg')),
+                'webp_srcset': srcsets['.webp'],
+                'jpeg_srcset': srcsets['.jpg'],
+            }
+        return {'src': release.cover_image.url, 'webp_srcset': '', 'jpeg_srcset': ''}
+    if release.cover_image_url:
+        return {'src': release.cover_image_url, 'webp_srcset': '', 'jpeg_srcset': ''}
+    return None
+
+
+def fetch_covers(urls):
+    """Downloads many images concurrently and creates their thumbnails.
+    Returns {url: relative path}; failed URLs are left out."""
+    urls = list(dict.fromkeys(url for url in urls if url))
+    results = {}
+    if not urls:
+        return results
+
+    def _fetch(url):
+        try:
+            relative_path = fetch_cover(url)
+        except (requests.RequestException, OSError) as e:
+            print(f"Error downloading image {url}: {e}")
+            return url, None
+        generate_thumbnails(relative_path) # Resizing releases the GIL, fine to do in the pool
+        return url, relative_path
+
+    with ThreadPoolExecutor(max_workers=min(settings.COVER_FETCH_WORKERS, len(urls))) as pool:
+        for url, relative_path in pool.map(_fetch, urls):
+            if relative_path:
+                results[url] = relative_path
+    return results
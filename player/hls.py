@@ -0,0 +1,260 @@
+"""HLS playback of songs, for instant start and cheap seeking in long tracks.
+
+With HLS_ENABLED a song is also offered as an HLS stream: a master playlist
+lists the AAC qualities of TRANSCODE_LADDER, each quality is a list of about
+HLS_SEGMENT_SECONDS long MPEG-TS segments. A quality is encoded by one
+continuous ffmpeg run through its hls muxer (segments cut from a single AAC
+stream, so there is no encoder priming or padding at the boundaries). The runs
+happen in the transcode pool, never in a web request: the master playlist
+queues every quality, since the player is about to pick one, and a media
+playlist or segment request queues its own quality if needed.
+
+While a quality is being encoded its media playlist is an EVENT playlist of the
+segments ffmpeg has finished so far (it writes them to a .tmp directory,
+renaming each one when complete), so playback starts after the first segment
+and the player reloads the playlist for the rest. A request waits at most
+HLS_SEGMENT_WAIT seconds for a segment that isn't there yet.
+
+Finished segments are moved next to the transcoded variants
+(player/transcode.py), keyed by the source's size and mtime, and share their
+LRU size limit. The playlist is moved in place last, so a quality counts as
+encoded only once all its segments are there; if one of them is evicted later
+the quality is encoded again.
+"""
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.urls import reverse
+
+from .transcode import QUALITIES, get_pool, cache_root, ffmpeg_available, note_encoded, touch
+
+SEGMENT_CONTENT_TYPE = 'video/mp2t'
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+POLL_INTERVAL = 0.1 # Seconds between checks while waiting for a running encode
+
+_pending = set() # Playlist paths queued or being encoded in this process
+_pending_lock = threading.Lock()
+
+
+def _variant_prefix(song, quality):
+    """Absolute path prefix of a quality's files, tied to the current source file. Raises OSError without a source."""
+    stat = os.stat(song.file.path)
+    return os.path.join(cache_root(), str(song.pk), f"{stat.st_size:x}-{stat.st_mtime_ns:x}_hls_{quality}")
+
+
+def playlist_path(song, quality):
+    return _variant_prefix(song, quality) + '.m3u8'
+
+
+def segment_path(song, quality, index):
+    return f"{_variant_prefix(song, quality)}_{index:05d}.ts"
+
+
+def encoding_dir(song, quality):
+    """Where a running encode writes. Ends in .tmp, so eviction and the cleanup of old versions leave it alone."""
+    return _variant_prefix(song, quality) + '.tmp'
+
+
+def read_segments(path):
+    """[(index, duration in seconds)] listed in an ffmpeg media playlist."""
+    segments = []
+    duration = None
+    with open(path, encoding='utf-8') as playlist:
+        for line in playlist:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#'):
+                segments.append((int(os.path.splitext(os.path.basename(line))[0]), duration))
+    return segments
+
+
+def cached_segments(song, quality):
+    """Segments of a quality if it is fully encoded (and marks its playlist used), otherwise None."""
+    playlist = playlist_path(song, quality)
+    try:
+        segments = read_segments(playlist)
+    except (OSError, ValueError):
+        return None
+    if not segments or not all(os.path.exists(segment_path(song, quality, index)) for index, _ in segments):
+        return None # Partly evicted
+    touch(playlist)
+    return segments
+
+
+def is_encoding(song, quality):
+    """True while an encode of the quality is queued here or running in any process."""
+    with _pending_lock:
+        if playlist_path(song, quality) in _pending:
+            return True
+    return os.path.isdir(encoding_dir(song, quality))
+
+
+def current_segments(song, quality):
+    """(segments, complete): every segment once the quality is encoded, otherwise the ones a running
+    encode has finished so far ([] before the first). (None, False) when it isn't encoded or being encoded."""
+    segments = cached_segments(song, quality)
+    if segments:
+        return segments, True
+    if not is_encoding(song, quality):
+        return None, False
+    try:
+        return read_segments(os.path.join(encoding_dir(song, quality), 'index.m3u8')), False
+    except (OSError, ValueError):
+        return [], False # No segment finished yet (or the encode is just moving its files in)
+
+
+def segment_file(song, quality, index):
+    """Path of a finished segment, from the encoded quality or a running encode, or None."""
+    path = segment_path(song, quality, index)
+    if os.path.exists(path):
+        return path
+    path = os.path.join(encoding_dir(song, quality), f'{index:05d}.ts') # Only renamed to .ts when complete
+    return path if os.path.exists(path) else None
+
+
+def _claim_encoding_dir(tmp_dir):
+    """Creates the encode's directory, which also tells other processes it is running.
+    False when another encode holds it; one left by a dead process is taken over after TRANSCODE_TIMEOUT."""
+    try:
+        os.mkdir(tmp_dir)
+        return True
+    except FileExistsError:
+        pass
+    try:
+        idle = time.time() - os.stat(tmp_dir).st_mtime # Every finished segment updates it
+    except FileNotFoundError:
+        idle = math.inf # Finished meanwhile
+    if idle < settings.TRANSCODE_TIMEOUT:
+        return False
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        os.mkdir(tmp_dir)
+        return True
+    except FileExistsError:
+        return False
+
+
+def encode_variant(song, quality):
+    """Encodes all segments of one quality (run in the pool, see schedule_encode).
+    Returns its segments [(index, duration)], or None if ffmpeg failed or another process is encoding it."""
+    segments = cached_segments(song, quality)
+    if segments:
+        return segments
+    playlist = playlist_path(song, quality)
+    tmp_dir = encoding_dir(song, quality)
+    os.makedirs(os.path.dirname(tmp_dir), exist_ok=True)
+    if not _claim_encoding_dir(tmp_dir):
+        return None
+    command = [
+        settings.FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', song.file.path,
+        '-map', '0:a:0', '-vn', '-map_metadata', '-1',
+        '-c:a', 'aac', '-b:a', settings.TRANSCODE_LADDER['aac'][quality],
+        # EVENT: the playlist is rewritten after every segment; temp_file: segments appear once complete
+        '-f', 'hls', '-hls_time', f'{settings.HLS_SEGMENT_SECONDS:g}', '-hls_playlist_type', 'event',
+        '-hls_list_size', '0', '-hls_segment_type', 'mpegts', '-hls_flags', 'temp_file',
+        '-hls_segment_filename', os.path.join(tmp_dir, '%05d.ts'),
+        os.path.join(tmp_dir, 'index.m3u8'),
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True, timeout=settings.TRANSCODE_TIMEOUT)
+        segments = read_segments(os.path.join(tmp_dir, 'index.m3u8'))
+        if not segments:
+            raise OSError("ffmpeg wrote no segments")
+        for index, _ in segments:
+            os.replace(os.path.join(tmp_dir, f'{index:05d}.ts'), segment_path(song, quality, index))
+        os.replace(os.path.join(tmp_dir, 'index.m3u8'), playlist) # Last: marks the quality complete
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        stderr = getattr(e, 'stderr', None) or ''
+        print(f"Error encoding HLS {quality} of song {song.pk}: {e} {stderr.strip()[-500:]}")
+        return None
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    note_encoded(sum(os.path.getsize(segment_path(song, quality, index)) for index, _ in segments))
+    return segments
+
+
+def _run_encode(song, quality, playlist):
+    try:
+        encode_variant(song, quality)
+    finally:
+        with _pending_lock:
+            _pending.discard(playlist)
+
+
+def schedule_encode(song, quality):
+    """Queues the encode of a quality unless it is encoded or queued here already. One running in another
+    process is left alone by encode_variant, or taken over if that process died."""
+    playlist = playlist_path(song, quality)
+    if cached_segments(song, quality):
+        return
+    with _pending_lock:
+        if playlist in _pending:
+            return
+        _pending.add(playlist)
+    get_pool().submit(_run_encode, song, quality, playlist)
+
+
+def prefetch_variants(song):
+    """Queues the encode of every quality not encoded yet, the player asks for one of them next."""
+    if not ffmpeg_available():
+        return
+    for quality in QUALITIES:
+        try:
+            schedule_encode(song, quality)
+        except OSError:
+            return # Source file gone
+
+
+def wait_for_segments(song, quality, timeout):
+    """current_segments, after waiting up to `timeout` seconds for a running encode's first segment."""
+    deadline = time.monotonic() + timeout
+    while True:
+        segments, complete = current_segments(song, quality)
+        if complete or segments or segments is None or time.monotonic() >= deadline:
+            return segments, complete
+        time.sleep(POLL_INTERVAL)
+
+
+def wait_for_segment(song, quality, index, timeout):
+    """segment_file, after waiting up to `timeout` seconds while an encode of the quality runs."""
+    deadline = time.monotonic() + timeout
+    while True:
+        path = segment_file(song, quality, index)
+        if path or time.monotonic() >= deadline or not is_encoding(song, quality):
+            return path
+        time.sleep(POLL_INTERVAL)
+
+
+def master_playlist(song):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for quality in QUALITIES:
+        bitrate = int(settings.TRANSCODE_LADDER['aac'][quality].rstrip('k')) * 1000
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={int(bitrate * 1.1)},CODECS="mp4a.40.2"') # + MPEG-TS overhead
+        lines.append(reverse('stream_song_hls_playlist', args=[song.pk, quality]))
+    return '\n'.join(lines) + '\n'
+
+
+def media_playlist(song, quality, segments, complete=True):
+    """VOD playlist of an encoded quality, or an EVENT playlist (no end yet) of the segments finished so far."""
+    # Must not change between reloads of an EVENT playlist, and rounded EXTINFs may not exceed it
+    target_duration = max([math.ceil(settings.HLS_SEGMENT_SECONDS)] + [round(duration) for _, duration in segments])
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{target_duration}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if complete else 'EVENT'}",
+    ]
+    for index, duration in segments:
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(reverse('stream_song_hls_segment', args=[song.pk, quality, index]))
+    if complete:
+        lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,319 @@
+"""Background ingest jobs for Spotify content.
+
+`add_spotify_content` only queues an IngestJob; the jobs are picked up by
+`manage.py run_ingest_worker`, which can run as many worker processes/threads
+as needed, independently of the web workers.
+
+Jobs are resumable: every finished track is recorded (IngestJobTrack) and
+playlists store the offset of the last committed page. While a job runs, a
+heartbeat thread of its worker keeps IngestJob.updated_at fresh, however long a
+single step (a spotdl batch) takes. A job without a heartbeat for
+INGEST_STALE_AFTER seconds has lost its worker; it is picked up again and
+continues from there, skipping finished tracks without touching storage or the
+Spotify API.
+"""
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import IngestJob, IngestJobTrack
+
+
+def enqueue_ingest_job(user, spotify_url, content_type, spotify_id):
+    """Creates a queued IngestJob and returns it. The view returns right after this."""
+    return IngestJob.objects.create(
+        user=user,
+        spotify_url=spotify_url,
+        content_type=content_type,
+        spotify_id=spotify_id,
+    )
+
+
+class JobProgress:
+    """Records per-track progress of an IngestJob. Passed to the process_spotify_* functions."""
+
+    def __init__(self, job):
+        self.job = job
+        self._positions = 0
+        self._registered_ids = set() # Tracks registered during this attempt, to tell duplicates from earlier attempts' rows
+        self._has_expected_total = False
+        self._lock = threading.Lock() # Artist ingest registers tracks from several threads
+
+    def resume(self):
+        """Prepares a job that ran before (worker crash): tracks that were mid-way are retried."""
+        IngestJobTrack.objects.filter(job=self.job, status=IngestJobTrack.STATUS_RUNNING).update(
+            status=IngestJobTrack.STATUS_PENDING, started_at=None
+        )
+        self._positions = IngestJobTrack.objects.filter(job=self.job).count()
+
+    @property
+    def checkpoint_offset(self):
+        return self.job.checkpoint_offset
+
+    def checkpoint(self, offset):
+        """Records that everything before `offset` (playlist page boundary) is committed."""
+        self.job.checkpoint_offset = offset
+        self._touch_job(checkpoint_offset=offset)
+
+    def finished_tracks(self, spotify_ids=None):
+        """{spotify_id: song pk or None} of tracks already done or failed in this job,
+        limited to `spotify_ids` when given."""
+        rows = IngestJobTrack.objects.filter(job=self.job, status__in=[IngestJobTrack.STATUS_DONE, IngestJobTrack.STATUS_FAILED])
+        if spotify_ids is not None:
+            rows = rows.filter(spotify_id__in=list(spotify_ids))
+        return dict(rows.values_list('spotify_id', 'song_id'))
+
+    def _touch_job(self, **updates):
+        updates['updated_at'] = timezone.now()
+        IngestJob.objects.filter(pk=self.job.pk).update(**updates)
+
+    def expect(self, total):
+        """Sets the expected number of tracks before they are all known (e.g. paged playlists)."""
+        self._has_expected_total = True
+        if self.job.checkpoint_offset:
+            return # Resumed, the first run already set the total and took skipped tracks off it
+        self._touch_job(total_tracks=total)
+
+    def skip_expected(self, count=1):
+        """Removes tracks from the expected total that will never be processed (e.g. local files)."""
+        if count <= 0:
+            return
+        IngestJob.objects.filter(pk=self.job.pk, total_tracks__gte=count).update(
+            total_tracks=F('total_tracks') - count, updated_at=timezone.now()
+        )
+
+    def add_tracks(self, tracks, done_songs=None, message=''):
+        """Registers (spotify_id, title) pairs as pending tracks of the job.
+        Tracks in done_songs ({spotify_id: Song}) are registered as done right away (nothing to do)."""
+        with self._lock:
+            self._add_tracks(list(tracks), done_songs or {}, message)
+
+    def _add_tracks(self, tracks, done_songs, message):
+        known_ids = set(IngestJobTrack.objects.filter(job=self.job, spotify_id__in=[t[0] for t in tracks]).values_list('spotify_id', flat=True))
+        new_rows = []
+        duplicates = 0
+        registered_before = False # The batch (playlist page, album) was registered by an earlier attempt
+        now = timezone.now()
+        for spotify_id, title in tracks:
+            self._positions += 1
+            if spotify_id in self._registered_ids:
+                duplicates += 1 # Listed twice in the playlist, processed once
+                continue
+            self._registered_ids.add(spotify_id)
+            if spotify_id in known_ids:
+                registered_before = True
+                continue # Registered by an earlier attempt of the job, still part of the total
+            row = IngestJobTrack(job=self.job, spotify_id=spotify_id, title=(title or '')[:200], position=self._positions)
+            if spotify_id in done_songs:
+                row.status, row.song, row.message, row.started_at, row.finished_at = IngestJobTrack.STATUS_DONE, done_songs[spotify_id], message, now, now
+            new_rows.append(row)
+        IngestJobTrack.objects.bulk_create(new_rows, ignore_conflicts=True)
+        done_count = sum(1 for row in new_rows if row.status == IngestJobTrack.STATUS_DONE)
+        if done_count:
+            self._touch_job(completed_tracks=F('completed_tracks') + done_count)
+        if self._has_expected_total and not registered_before:
+            self.skip_expected(duplicates) # The earlier attempt already took this batch's duplicates off
+        registered = IngestJobTrack.objects.filter(job=self.job).count()
+        IngestJob.objects.filter(pk=self.job.pk, total_tracks__lt=registered).update(total_tracks=registered)
+
+    def track_started(self, spotify_id):
+        IngestJobTrack.objects.filter(job=self.job, spotify_id=spotify_id, status=IngestJobTrack.STATUS_PENDING).update(
+            status=IngestJobTrack.STATUS_RUNNING, started_at=timezone.now()
+        )
+
+    def track_finished(self, spotify_id, song=None, ok=True, message=''):
+        status = IngestJobTrack.STATUS_DONE if ok else IngestJobTrack.STATUS_FAILED
+        updated = IngestJobTrack.objects.filter(job=self.job, spotify_id=spotify_id).exclude(
+            status__in=[IngestJobTrack.STATUS_DONE, IngestJobTrack.STATUS_FAILED]
+        ).update(status=status, song=song, message=message, finished_at=timezone.now())
+        if not updated:
+            return # Unknown or already counted (duplicate track in a playlist)
+        counter = 'completed_tracks' if ok else 'failed_tracks'
+        self._touch_job(**{counter: F(counter) + 1})
+
+
+class JobHeartbeat:
+    """Bumps IngestJob.updated_at every INGEST_HEARTBEAT_INTERVAL seconds from a thread while a job runs,
+    so a live job never looks stale, only one whose worker process is gone."""
+
+    def __init__(self, job):
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-heartbeat-{job.pk}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(settings.INGEST_HEARTBEAT_INTERVAL):
+                # Only while still ours, a requeued job isn't kept alive by the old claim
+                IngestJob.objects.filter(
+                    pk=self.job.pk, status=IngestJob.STATUS_RUNNING, worker_id=self.job.worker_id
+                ).update(updated_at=timezone.now())
+        except Exception as e:
+            print(f"Heartbeat of ingest job {self.job.pk} stopped: {e}")
+        finally:
+            connection.close() # The thread's own DB connection
+
+
+# Worker ids running in this process, never stale whatever their jobs' updated_at says
+_local_workers = set()
+
+
+def requeue_stale_jobs():
+    """Puts running jobs without a heartbeat for INGEST_STALE_AFTER seconds (dead worker) back in
+    the queue so they resume, or fails them after INGEST_MAX_ATTEMPTS claims."""
+    cutoff = timezone.now() - timedelta(seconds=settings.INGEST_STALE_AFTER)
+    stale = IngestJob.objects.filter(status=IngestJob.STATUS_RUNNING, updated_at__lt=cutoff).exclude(worker_id__in=list(_local_workers))
+    stale.filter(attempts__gte=settings.INGEST_MAX_ATTEMPTS).update(
+        status=IngestJob.STATUS_FAILED, error="Worker stopped responding too many times.", finished_at=timezone.now()
+    )
+    requeued = stale.filter(attempts__lt=settings.INGEST_MAX_ATTEMPTS).update(status=IngestJob.STATUS_QUEUED, worker_id=None)
+    if requeued:
+        print(f"Requeued {requeued} stalled ingest job(s), they resume from their last checkpoint.")
+
+
+def claim_next_job(worker_id):
+    """Atomically claims the oldest queued job for this worker. Returns None if the queue is empty."""
+    requeue_stale_jobs()
+    while True:
+        job_id = (IngestJob.objects.filter(status=IngestJob.STATUS_QUEUED)
+                  .order_by('created_at').values_list('id', flat=True).first())
+        if job_id is None:
+            return None
+        now = timezone.now()
+        # Conditional update so two workers can't claim the same job
+        claimed = IngestJob.objects.filter(id=job_id, status=IngestJob.STATUS_QUEUED).update(
+            status=IngestJob.STATUS_RUNNING, worker_id=worker_id, updated_at=now, attempts=F('attempts') + 1,
+            started_at=Coalesce(F('started_at'), Value(now)), # A resumed job keeps its first start for the ETA
+        )
+        if claimed:
+            return IngestJob.objects.get(id=job_id)
+
+
+def run_job(job):
+    """Runs one claimed job to completion and stores its final status and logs."""
+    # Imported here since views imports this module to enqueue jobs
+    from .views import process_spotify_track, process_spotify_album, process_spotify_playlist, process_spotify_artist
+
+    progress = JobProgress(job)
+    if job.attempts > 1:
+        progress.resume()
+        print(f"Resuming ingest job {job.pk} (attempt {job.attempts}) from offset {job.checkpoint_offset}")
+    logs = []
+    status = IngestJob.STATUS_DONE
+    error = None
+    heartbeat = JobHeartbeat(job)
+    heartbeat.start()
+    try:
+        if job.content_type == 'track' and job.spotify_id in progress.finished_tracks():
+            logs.append("Track was already processed by an earlier attempt.")
+        elif job.content_type == 'track':
+            progress.add_tracks([(job.spotify_id, '')])
+            progress.track_started(job.spotify_id)
+            song, track_logs = process_spotify_track(job.spotify_id, job.user)
+            logs.extend(track_logs)
+            progress.track_finished(job.spotify_id, song=song, ok=bool(song and song.file), message="\n".join(track_logs))
+            if not song:
+                status, error = IngestJob.STATUS_FAILED, "Track processing finished, but no song object returned."
+        elif job.content_type == 'album':
+            songs, release_obj, album_logs = process_spotify_album(job.spotify_id, job.user, progress=progress)
+            logs.extend(album_logs)
+            if release_obj:
+                logs.append(f"Successfully processed album: {release_obj.title} ({len(songs)} tracks)")
+            else:
+                status, error = IngestJob.STATUS_FAILED, "Album processing finished, but no release object returned."
+        elif job.content_type == 'artist':
+            songs, artist_obj, artist_logs = process_spotify_artist(job.spotify_id, job.user, progress=progress)
+            logs.extend(artist_logs)
+            if artist_obj:
+                logs.append(f"Successfully processed artist: {artist_obj.name} ({len(songs)} tracks)")
+            else:
+                status, error = IngestJob.STATUS_FAILED, "Artist processing finished, but no artist object returned."
+        elif job.content_type == 'playlist':
+            songs, playlist_obj, playlist_logs = process_spotify_playlist(job.spotify_id, job.user, progress=progress)
+            logs.extend(playlist_logs)
+            if playlist_obj:
+                logs.append(f"Successfully processed playlist: {playlist_obj.name} ({len(songs)} tracks)")
+            else:
+                status, error = IngestJob.STATUS_FAILED, "Playlist processing finished, but no playlist object returned."
+        else:
+            status, error = IngestJob.STATUS_FAILED, f"Unsupported content type: {job.content_type}"
+    except Exception as e:
+        status, error = IngestJob.STATUS_FAILED, f"Error during {job.content_type} processing: {e}"
+        logs.append(traceback.format_exc())
+    finally:
+        heartbeat.stop()
+
+    if error:
+        logs.append(error)
+    now = timezone.now()
+    IngestJob.objects.filter(pk=job.pk).update(status=status, error=error, log="\n".join(logs), finished_at=now, updated_at=now)
+    print(f"Ingest job {job.pk} finished with status '{status}'")
+    return status
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+
+def run_worker(worker_id, stop_event, poll_interval=2.0, exit_when_idle=False):
+    """Claims and runs jobs until stop_event is set (or the queue is empty with exit_when_idle)."""
+    _local_workers.add(worker_id)
+    try:
+        while not stop_event.is_set():
+            job = claim_next_job(worker_id)
+            if job is None:
+                if exit_when_idle:
+                    return
+                stop_event.wait(poll_interval)
+                continue
+            print(f"Worker {worker_id} picked up ingest job {job.pk}: {job}")
+            run_job(job)
+    finally:
+        _local_workers.discard(worker_id)
+        connection.close() # Each worker thread owns its own DB connection
+
+
+def run_worker_pool(concurrency, poll_interval=2.0, exit_when_idle=False, worker_prefix=None):
+    """Runs `concurrency` worker threads in this process until interrupted."""
+    worker_prefix = worker_prefix or default_worker_id()
+    stop_event = threading.Event()
+    threads = []
+    for i in range(concurrency):
+        thread = threading.Thread(
+            target=run_worker,
+            args=(f"{worker_prefix}-{i}", stop_event, poll_interval, exit_when_idle),
+            name=f"ingest-worker-{i}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Stopping ingest workers after their current jobs...")
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    # Lyrics are looked up in their own pool after the jobs finished, let them land before exiting
+    from .lyrics import wait_for_lyrics
+    remaining = wait_for_lyrics(timeout=60)
+    if remaining:
+        print(f"Exiting with {remaining} lyrics lookups unfinished, run manage.py fetch_lyrics to fill them in.")
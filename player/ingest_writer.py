@@ -0,0 +1,177 @@
+"""Bulk database writes for Spotify ingest.
+
+An album, or one page of a playlist, is written with a handful of queries:
+one upsert per model (Artist, Album/EP/Single, Song) plus diffed inserts into
+the M2M through tables, all inside one transaction.
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from .models import Artist, Album, EP, Single, Song, PlaylistSong
+
+RELEASE_MODELS = {'album': Album, 'ep': EP, 'single': Single}
+
+
+# Helper function to parse release date
+def parse_release_date(release_date_str):
+    if not release_date_str:
+        return None
+    try:
+        parts = release_date_str.split('-')
+        if len(parts) == 1: # YYYY
+            return date(int(parts[0]), 1, 1)
+        elif len(parts) == 2: # YYYY-MM
+            return date(int(parts[0]), int(parts[1]), 1)
+        else: # YYYY-MM-DD
+            return date(int(parts[0]), int(parts[1]), int(parts[2]))
+    except (ValueError, TypeError):
+        print(f"Could not parse date: {release_date_str}")
+        return None # Invalid date format or type
+
+
+def release_model_for(album_info):
+    return RELEASE_MODELS.get(album_info.get('album_type', 'album'), Album)
+
+
+def sync_m2m(relation, wanted):
+    """Makes an M2M relation match `wanted` ({owner_pk: set of target pks}) like .set(), with bulk queries.
+    `relation` is the descriptor, e.g. Album.artists."""
+    if not wanted:
+        return
+    through = relation.through
+    owner_field = relation.field.m2m_field_name() + '_id'
+    target_field = relation.field.m2m_reverse_field_name() + '_id'
+
+    existing = through.objects.filter(**{f"{owner_field}__in": list(wanted)}).values_list('id', owner_field, target_field)
+    existing_pairs = set()
+    stale_ids = []
+    for row_id, owner_id, target_id in existing:
+        if target_id in wanted[owner_id]:
+            existing_pairs.add((owner_id, target_id))
+        else:
+            stale_ids.append(row_id)
+    if stale_ids:
+        through.objects.filter(id__in=stale_ids).delete()
+    through.objects.bulk_create(
+        [through(**{owner_field: owner_id, target_field: target_id})
+         for owner_id, targets in wanted.items() for target_id in targets
+         if (owner_id, target_id) not in existing_pairs],
+        ignore_conflicts=True,
+    )
+
+
+def sync_playlist_songs(playlist, positions, remove_missing=True):
+    """Makes a playlist's memberships match `positions` ({song pk: position}) with one diffed write:
+    new songs are inserted, moved ones get their new position and, with remove_missing, songs
+    no longer listed are removed. Returns (added, moved, removed) counts."""
+    rows = PlaylistSong.objects.filter(playlist=playlist)
+    if not remove_missing:
+        rows = rows.filter(song_id__in=list(positions)) # Only the listed songs matter (one playlist page)
+    existing = {song_id: (row_id, position) for row_id, song_id, position in rows.values_list('id', 'song_id', 'position')}
+    new_rows = [
+        PlaylistSong(playlist=playlist, song_id=song_id, position=position)
+        for song_id, position in positions.items() if song_id not in existing
+    ]
+    moved_rows = [
+        PlaylistSong(id=existing[song_id][0], position=position)
+        for song_id, position in positions.items() if song_id in existing and existing[song_id][1] != position
+    ]
+    stale_ids = [row_id for song_id, (row_id, _) in existing.items() if song_id not in positions] if remove_missing else []
+
+    with transaction.atomic():
+        if stale_ids:
+            PlaylistSong.objects.filter(id__in=stale_ids).delete()
+        PlaylistSong.objects.bulk_create(new_rows, batch_size=500, ignore_conflicts=True)
+        PlaylistSong.objects.bulk_update(moved_rows, ['position'], batch_size=500)
+    return len(new_rows), len(moved_rows), len(stale_ids)
+
+
+def _upsert(model, objects, update_fields):
+    """bulk_create with ON CONFLICT(spotify_id) DO UPDATE, returns {spotify_id: instance}."""
+    if not objects:
+        return {}
+    model.objects.bulk_create(objects, update_conflicts=True, unique_fields=['spotify_id'], update_fields=update_fields)
+    # Primary keys aren't reliably returned for upserts on every backend, read them back in one query
+    return model.objects.in_bulk([obj.spotify_id for obj in objects], field_name='spotify_id')
+
+
+class IngestBatch:
+    """Result of write_track_batch."""
+
+    def __init__(self):
+        self.songs = {} # track spotify_id -> Song
+        self.releases = {} # release spotify_id -> Album/EP/Single
+        self.artists = {} # artist spotify_id -> Artist
+        self.logs = []
+
+
+def write_track_batch(track_payloads):
+    """Upserts the artists, releases and songs of full Spotify track payloads in one transaction.
+    Existing lyrics and files are kept; only Spotify metadata is overwritten."""
+    batch = IngestBatch()
+    track_payloads = [t for t in track_payloads if t and t.get('id') and not t.get('is_local')]
+    if not track_payloads:
+        return batch
+
+    artist_names = {}
+    release_infos = {}
+    for track in track_payloads:
+        for artist_data in track['artists'] + track['album'].get('artists', []):
+            if artist_data.get('id'):
+                artist_names[artist_data['id']] = artist_data['name']
+        release_infos[track['album']['id']] = track['album']
+
+    with transaction.atomic():
+        # --- Artists ---
+        batch.artists = _upsert(
+            Artist,
+            [Artist(spotify_id=spotify_id, name=name[:100]) for spotify_id, name in artist_names.items()],
+            ['name'],
+        )
+
+        # --- Releases (Album/EP/Single), one upsert per model ---
+        release_objects = {model: [] for model in RELEASE_MODELS.values()}
+        for album_info in release_infos.values():
+            release_objects[release_model_for(album_info)].append(release_model_for(album_info)(
+                spotify_id=album_info['id'],
+                title=album_info['name'][:100],
+                release_date=parse_release_date(album_info.get('release_date')),
+                cover_image_url=album_info['images'][0]['url'] if album_info.get('images') else None,
+            ))
+        for model, objects in release_objects.items():
+            saved = _upsert(model, objects, ['title', 'release_date', 'cover_image_url'])
+            batch.releases.update(saved)
+            sync_m2m(model.artists, {
+                release.pk: {batch.artists[a['id']].pk for a in release_infos[spotify_id].get('artists', []) if a.get('id') in batch.artists}
+                for spotify_id, release in saved.items()
+            })
+
+        # --- Songs ---
+        song_objects = []
+        for track in track_payloads:
+            release_obj = batch.releases[track['album']['id']]
+            song_objects.append(Song(
+                spotify_id=track['id'],
+                title=track['name'][:100],
+                duration=timedelta(milliseconds=track['duration_ms']) if track.get('duration_ms') is not None else None,
+                release_date=release_obj.release_date, # Use release's date
+                album=release_obj if isinstance(release_obj, Album) else None,
+                ep=release_obj if isinstance(release_obj, EP) else None,
+                single=release_obj if isinstance(release_obj, Single) else None,
+                track_number=track.get('track_number'),
+            ))
+        batch.songs = _upsert(
+            Song,
+            list({song.spotify_id: song for song in song_objects}.values()), # A playlist may list a track twice
+            ['title', 'duration', 'release_date', 'album', 'ep', 'single', 'track_number'],
+        )
+        sync_m2m(Song.artists, {
+            batch.songs[track['id']].pk: {batch.artists[a['id']].pk for a in track['artists'] if a.get('id') in batch.artists}
+            for track in track_payloads
+        })
+
+    batch.logs.append(
+        f"Saved {len(batch.songs)} songs, {len(batch.releases)} releases and {len(batch.artists)} artists in one batch."
+    )
+    return batch
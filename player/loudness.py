@@ -0,0 +1,138 @@
+"""Loudness analysis (EBU R128 / ReplayGain 2.0) for volume normalization.
+
+A song is decoded by ffmpeg to 48 kHz float32 and read in chunks of about
+CHUNK_SECONDS, so memory stays flat for long mixes. Each chunk is K-weighted
+(the two BS.1770 filters, applied as one FFT convolution in NumPy; there is
+no IIR filter in NumPy itself) and reduced to the mean square of every
+100 ms. At the end those are combined into 400 ms blocks with 75% overlap
+and gated (-70 LUFS absolute, -10 LU relative) into the integrated loudness.
+The sample peak is taken from the unfiltered audio.
+
+Song.replay_gain is LOUDNESS_TARGET_LUFS minus the integrated loudness (dB),
+Song.loudness_peak the linear peak, so the player can normalize without
+clipping: gain = min(10 ** (replay_gain / 20), 1 / loudness_peak).
+"""
+import subprocess
+
+import mutagen
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError: # Optional, loudness analysis is unavailable without it
+    np = None
+
+SAMPLE_RATE = 48000 # The K-weighting coefficients below are for 48 kHz
+SUB_BLOCK = SAMPLE_RATE // 10 # 100 ms, a quarter of a 400 ms gating block
+CHUNK_SECONDS = 10
+FILTER_TAPS = 16384 # Length of the K-weighting impulse response, it has decayed long before that
+
+# ITU-R BS.1770-4 K-weighting at 48 kHz: high shelf (head effects), then high pass (RLB)
+SHELF_B = (1.53512485958697, -2.69169618940638, 1.19839281085285)
+SHELF_A = (1.0, -1.69065929318241, 0.73248077421585)
+HIGHPASS_B = (1.0, -2.0, 1.0)
+HIGHPASS_A = (1.0, -1.99004745483398, 0.99007225036621)
+
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+_filter_cache = {}
+
+
+def loudness_available():
+    return np is not None
+
+
+def _k_weighting_spectrum(fft_size):
+    """Frequency response of the K-weighting filter on an rfft grid of `fft_size`."""
+    if fft_size not in _filter_cache:
+        z = np.exp(-1j * np.pi * np.arange(FILTER_TAPS + 1) / FILTER_TAPS) # e^-jw for w in [0, pi]
+        def biquad(b, a):
+            return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+        impulse = np.fft.irfft(biquad(SHELF_B, SHELF_A) * biquad(HIGHPASS_B, HIGHPASS_A), 2 * FILTER_TAPS)[:FILTER_TAPS]
+        _filter_cache[fft_size] = np.fft.rfft(impulse, fft_size)
+    return _filter_cache[fft_size]
+
+
+def _block_loudness(energy):
+    return -0.691 + 10 * np.log10(np.maximum(energy, 1e-20))
+
+
+def integrated_loudness(sub_block_energies):
+    """Gated integrated loudness in LUFS from the channel-summed mean squares of 100 ms sub-blocks.
+    None for silence or audio shorter than one gating block."""
+    energies = np.asarray(sub_block_energies, dtype=np.float64)
+    if energies.size < 4:
+        return None
+    cumulative = np.concatenate(([0.0], np.cumsum(energies)))
+    blocks = (cumulative[4:] - cumulative[:-4]) / 4 # 400 ms blocks, one every 100 ms
+    loudness = _block_loudness(blocks)
+    above_absolute = blocks[loudness > ABSOLUTE_GATE]
+    if not above_absolute.size:
+        return None
+    relative_threshold = _block_loudness(above_absolute.mean()) + RELATIVE_GATE
+    gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative_threshold)]
+    return float(_block_loudness(gated.mean()))
+
+
+def analyze_file(path):
+    """Decodes the file at `path` and returns (integrated loudness in LUFS or None, linear sample peak).
+    Raises RuntimeError when ffmpeg fails. Doesn't touch the database, so it can run in worker processes."""
+    channels = 2
+    try:
+        audio = mutagen.File(path)
+        if audio is not None and getattr(audio.info, 'channels', None) == 1:
+            channels = 1 # Mono counts once, not as two identical channels
+    except Exception:
+        pass # ffmpeg may still decode it
+    command = [
+        settings.FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', path, '-map', '0:a:0', '-vn', '-ac', str(channels), '-ar', str(SAMPLE_RATE),
+        '-f', 'f32le', '-',
+    ]
+    frame_bytes = 4 * channels
+    chunk_frames = SAMPLE_RATE * CHUNK_SECONDS
+    fft_size = 1 << (chunk_frames + FILTER_TAPS - 1).bit_length()
+    spectrum = _k_weighting_spectrum(fft_size)[:, None]
+
+    leftover = b''
+    filter_tail = np.zeros((FILTER_TAPS - 1, channels)) # Overlap-add carry
+    pending = np.zeros((0, channels)) # Filtered samples not yet making up a whole sub-block
+    energies = []
+    peak = 0.0
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(chunk_frames * frame_bytes - len(leftover))
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % frame_bytes
+            leftover = data[usable:]
+            if not usable:
+                continue
+            samples = np.frombuffer(data[:usable], dtype='<f4').reshape(-1, channels).astype(np.float64)
+            peak = max(peak, float(np.abs(samples).max()))
+
+            frames = samples.shape[0]
+            filtered = np.fft.irfft(np.fft.rfft(samples, fft_size, axis=0) * spectrum, fft_size, axis=0)[:frames + FILTER_TAPS - 1]
+            filtered[:FILTER_TAPS - 1] += filter_tail
+            filter_tail = filtered[frames:].copy()
+
+            pending = np.concatenate((pending, filtered[:frames]))
+            whole = pending.shape[0] // SUB_BLOCK * SUB_BLOCK
+            if whole:
+                sub_blocks = pending[:whole].reshape(-1, SUB_BLOCK, channels)
+                energies.append((sub_blocks ** 2).mean(axis=1).sum(axis=1)) # Channel weights are 1.0 for L/R
+                pending = pending[whole:]
+        stderr = process.stderr.read().decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.strip()[-500:]}")
+    loudness = integrated_loudness(np.concatenate(energies)) if energies else None
+    return loudness, peak
+
+
+def replay_gain(loudness):
+    """Gain in dB that brings `loudness` (LUFS) to LOUDNESS_TARGET_LUFS, None without a loudness."""
+    if loudness is None:
+        return None
+    return round(settings.LOUDNESS_TARGET_LUFS - loudness, 2)
@@ -0,0 +1,240 @@
+"""Lyrics lookups, run as their own stage next to ingest.
+
+syncedlyrics.search asks its providers one after another, and one slow provider
+can hold a track for many seconds. Lyrics aren't needed to play a song, so
+ingest only schedules a lookup (schedule_lyrics) and carries on with the audio.
+A bounded pool of LYRICS_WORKERS threads then asks the providers in
+LYRICS_PROVIDERS order, waits at most LYRICS_PROVIDER_TIMEOUT seconds for each,
+and fills in Song.lyrics / synced_lyrics once a result comes back.
+
+Every lookup outcome, including "nothing found", is kept in LyricsCacheEntry
+under the normalized title and artists. Re-ingests, the same recording on an
+album and a single, and fetch_lyrics runs read that first; misses are searched
+again after LYRICS_NEGATIVE_CACHE_TTL.
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+from syncedlyrics import providers as lyrics_providers
+from syncedlyrics.utils import Lyrics
+
+from .models import LyricsCacheEntry, Song
+
+PROVIDER_CLASSES = {
+    'musixmatch': lyrics_providers.Musixmatch,
+    'lrclib': lyrics_providers.Lrclib,
+    'netease': lyrics_providers.NetEase,
+    'megalobiz': lyrics_providers.Megalobiz,
+    'genius': lyrics_providers.Genius,
+    'deezer': lyrics_providers.Deezer,
+}
+
+# Songs without any lyrics yet, lookups never overwrite lyrics that were found or edited since
+NO_LYRICS = (Q(lyrics__isnull=True) | Q(lyrics='')) & (Q(synced_lyrics__isnull=True) | Q(synced_lyrics=''))
+
+_pools_lock = threading.Lock()
+_song_pool = None # Runs one lookup per song
+_provider_pool = None # Runs single provider requests, so they can be timed out
+_pending = {} # song pk -> Future, a song is never looked up twice at the same time
+_pending_lock = threading.Lock()
+_local = threading.local() # Provider instances (and their HTTP sessions) per provider thread
+_key_locks = {} # lookup key -> [Lock, users], one search per key at a time
+_key_locks_lock = threading.Lock()
+
+# "Song (feat. X)", "Song [with X]" and "Song - Remastered 2011" / "- Radio Edit" share their lyrics
+FEATURING_RE = re.compile(r'\s*[\(\[](?:feat\.?|ft\.?|featuring|with)\s[^\)\]]*[\)\]]', re.IGNORECASE)
+VERSION_SUFFIX_RE = re.compile(r'\s+-\s+[^-]*\b(?:remaster(?:ed)?|version|edit|mono|stereo|mix)\b[^-]*$', re.IGNORECASE)
+
+
+def normalize_text(value):
+    """Lowercase, without accents, punctuation or repeated whitespace."""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^\w\s]', ' ', value.lower()).split())
+
+
+def lyrics_lookup_key(title, artist_names):
+    """Returns (key, normalized title, normalized artists) for the lyrics cache."""
+    title = normalize_text(VERSION_SUFFIX_RE.sub('', FEATURING_RE.sub('', title or '')))
+    artists = ', '.join(sorted({normalize_text(name) for name in artist_names if name}))
+    return hashlib.sha256(f"{title}\n{artists}".encode('utf-8')).hexdigest(), title, artists
+
+
+def get_cached_lyrics(key):
+    """The cache entry for a key, or None when there is none or it has expired."""
+    entry = LyricsCacheEntry.objects.filter(lookup_key=key).first()
+    if entry is None:
+        return None
+    ttl = settings.LYRICS_CACHE_TTL if entry.found else settings.LYRICS_NEGATIVE_CACHE_TTL
+    if ttl is not None and entry.checked_at < timezone.now() - timedelta(seconds=ttl):
+        return None
+    return entry
+
+
+def cached_misses(keys):
+    """The keys among `keys` whose last lookup found nothing and isn't due for another search, in one query."""
+    if not settings.LYRICS_NEGATIVE_CACHE_TTL:
+        return set()
+    cutoff = timezone.now() - timedelta(seconds=settings.LYRICS_NEGATIVE_CACHE_TTL)
+    return set(LyricsCacheEntry.objects.filter(lookup_key__in=list(keys), found=False, checked_at__gte=cutoff)
+               .values_list('lookup_key', flat=True))
+
+
+def store_cached_lyrics(key, title, artists, found):
+    """Records a lookup outcome. Misses are not stored with LYRICS_NEGATIVE_CACHE_TTL = 0."""
+    is_hit = bool(found.synced or found.unsynced)
+    if not is_hit and settings.LYRICS_NEGATIVE_CACHE_TTL == 0:
+        return
+    # One INSERT .. ON CONFLICT statement, concurrent writers on SQLite can't deadlock on it
+    LyricsCacheEntry.objects.bulk_create([LyricsCacheEntry(
+        lookup_key=key,
+        title=title[:255],
+        artists=artists[:500],
+        synced_lyrics=found.synced,
+        lyrics=found.unsynced,
+        found=is_hit,
+        checked_at=timezone.now(),
+    )], update_conflicts=True, unique_fields=['lookup_key'],
+        update_fields=['title', 'artists', 'synced_lyrics', 'lyrics', 'found', 'checked_at'])
+
+
+@contextmanager
+def _lock_key(key):
+    with _key_locks_lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+
+def _get_pools():
+    global _song_pool, _provider_pool
+    with _pools_lock:
+        if _song_pool is None:
+            _song_pool = ThreadPoolExecutor(max_workers=settings.LYRICS_WORKERS, thread_name_prefix='lyrics')
+            # Extra threads so a provider stuck past its timeout doesn't starve the other lookups
+            _provider_pool = ThreadPoolExecutor(max_workers=settings.LYRICS_WORKERS * 2, thread_name_prefix='lyrics-provider')
+        return _song_pool, _provider_pool
+
+
+def _provider_search(name, search_term):
+    providers = getattr(_local, 'providers', None)
+    if providers is None:
+        providers = _local.providers = {}
+    if name not in providers:
+        providers[name] = PROVIDER_CLASSES[name]()
+    return providers[name].get_lrc(search_term)
+
+
+def search_lyrics(search_term, logs):
+    """Asks the configured providers in order until one has synced lyrics.
+    Returns (Lyrics, complete): synced and/or unsynced may be None, and complete is False
+    when a provider failed or timed out, i.e. a miss isn't worth caching."""
+    _, provider_pool = _get_pools()
+    found = Lyrics()
+    complete = True
+    for name in settings.LYRICS_PROVIDERS:
+        name = name.strip().lower()
+        if name not in PROVIDER_CLASSES:
+            logs.append(f"Unknown lyrics provider '{name}', skipping.")
+            continue
+        future = provider_pool.submit(_provider_search, name, search_term)
+        try:
+            found.update(future.result(timeout=settings.LYRICS_PROVIDER_TIMEOUT))
+        except FutureTimeout:
+            future.cancel() # Drops it if it never started, otherwise it finishes on its own
+            logs.append(f"{name} gave no answer within {settings.LYRICS_PROVIDER_TIMEOUT}s for '{search_term}'.")
+            complete = False
+            continue
+        except Exception as e:
+            logs.append(f"Error searching lyrics on {name} for '{search_term}': {e}")
+            complete = False
+            continue
+        if found.synced:
+            return found, True # Plain lyrics keep the search going, synced ones are preferred
+    return found, complete
+
+
+def fetch_lyrics_for_song(song_id, title, artist_names):
+    """Looks up and saves lyrics for one song. Returns the list of saved fields."""
+    logs = []
+    search_term = f"{title} {' '.join(artist_names)}"
+    key, normalized_title, normalized_artists = lyrics_lookup_key(title, artist_names)
+    close_old_connections()
+    try:
+        with _lock_key(key): # The same recording on an album and a single is searched once
+            cached = get_cached_lyrics(key)
+            if cached is not None:
+                found = Lyrics(synced=cached.synced_lyrics, unsynced=cached.lyrics)
+                logs.append(f"Using cached lyrics lookup for '{title}' from {cached.checked_at:%Y-%m-%d}.")
+            else:
+                found, complete = search_lyrics(search_term, logs)
+                if found.synced or found.unsynced or complete:
+                    store_cached_lyrics(key, normalized_title, normalized_artists, found)
+        if found.synced:
+            update_fields = {'synced_lyrics': found.synced}
+            logs.append(f"Found synced lyrics for '{title}'.")
+        elif found.unsynced:
+            update_fields = {'lyrics': found.unsynced}
+            logs.append(f"Found plain lyrics for '{title}'.")
+        else:
+            update_fields = {}
+            logs.append(f"No lyrics found for '{title}'.")
+        if update_fields and not Song.objects.filter(NO_LYRICS, pk=song_id).update(**update_fields):
+            logs.append(f"Lyrics for '{title}' were added meanwhile, keeping those.")
+            update_fields = {}
+        return list(update_fields)
+    except Exception as e:
+        logs.append(f"Error fetching lyrics for '{title}': {e}")
+        return []
+    finally:
+        connection.close() # Pool threads outlive the lookup
+        for log in logs:
+            print(log)
+
+
+def _done(song_id, future):
+    with _pending_lock:
+        if _pending.get(song_id) is future:
+            del _pending[song_id]
+
+
+def schedule_lyrics(song, artist_names):
+    """Queues a lyrics lookup for a song that has none yet. Returns the Future, or None when
+    the song already has lyrics or a lookup for it is already queued."""
+    if song.lyrics or song.synced_lyrics:
+        return None
+    song_pool, _ = _get_pools()
+    with _pending_lock:
+        if song.pk in _pending:
+            return None
+        future = song_pool.submit(fetch_lyrics_for_song, song.pk, song.title, list(artist_names))
+        _pending[song.pk] = future
+    future.add_done_callback(lambda f, song_id=song.pk: _done(song_id, f))
+    return future
+
+
+def wait_for_lyrics(timeout=None):
+    """Blocks until the queued lookups are done (e.g. before a worker process exits).
+    Returns the number still running after `timeout`."""
+    with _pending_lock:
+        futures = list(_pending.values())
+    if not futures:
+        return 0
+    _, not_done = wait(futures, timeout=timeout)
+    return len(not_done)
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from player.loudness import analyze_file, loudness_available, replay_gain
+from player.models import Song
+from player.streaming import file_version
+from player.transcode import ffmpeg_available
+
+
+class Command(BaseCommand):
+    help = 'Measures the loudness (EBU R128) and peak of songs and stores their ReplayGain, skipping unchanged files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('song_ids', nargs='*', type=int,
+                            help='Only these songs (default: every song with a file).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes decoding files.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Songs saved per database write.')
+        parser.add_argument('--force', action='store_true',
+                            help='Measure again even if the file is unchanged since the last run.')
+
+    def handle(self, *args, **options):
+        if not loudness_available() or not ffmpeg_available():
+            self.stdout.write(self.style.ERROR(f"Loudness analysis needs NumPy and ffmpeg ('{settings.FFMPEG_BINARY}')."))
+            return
+
+        songs = Song.objects.exclude(file='').exclude(file__isnull=True)
+        if options['song_ids']:
+            songs = songs.filter(pk__in=options['song_ids'])
+
+        work = []
+        missing = 0
+        for song_id, name, measured_version in songs.values_list('pk', 'file', 'loudness_version').iterator():
+            path = default_storage.path(name)
+            version = file_version(path)
+            if version is None:
+                missing += 1
+            elif options['force'] or measured_version != version:
+                work.append((song_id, path, version))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'Skipping {missing} songs whose file is missing on disk.'))
+        if not work:
+            self.stdout.write(self.style.SUCCESS('Loudness of every song is up to date.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Analyzing {len(work)} songs with {options["workers"]} processes...'))
+        connection.close() # Not shared with the forked workers
+        done = failed = 0
+        measured = []
+        fields = ['loudness_lufs', 'loudness_peak', 'replay_gain', 'loudness_version']
+        # Workers only decode and measure, the database is written from here in batches
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), initializer=django.setup) as pool:
+            futures = {pool.submit(analyze_file, path): (song_id, path, version) for song_id, path, version in work}
+            for future in as_completed(futures):
+                song_id, path, version = futures[future]
+                try:
+                    loudness, peak = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'Could not analyze {path}: {e}'))
+                    continue
+                # Silent files are stored too (without gain), so they aren't decoded again next run
+                measured.append(Song(
+                    pk=song_id,
+                    loudness_lufs=round(loudness, 2) if loudness is not None else None,
+                    loudness_peak=round(peak, 5),
+                    replay_gain=replay_gain(loudness),
+                    loudness_version=version,
+                ))
+                if len(measured) >= options['batch_size']:
+                    Song.objects.bulk_update(measured, fields)
+                    done += len(measured)
+                    measured = []
+                    self.stdout.write(f'{done}/{len(work)} songs saved...')
+        if measured:
+            Song.objects.bulk_update(measured, fields)
+            done += len(measured)
+
+        self.stdout.write(self.style.SUCCESS(f'Analyzed {done} songs ({failed} failed).'))
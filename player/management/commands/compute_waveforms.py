@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from player.models import Song, SongWaveform
+from player.streaming import file_version
+from player.waveform import compute_peaks, store_waveforms, waveforms_available
+
+
+class Command(BaseCommand):
+    help = 'Computes the seek bar waveform peaks of songs that have none, or whose file changed since.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('song_ids', nargs='*', type=int,
+                            help='Only these songs (default: every song with a file).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes decoding files.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Waveforms saved per database write.')
+        parser.add_argument('--force', action='store_true',
+                            help='Compute again even if the stored peaks match the file (e.g. after changing WAVEFORM_BUCKETS).')
+
+    def handle(self, *args, **options):
+        if not waveforms_available():
+            self.stdout.write(self.style.ERROR(f"Waveforms need NumPy and ffmpeg ('{settings.FFMPEG_BINARY}')."))
+            return
+
+        songs = Song.objects.exclude(file='').exclude(file__isnull=True)
+        if options['song_ids']:
+            songs = songs.filter(pk__in=options['song_ids'])
+        stored = dict(SongWaveform.objects.values_list('song_id', 'source_version'))
+
+        work = []
+        missing = 0
+        for song_id, name in songs.values_list('pk', 'file').iterator():
+            path = default_storage.path(name)
+            version = file_version(path)
+            if version is None:
+                missing += 1
+            elif options['force'] or stored.get(song_id) != version:
+                work.append((song_id, path, version))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'Skipping {missing} songs whose file is missing on disk.'))
+        if not work:
+            self.stdout.write(self.style.SUCCESS('All waveforms are up to date.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Computing {len(work)} waveforms with {options["workers"]} processes...'))
+        connection.close() # Not shared with the forked workers
+        done = failed = 0
+        results = []
+        # Workers only decode and compute, the database is written from here in batches
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), initializer=django.setup) as pool:
+            futures = {pool.submit(compute_peaks, path): (song_id, path, version) for song_id, path, version in work}
+            for future in as_completed(futures):
+                song_id, path, version = futures[future]
+                try:
+                    peaks = future.result()
+                except Exception as e:
+                    peaks = None
+                    self.stdout.write(self.style.WARNING(f'Could not decode {path}: {e}'))
+                if not peaks:
+                    failed += 1
+                    continue
+                results.append((song_id, peaks, version))
+                if len(results) >= options['batch_size']:
+                    store_waveforms(results)
+                    done += len(results)
+                    results = []
+                    self.stdout.write(f'{done}/{len(work)} waveforms saved...')
+        if results:
+            store_waveforms(results)
+            done += len(results)
+
+        self.stdout.write(self.style.SUCCESS(f'Computed {done} waveforms ({failed} failed).'))
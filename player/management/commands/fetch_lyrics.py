@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from player.lyrics import NO_LYRICS, schedule_lyrics, wait_for_lyrics
+from player.models import LyricsCacheEntry, Song
+
+
+class Command(BaseCommand):
+    help = 'Looks up lyrics for songs that have none yet, using the concurrent lyrics pool and the lyrics cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Only look up this many songs.')
+        parser.add_argument('--retry-misses', action='store_true',
+                            help='Forget cached "no lyrics found" results first, so those songs are searched again.')
+
+    def handle(self, *args, **options):
+        if options['retry_misses']:
+            deleted, _ = LyricsCacheEntry.objects.filter(found=False).delete()
+            self.stdout.write(self.style.NOTICE(f'Forgot {deleted} cached lyrics misses.'))
+
+        songs = Song.objects.filter(NO_LYRICS).prefetch_related('artists').order_by('pk')
+        if options['limit']:
+            songs = songs[:options['limit']]
+        songs = list(songs)
+        if not songs:
+            self.stdout.write(self.style.SUCCESS('Every song already has lyrics.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Looking up lyrics for {len(songs)} songs...'))
+        for song in songs:
+            schedule_lyrics(song, [artist.name for artist in song.artists.all()])
+        wait_for_lyrics()
+
+        found = Song.objects.filter(pk__in=[song.pk for song in songs]).exclude(NO_LYRICS).count()
+        self.stdout.write(self.style.SUCCESS(f'Found lyrics for {found} of {len(songs)} songs.'))
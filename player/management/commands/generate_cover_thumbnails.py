@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from player.covers import generate_thumbnails, thumbnails_ready
+from player.models import Album, EP, Single
+
+
+class Command(BaseCommand):
+    help = 'Creates the WebP/JPEG cover thumbnails for covers stored before they were generated at ingest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.COVER_FETCH_WORKERS,
+                            help='Number of covers resized in parallel.')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate thumbnails that already exist (e.g. after changing sizes or quality).')
+        parser.add_argument('--fetch-missing', action='store_true',
+                            help='First download covers of releases that only have a cover URL.')
+
+    def handle(self, *args, **options):
+        if options['fetch_missing']:
+            from player.views import download_missing_covers # Sets up the Spotify client, only import when needed
+            logs = []
+            for model in (Album, EP, Single):
+                download_missing_covers(list(model.objects.filter(cover_image='').exclude(cover_image_url__isnull=True).exclude(cover_image_url='')), logs)
+            for log in logs:
+                self.stdout.write(log)
+
+        # Releases often share artwork (content-addressed covers), resize each file once
+        cover_paths = set()
+        for model in (Album, EP, Single):
+            cover_paths.update(model.objects.exclude(cover_image='').values_list('cover_image', flat=True))
+        if not options['force']:
+            cover_paths = {path for path in cover_paths if not thumbnails_ready(path)}
+        if not cover_paths:
+            self.stdout.write(self.style.SUCCESS('All cover thumbnails are up to date.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Creating thumbnails for {len(cover_paths)} covers...'))
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for path, ok in zip(cover_paths, pool.map(lambda p: generate_thumbnails(p, force=options['force']), cover_paths)):
+                if ok:
+                    created += 1
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'Could not create thumbnails for {path}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Created thumbnails for {created} covers ({failed} failed).'))
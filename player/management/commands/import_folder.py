@@ -0,0 +1,245 @@
+import itertools
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from player.ingest_writer import RELEASE_MODELS, parse_release_date, sync_m2m
+from player.media_tags import read_file_tags
+from player.models import Artist, MediaFileFingerprint, Song
+
+AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.mp4', '.aac', '.flac', '.ogg', '.oga', '.opus', '.wav', '.aiff', '.aif', '.wma', '.ape', '.wv'}
+UNKNOWN_ARTIST = 'Unknown Artist'
+
+
+def iter_audio_files(root):
+    """Yields the absolute paths of audio files under `root`, depth first, without listing the whole tree up front."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirectories = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                        yield entry.path
+                stack.extend(sorted(subdirectories, reverse=True)) # Visit in name order
+        except OSError as e:
+            print(f"Could not read directory {directory}: {e}")
+
+
+def _read_and_place(job):
+    """Worker: reads the tags of one file and links/copies it into MEDIA_ROOT.
+    Returns (source, media name, tags, size, mtime_ns, error)."""
+    source, name, mode = job
+    try:
+        tags = read_file_tags(source)
+        target = os.path.join(settings.MEDIA_ROOT, name)
+        if mode != 'reference' and not os.path.lexists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if mode == 'copy':
+                shutil.copy2(source, target)
+            else:
+                try:
+                    os.symlink(source, target)
+                except OSError:
+                    # Windows only allows symlinks with admin rights or Developer Mode: hard link, or else copy
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy2(source, target)
+        stat = os.stat(target)
+        return source, name, tags, stat.st_size, stat.st_mtime_ns, None
+    except Exception as e:
+        return source, name, None, None, None, str(e) or e.__class__.__name__
+
+
+def release_kind(album_tags):
+    """'album', 'ep' or 'single' for the tags of a release's files, from the MusicBrainz album type
+    or else the largest track count, since files of one album don't always carry the same tags."""
+    for tags in album_tags:
+        if tags['release_type'] in RELEASE_MODELS:
+            return tags['release_type']
+    total = max((tags['track_total'] or 0 for tags in album_tags), default=0)
+    if total and total <= 3:
+        return 'single'
+    if total and total <= 6:
+        return 'ep'
+    return 'album'
+
+
+def _key(value):
+    return ' '.join((value or '').casefold().split())
+
+
+class Command(BaseCommand):
+    help = ('Imports a folder of audio files into the library: reads their tags in worker processes and '
+            'creates the artists, albums/EPs/singles and songs in batches. Files already imported are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('folder', help='Folder to import, scanned recursively.')
+        parser.add_argument('--copy', action='store_true',
+                            help='Copy files from outside MEDIA_ROOT instead of symlinking them (copied anyway where symlinks and hard links fail).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes reading tags.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Files parsed and written per batch.')
+
+    def handle(self, *args, **options):
+        folder = os.path.realpath(options['folder'])
+        if not os.path.isdir(folder):
+            raise CommandError(f'Not a folder: {folder}')
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        inside_media = os.path.commonpath([folder, media_root]) == media_root
+        mode = 'reference' if inside_media else ('copy' if options['copy'] else 'symlink')
+        # Files outside MEDIA_ROOT show up under MEDIA_ROOT/imports/<folder name>/ with their relative paths
+        import_base = os.path.join(settings.IMPORT_DIR, os.path.basename(folder))
+
+        self.stdout.write(self.style.NOTICE('Loading the library index...'))
+        self.load_index()
+        self.counts = {'imported': 0, 'already': 0, 'errors': 0}
+
+        def jobs():
+            for path in iter_audio_files(folder):
+                if inside_media:
+                    name = os.path.relpath(path, media_root)
+                else:
+                    name = os.path.join(import_base, os.path.relpath(path, folder))
+                name = name.replace(os.sep, '/')
+                if name in self.known_files:
+                    self.counts['already'] += 1
+                    continue
+                yield path, name, mode
+
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+        batches = iter(lambda: list(itertools.islice(job_iter, batch_size)), [])
+        job_iter = jobs()
+        started = time.monotonic()
+        connection.close() # Not shared with the forked workers
+        self.stdout.write(self.style.NOTICE(f'Importing {folder} ({mode}) with {workers} processes...'))
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            chunksize = max(1, batch_size // (4 * workers))
+            pending = pool.map(_read_and_place, next(batches, []), chunksize=chunksize)
+            while True:
+                results = list(pending)
+                if not results:
+                    break
+                # The workers parse the next batch while this one is written
+                pending = pool.map(_read_and_place, next(batches, []), chunksize=chunksize)
+                self.write_batch(results)
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(f"{self.counts['imported']} imported, {self.counts['already']} already in the library, "
+                                  f"{self.counts['errors']} errors ({self.counts['imported'] * 60 / elapsed:.0f} files/min)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.counts['imported']} songs ({self.counts['already']} already imported, {self.counts['errors']} errors)."
+        ))
+
+    def load_index(self):
+        """Names -> ids of everything already in the library, so a batch needs no lookups."""
+        self.known_files = set(Song.objects.exclude(file='').values_list('file', flat=True))
+        self.artists = {}
+        for pk, name in Artist.objects.order_by('pk').values_list('pk', 'name'):
+            self.artists.setdefault(_key(name), pk) # First one wins for artists sharing a name
+        artist_keys = {pk: key for key, pk in self.artists.items()}
+        self.releases = {} # (kind, title key, artist key) -> pk, one entry per credited artist
+        for kind, model in RELEASE_MODELS.items():
+            titles = dict(model.objects.values_list('pk', 'title'))
+            owner_field = model.artists.field.m2m_field_name() + '_id'
+            for release_id, artist_id in model.artists.through.objects.order_by('pk').values_list(owner_field, 'artist_id'):
+                self.releases.setdefault((kind, _key(titles[release_id]), artist_keys.get(artist_id)), release_id)
+
+    def write_batch(self, results):
+        parsed = []
+        for source, name, tags, size, mtime_ns, error in results:
+            if error:
+                self.counts['errors'] += 1
+                self.stdout.write(self.style.ERROR(f'Could not import {source}: {error}'))
+                continue
+            if name in self.known_files:
+                continue # Listed twice, e.g. through a symlinked directory
+            self.known_files.add(name)
+            tags['title'] = tags['title'] or os.path.splitext(os.path.basename(source))[0]
+            tags['artists'] = tags['artists'] or [tags['album_artist'] or UNKNOWN_ARTIST]
+            tags['album_artist'] = tags['album_artist'] or tags['artists'][0]
+            parsed.append((name, tags, size, mtime_ns))
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            # --- Artists not seen before ---
+            new_artists = {}
+            for _, tags, _, _ in parsed:
+                for artist_name in tags['artists'] + [tags['album_artist']]:
+                    if _key(artist_name) not in self.artists:
+                        new_artists.setdefault(_key(artist_name), Artist(name=artist_name[:100]))
+            Artist.objects.bulk_create(list(new_artists.values()))
+            for key, artist in new_artists.items():
+                self.artists[key] = artist.pk
+
+            # --- Releases not seen before, one bulk insert per model ---
+            album_tags = {} # (title key, album artist key) -> tags of its files in this batch
+            for _, tags, _, _ in parsed:
+                if tags['album']:
+                    album_tags.setdefault((_key(tags['album']), _key(tags['album_artist'])), []).append(tags)
+            release_keys = {}
+            for (title, artist), tags_list in album_tags.items():
+                # A release created by an earlier batch keeps its kind
+                kind = next((kind for kind in RELEASE_MODELS if (kind, title, artist) in self.releases), None)
+                release_keys[(title, artist)] = (kind or release_kind(tags_list), title, artist)
+            new_releases = {}
+            for _, tags, _, _ in parsed:
+                if not tags['album']:
+                    continue
+                key = release_keys[(_key(tags['album']), _key(tags['album_artist']))]
+                if key not in self.releases and key not in new_releases:
+                    new_releases[key] = RELEASE_MODELS[key[0]](
+                        title=tags['album'][:100],
+                        release_date=parse_release_date((tags['date'] or '')[:10]),
+                    )
+            for kind, model in RELEASE_MODELS.items():
+                objects = {key: release for key, release in new_releases.items() if key[0] == kind}
+                model.objects.bulk_create(list(objects.values()))
+                for key, release in objects.items():
+                    self.releases[key] = release.pk
+                sync_m2m(model.artists, {release.pk: {self.artists[key[2]]} for key, release in objects.items()})
+
+            # --- Songs ---
+            songs = []
+            for name, tags, _, _ in parsed:
+                release_key = release_keys[(_key(tags['album']), _key(tags['album_artist']))] if tags['album'] else None
+                release_id = self.releases.get(release_key) if release_key else None
+                release_date = new_releases[release_key].release_date if release_key in new_releases else None
+                songs.append(Song(
+                    title=tags['title'][:100],
+                    file=name,
+                    duration=timedelta(seconds=tags['duration']) if tags['duration'] else None,
+                    track_number=tags['track_number'],
+                    disc_number=tags['disc_number'],
+                    isrc=tags['isrc'],
+                    bitrate=tags['bitrate'],
+                    release_date=release_date or parse_release_date((tags['date'] or '')[:10]),
+                    album_id=release_id if release_key and release_key[0] == 'album' else None,
+                    ep_id=release_id if release_key and release_key[0] == 'ep' else None,
+                    single_id=release_id if release_key and release_key[0] == 'single' else None,
+                ))
+            Song.objects.bulk_create(songs)
+            sync_m2m(Song.artists, {
+                song.pk: {self.artists[_key(artist_name)] for artist_name in tags['artists']}
+                for song, (_, tags, _, _) in zip(songs, parsed)
+            })
+
+            # rescan_media doesn't need to open these files again
+            MediaFileFingerprint.objects.bulk_create(
+                [MediaFileFingerprint(path=name, size=size, mtime_ns=mtime_ns) for name, _, size, mtime_ns in parsed],
+                update_conflicts=True, unique_fields=['path'], update_fields=['size', 'mtime_ns', 'scanned_at'],
+            )
+        self.counts['imported'] += len(songs)
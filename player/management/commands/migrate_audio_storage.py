@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from player.audio_store import is_stored, remove_empty_parents, store_file
+from player.models import DownloadedFile, MediaFileFingerprint, Song
+
+
+def _store(name):
+    """Thread pool job: (old name, new name or None, error or None). The old file is left in place."""
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(path):
+        return name, None, 'file not found'
+    try:
+        return name, store_file(path), None
+    except OSError as e:
+        return name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = ('Moves the audio files of existing songs into the content-addressed layout (AUDIO_STORAGE_DIR/ab/cd/<sha256>.<ext>). '
+            'Each file is stored before its songs are repointed and removed only afterwards, so playback keeps working '
+            'while this runs, and it can be interrupted and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Files stored and repointed per database transaction.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Files hashed and stored in parallel.')
+        parser.add_argument('--keep-old', action='store_true',
+                            help="Don't delete the old files after the songs are repointed.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the files that would be moved.')
+
+    def handle(self, *args, **options):
+        if not settings.AUDIO_CONTENT_ADDRESSED:
+            self.stdout.write(self.style.WARNING(
+                'AUDIO_CONTENT_ADDRESSED is off: existing files will be moved, but new downloads keep the spotdl layout.'
+            ))
+        names = [name for name in Song.objects.exclude(file='').exclude(file__isnull=True)
+                 .order_by('file').values_list('file', flat=True).distinct().iterator() if not is_stored(name)]
+        if not names:
+            self.stdout.write(self.style.SUCCESS('Every song file is already in content-addressed storage.'))
+            return
+        if options['dry_run']:
+            self.stdout.write(self.style.NOTICE(f'{len(names)} files would be moved.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Moving {len(names)} files with {options["workers"]} threads...'))
+        counts = {'moved': 0, 'deduplicated': 0, 'missing': 0, 'errors': 0, 'removed': 0}
+        batch_size = max(1, options['batch_size'])
+        stored = set()
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for start in range(0, len(names), batch_size):
+                moved = {}
+                for old_name, new_name, error in pool.map(_store, names[start:start + batch_size]):
+                    if error == 'file not found':
+                        counts['missing'] += 1
+                    elif error:
+                        counts['errors'] += 1
+                        self.stdout.write(self.style.ERROR(f'Could not store {old_name}: {error}'))
+                    else:
+                        moved[old_name] = new_name
+                if moved:
+                    self.repoint(moved)
+                    counts['moved'] += len(moved)
+                    counts['deduplicated'] += sum(1 for new_name in moved.values() if new_name in stored or stored.add(new_name))
+                    if not options['keep_old']:
+                        counts['removed'] += self.remove_old_files(moved)
+                self.stdout.write(f'{min(start + batch_size, len(names))}/{len(names)} files checked...')
+
+        self.stdout.write(self.style.SUCCESS('\nAudio storage migration finished.'))
+        self.stdout.write(f" - Moved: {counts['moved']} ({counts['deduplicated']} identical to another file)")
+        self.stdout.write(f" - Old files removed: {counts['removed']}")
+        self.stdout.write(f" - File not found: {counts['missing']}")
+        self.stdout.write(f" - Errors: {counts['errors']}")
+
+    def repoint(self, moved):
+        """Points the songs, download manifest and scan fingerprints at the stored files, in one transaction."""
+        with transaction.atomic():
+            songs = list(Song.objects.filter(file__in=list(moved)).only('pk', 'file'))
+            for song in songs:
+                song.file.name = moved[song.file.name]
+            Song.objects.bulk_update(songs, ['file'], batch_size=500)
+
+            downloads = list(DownloadedFile.objects.filter(path__in=list(moved)))
+            for download in downloads:
+                download.path = moved[download.path]
+            DownloadedFile.objects.bulk_update(downloads, ['path'], batch_size=500)
+
+            # Hard links keep the modification time, so rescan_media needn't read the files again
+            fingerprints = list(MediaFileFingerprint.objects.filter(path__in=list(moved)))
+            MediaFileFingerprint.objects.bulk_create(
+                [MediaFileFingerprint(path=moved[fingerprint.path], size=fingerprint.size, mtime_ns=fingerprint.mtime_ns)
+                 for fingerprint in fingerprints],
+                batch_size=500, update_conflicts=True, unique_fields=['path'], update_fields=['size', 'mtime_ns', 'scanned_at'],
+            )
+            MediaFileFingerprint.objects.filter(pk__in=[fingerprint.pk for fingerprint in fingerprints]).delete()
+
+    def remove_old_files(self, moved):
+        # A download linked in the meantime may point at an old path again, those files stay
+        still_used = set(Song.objects.filter(file__in=list(moved)).values_list('file', flat=True))
+        removed = 0
+        for old_name in moved:
+            if old_name in still_used:
+                continue
+            path = os.path.join(settings.MEDIA_ROOT, old_name)
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.stdout.write(self.style.WARNING(f'Could not remove {path}: {e}'))
+                continue
+            removed += 1
+            remove_empty_parents(path, settings.MEDIA_ROOT)
+        return removed
@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from player.media_tags import read_tags
+from player.models import MediaFileFingerprint, Song
+
+TAG_FIELDS = ['duration', 'track_number', 'disc_number', 'isrc', 'bitrate']
+
+
+def _read(path):
+    """read_tags for the pool: returns (tags, None) or (None, error message) instead of raising."""
+    try:
+        return read_tags(path), None
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+
+
+class Command(BaseCommand):
+    help = ('Reads duration, track/disc number, ISRC and bitrate from the audio files of songs in parallel '
+            'and stores them. Files whose size and modification time are unchanged since the last scan are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes reading tags.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Songs handled (and saved) per round.')
+        parser.add_argument('--force', action='store_true',
+                            help='Read every file again, even if unchanged since the last scan.')
+
+    def handle(self, *args, **options):
+        songs = Song.objects.exclude(file='').exclude(file__isnull=True).order_by('pk')
+        total = songs.count()
+        if not total:
+            self.stdout.write(self.style.WARNING('No songs with associated files found.'))
+            return
+        self.stdout.write(self.style.NOTICE(f'Checking {total} songs with {options["workers"]} processes...'))
+
+        counts = {'updated': 0, 'unchanged': 0, 'skipped': 0, 'missing': 0, 'errors': 0}
+        chunk_size = max(1, options['chunk_size'])
+        self.workers = max(1, options['workers'])
+        connection.close() # Not shared with the forked workers
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as pool:
+            last_pk = 0
+            checked = 0
+            while True:
+                # Keyset pagination, stays fast however far into the table we are
+                chunk = list(songs.filter(pk__gt=last_pk).only('pk', 'title', 'file', *TAG_FIELDS)[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                self.rescan_chunk(chunk, pool, options['force'], counts)
+                checked += len(chunk)
+                self.stdout.write(f'Checked {checked}/{total} songs...')
+
+        self.stdout.write(self.style.SUCCESS('\nMedia rescan finished.'))
+        self.stdout.write(f" - Updated: {counts['updated']}")
+        self.stdout.write(f" - Read, nothing changed: {counts['unchanged']}")
+        self.stdout.write(f" - Skipped, file unchanged since last scan: {counts['skipped']}")
+        self.stdout.write(f" - File not found: {counts['missing']}")
+        self.stdout.write(f" - Errors reading tags: {counts['errors']}")
+
+    def rescan_chunk(self, chunk, pool, force, counts):
+        songs_by_path = {}
+        for song in chunk:
+            songs_by_path.setdefault(song.file.name, []).append(song) # The same file can back several songs
+        fingerprints = {} if force else {
+            fingerprint.path: (fingerprint.size, fingerprint.mtime_ns)
+            for fingerprint in MediaFileFingerprint.objects.filter(path__in=songs_by_path)
+        }
+
+        to_read = [] # (relative path, absolute path, size, mtime_ns)
+        for name, path_songs in songs_by_path.items():
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                counts['missing'] += len(path_songs)
+                self.stdout.write(self.style.ERROR(f'File not found for Song ID {path_songs[0].id} ("{path_songs[0].title}") at path: {path}'))
+                continue
+            # The fingerprint is per file, a song linked to it later (shared download, import_folder, a dedupe
+            # in migrate_audio_storage) still needs a read. Bitrate comes only from the file, so it marks scanned songs
+            if fingerprints.get(name) == (stat.st_size, stat.st_mtime_ns) and all(song.bitrate is not None for song in path_songs):
+                counts['skipped'] += len(path_songs)
+                continue
+            to_read.append((name, path, stat.st_size, stat.st_mtime_ns))
+        if not to_read:
+            return
+
+        changed_songs = []
+        scanned = []
+        # A few large map chunks per worker instead of one round trip per file
+        results = pool.map(_read, [path for _, path, _, _ in to_read], chunksize=max(1, len(to_read) // (4 * self.workers)))
+        for (name, path, size, mtime_ns), (tags, error) in zip(to_read, results):
+            if error:
+                counts['errors'] += len(songs_by_path[name])
+                self.stdout.write(self.style.ERROR(f'Could not read tags of {path}: {error}'))
+                continue
+            scanned.append(MediaFileFingerprint(path=name, size=size, mtime_ns=mtime_ns))
+            values = dict(tags, duration=timedelta(seconds=tags['duration']) if tags['duration'] else None)
+            for song in songs_by_path[name]:
+                changed = False
+                for field in TAG_FIELDS:
+                    # A tag missing from the file keeps what the song already has (e.g. from Spotify)
+                    if values[field] is not None and getattr(song, field) != values[field]:
+                        setattr(song, field, values[field])
+                        changed = True
+                if changed:
+                    changed_songs.append(song)
+                    counts['updated'] += 1
+                else:
+                    counts['unchanged'] += 1
+
+        with transaction.atomic():
+            if changed_songs:
+                Song.objects.bulk_update(changed_songs, TAG_FIELDS, batch_size=500)
+            MediaFileFingerprint.objects.bulk_create(
+                scanned, batch_size=500, update_conflicts=True,
+                unique_fields=['path'], update_fields=['size', 'mtime_ns', 'scanned_at'],
+            )
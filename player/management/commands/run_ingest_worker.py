@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from player.ingest import run_worker_pool
+
+
+class Command(BaseCommand):
+    help = 'Runs a pool of workers that process queued Spotify ingest jobs (run as many of these as needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.INGEST_WORKER_CONCURRENCY,
+                            help='Number of jobs processed in parallel by this process.')
+        parser.add_argument('--poll-interval', type=float, default=settings.INGEST_POLL_INTERVAL,
+                            help='Seconds to wait between checks when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever.')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(self.style.NOTICE(f'Starting {concurrency} ingest worker(s)...'))
+        run_worker_pool(concurrency, poll_interval=options['poll_interval'], exit_when_idle=options['once'])
+        self.stdout.write(self.style.SUCCESS('Ingest workers stopped.'))
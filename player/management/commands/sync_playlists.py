@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from player.models import Playlist
+
+
+class Command(BaseCommand):
+    help = 'Resyncs imported Spotify playlists that changed upstream (run it on a schedule, e.g. cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('playlist_ids', nargs='*',
+                            help='Spotify ids of the playlists to sync (default: every imported playlist).')
+        parser.add_argument('--force', action='store_true',
+                            help='Resync even if the Spotify snapshot_id is unchanged.')
+
+    def handle(self, *args, **options):
+        from player.views import sync_spotify_playlist # Sets up the Spotify client, only import when needed
+
+        playlists = Playlist.objects.exclude(spotify_id__isnull=True).exclude(spotify_id='').select_related('user')
+        if options['playlist_ids']:
+            playlists = playlists.filter(spotify_id__in=options['playlist_ids'])
+
+        changed = unchanged = 0
+        for playlist in playlists:
+            was_changed, logs = sync_spotify_playlist(playlist, force=options['force'])
+            if was_changed:
+                changed += 1
+                self.stdout.write(self.style.NOTICE(f"Synced '{playlist.name}':"))
+                for log in logs:
+                    self.stdout.write(f"  {log}")
+            else:
+                unchanged += 1
+                self.stdout.write(logs[-1] if logs else f"Skipped '{playlist.name}'.")
+
+        self.stdout.write(self.style.SUCCESS(f'{changed} playlists synced, {unchanged} unchanged or skipped.'))
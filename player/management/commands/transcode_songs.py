@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from player.models import Song
+from player.transcode import CODECS, QUALITIES, evict, ffmpeg_available, transcode, variant_path
+
+
+class Command(BaseCommand):
+    help = 'Encodes the low/medium/high Opus/AAC variants of songs ahead of time, then trims the variant cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('song_ids', nargs='*', type=int,
+                            help='Only these songs (default: every song with a file).')
+        parser.add_argument('--codec', action='append', choices=sorted(CODECS),
+                            help=f'Codec to encode, can be repeated (default: {settings.TRANSCODE_DEFAULT_CODEC}).')
+        parser.add_argument('--quality', action='append', choices=QUALITIES,
+                            help='Quality to encode, can be repeated (default: all of them).')
+        parser.add_argument('--workers', type=int, default=settings.TRANSCODE_WORKERS,
+                            help='Number of ffmpeg processes run at the same time.')
+        parser.add_argument('--force', action='store_true',
+                            help='Encode again even if the variant exists (e.g. after changing the ladder).')
+        parser.add_argument('--evict-only', action='store_true',
+                            help='Only delete least recently used variants until the cache fits its size limit.')
+
+    def handle(self, *args, **options):
+        if options['evict_only']:
+            removed, freed = evict()
+            self.stdout.write(self.style.SUCCESS(f'Removed {removed} variants ({freed / 1024 / 1024:.1f} MB).'))
+            return
+        if not ffmpeg_available():
+            self.stdout.write(self.style.ERROR(f"ffmpeg not found ('{settings.FFMPEG_BINARY}'), set FFMPEG_BINARY."))
+            return
+
+        codecs = options['codec'] or [settings.TRANSCODE_DEFAULT_CODEC]
+        qualities = options['quality'] or list(QUALITIES)
+        songs = Song.objects.exclude(file='').exclude(file__isnull=True).order_by('pk')
+        if options['song_ids']:
+            songs = songs.filter(pk__in=options['song_ids'])
+
+        work = []
+        missing_sources = 0
+        for song in songs.iterator():
+            if not os.path.exists(song.file.path):
+                missing_sources += 1
+                continue
+            for codec in codecs:
+                for quality in qualities:
+                    if options['force'] or not os.path.exists(variant_path(song, codec, quality)):
+                        work.append((song, codec, quality))
+        if missing_sources:
+            self.stdout.write(self.style.WARNING(f'Skipping {missing_sources} songs whose file is missing on disk.'))
+        if not work:
+            self.stdout.write(self.style.SUCCESS('All requested variants exist already.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Encoding {len(work)} variants with {options["workers"]} workers...'))
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            results = pool.map(lambda item: transcode(*item, force=options['force']), work)
+            for (song, codec, quality), path in zip(work, results):
+                if path:
+                    done += 1
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"Could not encode '{song.title}' ({song.pk}) as {codec}/{quality}"))
+
+        self.stdout.write(self.style.SUCCESS(f'Encoded {done} variants ({failed} failed).'))
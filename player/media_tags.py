@@ -0,0 +1,86 @@
+"""Reading tags and stream info from audio files with mutagen.
+
+read_tags and read_file_tags only need a path and return plain values, so
+they can run in worker processes (manage.py rescan_media, import_folder);
+everything that touches the database stays in the parent.
+"""
+import mutagen
+from mutagen.easymp4 import EasyMP4Tags
+
+# spotdl writes the ISRC into M4A files as an iTunes freeform atom, which easy mode doesn't map by default
+if 'isrc' not in EasyMP4Tags.Get:
+    EasyMP4Tags.RegisterFreeformKey('isrc', 'ISRC')
+
+
+def _first(tags, key):
+    values = tags.get(key) if tags else None
+    if not values:
+        return None
+    value = str(values[0]).strip()
+    return value or None
+
+
+def _number(value):
+    """'3/12' or '3' -> 3, anything else -> None."""
+    if not value:
+        return None
+    try:
+        number = int(value.split('/')[0].strip())
+    except (ValueError, TypeError):
+        return None
+    return number if number > 0 else None
+
+
+def _open(path):
+    audio = mutagen.File(path, easy=True)
+    if audio is None:
+        raise mutagen.MutagenError(f"Unsupported audio format: {path}")
+    return audio
+
+
+def read_tags(path, audio=None):
+    """Returns {'duration' (seconds), 'bitrate' (kbps), 'track_number', 'disc_number', 'isrc'} for the
+    file at `path`, with None for anything the file doesn't have. Raises mutagen.MutagenError or OSError."""
+    audio = audio or _open(path)
+    info = audio.info
+    isrc = _first(audio.tags, 'isrc')
+    return {
+        'duration': round(info.length, 3) if getattr(info, 'length', None) else None,
+        'bitrate': round(info.bitrate / 1000) if getattr(info, 'bitrate', None) else None,
+        'track_number': _number(_first(audio.tags, 'tracknumber')),
+        'disc_number': _number(_first(audio.tags, 'discnumber')),
+        'isrc': isrc.upper().replace('-', '')[:12] if isrc else None,
+    }
+
+
+def _split_artists(values):
+    names = []
+    for value in values or []:
+        for name in str(value).split(';'): # Vorbis/ID3 multi-value tags, or "A; B" in one value
+            name = name.strip()
+            if name and name not in names:
+                names.append(name)
+    return names
+
+
+def read_file_tags(path):
+    """read_tags plus what's needed to file a song into the library: 'title', 'artists' (list),
+    'album', 'album_artist', 'date', 'track_total' and 'release_type' (MusicBrainz album type)."""
+    audio = _open(path)
+    tags = audio.tags or {}
+    values = read_tags(path, audio)
+    track_total = _number(_first(tags, 'tracktotal') or _first(tags, 'totaltracks'))
+    track_tag = _first(tags, 'tracknumber')
+    if not track_total and track_tag and '/' in track_tag:
+        track_total = _number(track_tag.split('/', 1)[1])
+    artists = _split_artists(tags.get('artist'))
+    values.update({
+        'title': _first(tags, 'title'),
+        'artists': artists,
+        'album': _first(tags, 'album'),
+        'album_artist': (_split_artists(tags.get('albumartist')) or artists or [None])[0],
+        'date': _first(tags, 'date') or _first(tags, 'originaldate'),
+        'track_total': track_total,
+        'release_type': (_first(tags, 'musicbrainz_albumtype') or _first(tags, 'releasetype') or '').lower() or None,
+    })
+    return values
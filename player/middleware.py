@@ -0,0 +1,54 @@
+"""Strong ETags for HTML pages and JSON responses, and client hints on pages.
+
+Every page and JSON response gets an ETag hashed from its body and
+`Cache-Control: private, no-cache`, so the browser keeps a copy and revalidates
+it with If-None-Match; an unchanged page (loadContent navigation, queue polls)
+then costs a bodyless 304 instead of the full response.
+
+Django's ConditionalGetMiddleware can't be used as is: `{% csrf_token %}` is
+masked differently on every render, so no two pages would hash the same. The
+token value is left out of the hash and the CSRF secret it unmasks to is
+hashed instead, which keeps a cached page's token valid whenever it's reused.
+
+Pages also ask for the ECT and Save-Data client hints (Accept-CH), which the
+stream endpoint uses to pick a transcoded variant (player/transcode.py).
+"""
+import hashlib
+import re
+
+from django.utils.cache import get_conditional_response
+
+from .transcode import advertise_client_hints
+
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+ETAG_CONTENT_TYPES = ('text/html', 'application/json')
+
+
+class ConditionalContentMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.streaming:
+            return response
+        if response.has_header('ETag') or not response.get('Content-Type', '').startswith(ETAG_CONTENT_TYPES):
+            return response
+
+        digest = hashlib.sha256(CSRF_INPUT_RE.sub(rb'\1\2', response.content))
+        digest.update(request.META.get('CSRF_COOKIE', '').encode())
+        response['ETag'] = f'"{digest.hexdigest()[:32]}"'
+        if not response.has_header('Cache-Control'):
+            response['Cache-Control'] = 'private, no-cache' # Per user, always revalidated
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+class ClientHintsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.get('Content-Type', '').startswith('text/html'):
+            advertise_client_hints(response)
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+def seed_manifest_from_songs(apps, schema_editor):
+    """Existing downloads are already linked to songs, so index them without scanning the disk."""
+    Song = apps.get_model('player', 'Song')
+    DownloadedFile = apps.get_model('player', 'DownloadedFile')
+    entries = [
+        DownloadedFile(spotify_id=spotify_id, path=path)
+        for spotify_id, path in Song.objects.exclude(spotify_id__isnull=True).exclude(file='').values_list('spotify_id', 'file')
+    ]
+    DownloadedFile.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0007_ingestjob_ingestjobtrack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=50, unique=True)),
+                ('path', models.CharField(help_text='Path relative to MEDIA_ROOT', max_length=500)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('downloaded_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Downloaded Files',
+            },
+        ),
+        migrations.RunPython(seed_manifest_from_songs, migrations.RunPython.noop),
+    ]
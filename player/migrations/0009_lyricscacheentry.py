@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0008_downloadedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LyricsCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lookup_key', models.CharField(help_text='sha256 of the normalized title and artists', max_length=64, unique=True)),
+                ('title', models.CharField(max_length=255)),
+                ('artists', models.CharField(max_length=500)),
+                ('lyrics', models.TextField(blank=True, null=True)),
+                ('synced_lyrics', models.TextField(blank=True, null=True)),
+                ('found', models.BooleanField(default=False)),
+                ('checked_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Lyrics Cache Entries',
+            },
+        ),
+    ]
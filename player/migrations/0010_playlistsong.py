@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 18:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Turns the auto-created Playlist.songs table into the PlaylistSong model without copying rows:
+    the model takes over the existing table (state only), then gets its position column."""
+
+    dependencies = [
+        ('player', '0009_lyricscacheentry'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PlaylistSong',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='player.playlist')),
+                        ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='player.song')),
+                    ],
+                    options={
+                        'verbose_name_plural': 'Playlist Songs',
+                        'db_table': 'player_playlist_songs',
+                        'ordering': ['position'],
+                        'unique_together': {('playlist', 'song')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='playlist',
+                    name='songs',
+                    field=models.ManyToManyField(blank=True, related_name='playlists', through='player.PlaylistSong', to='player.song'),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name='playlistsong',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
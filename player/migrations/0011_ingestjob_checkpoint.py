@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0010_playlistsong'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='checkpoint_offset',
+            field=models.PositiveIntegerField(default=0, help_text='Playlist offset up to which every page is committed, a resumed run starts here.'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0011_ingestjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='last_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='snapshot_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
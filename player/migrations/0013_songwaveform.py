@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 18:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0012_playlist_snapshot_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peaks', models.BinaryField(help_text='int8 min/max pairs, one pair per bucket')),
+                ('buckets', models.PositiveIntegerField()),
+                ('source_version', models.CharField(help_text='Version of the audio file the peaks were computed from', max_length=32)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='waveform', to='player.song')),
+            ],
+            options={
+                'verbose_name_plural': 'Song Waveforms',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0013_songwaveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='loudness_lufs',
+            field=models.FloatField(blank=True, help_text='Integrated loudness (EBU R128)', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='loudness_peak',
+            field=models.FloatField(blank=True, help_text='Linear sample peak, 1.0 = full scale', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='loudness_version',
+            field=models.CharField(blank=True, default='', help_text='Version of the file the loudness was measured on', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='replay_gain',
+            field=models.FloatField(blank=True, help_text='Gain in dB to reach LOUDNESS_TARGET_LUFS', null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0014_song_loudness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFileFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Media File Fingerprints',
+            },
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, help_text='Audio bitrate of the file in kbps', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='disc_number',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='isrc',
+            field=models.CharField(blank=True, max_length=12, null=True),
+        ),
+    ]
@@ -78,10 +78,18 @@ class Song(models.Model):
     track_number = models.PositiveIntegerField(null=True, blank=True, help_text="Track number within the release")
     # --- MODIFICATION END ---
     duration = models.DurationField(null=True, blank=True) # Allow null
+    disc_number = models.PositiveIntegerField(null=True, blank=True) # From the file tags (manage.py rescan_media)
+    isrc = models.CharField(max_length=12, blank=True, null=True) # From the file tags
+    bitrate = models.PositiveIntegerField(null=True, blank=True, help_text="Audio bitrate of the file in kbps")
     file = models.FileField(upload_to='songs/', max_length=500) # Increased max_length
     lyrics = models.TextField(blank=True, null=True)
     release_date = models.DateField(null=True, blank=True) # Allow null
     synced_lyrics = models.TextField(blank=True, null=True)
+    # Loudness normalization (manage.py analyze_loudness, see player/loudness.py)
+    loudness_lufs = models.FloatField(null=True, blank=True, help_text="Integrated loudness (EBU R128)")
+    loudness_peak = models.FloatField(null=True, blank=True, help_text="Linear sample peak, 1.0 = full scale")
+    replay_gain = models.FloatField(null=True, blank=True, help_text="Gain in dB to reach LOUDNESS_TARGET_LUFS")
+    loudness_version = models.CharField(max_length=32, blank=True, default='', help_text="Version of the file the loudness was measured on")
 
     def get_release(self):
         # Helper to get the associated Album, EP, or Single
@@ -108,8 +116,10 @@ class Playlist(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     cover_image = models.ImageField(upload_to='playlists/', blank=True, null=True)
-    songs = models.ManyToManyField('Song', related_name='playlists', blank=True) # Allow blank
+    songs = models.ManyToManyField('Song', through='PlaylistSong', related_name='playlists', blank=True) # Allow blank, ordered by PlaylistSong.position
     spotify_id = models.CharField(max_length=50, unique=True, null=True, blank=True) # Optional: Added
+    snapshot_id = models.CharField(max_length=100, blank=True, null=True) # Spotify version of the last complete sync
+    last_synced_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -117,6 +127,21 @@ class Playlist(models.Model):
     class Meta:
         verbose_name_plural = "Playlists"
 
+class PlaylistSong(models.Model):
+    """Membership of a song in a playlist, with its position (the former auto-created M2M table)."""
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0) # Index in the Spotify playlist, first one wins for duplicates
+
+    def __str__(self):
+        return f"{self.playlist} #{self.position}: {self.song}"
+
+    class Meta:
+        db_table = 'player_playlist_songs' # Keeps the rows of the old auto-created table
+        unique_together = ('playlist', 'song')
+        ordering = ['position']
+        verbose_name_plural = "Playlist Songs"
+
 class Library(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='library')
     artists = models.ManyToManyField(Artist, related_name='libraries', blank=True)
@@ -162,6 +187,149 @@ class QueueItem(models.Model):
         return f"Order {self.order}: {self.song.title} in {self.queue}"
 
 
+class DownloadedFile(models.Model):
+    """Index of downloaded audio by Spotify track id, so a track's file is found without scanning SPOTDL_DOWNLOAD_PATH."""
+    spotify_id = models.CharField(max_length=50, unique=True)
+    path = models.CharField(max_length=500, help_text="Path relative to MEDIA_ROOT")
+    size = models.PositiveBigIntegerField(default=0)
+    downloaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.spotify_id} -> {self.path}"
+
+    class Meta:
+        verbose_name_plural = "Downloaded Files"
+
+class LyricsCacheEntry(models.Model):
+    """Outcome of a lyrics lookup by normalized title and artists, hits and misses alike (see player/lyrics.py)."""
+    lookup_key = models.CharField(max_length=64, unique=True, help_text="sha256 of the normalized title and artists")
+    title = models.CharField(max_length=255) # Normalized, for reference
+    artists = models.CharField(max_length=500) # Normalized and sorted, for reference
+    lyrics = models.TextField(blank=True, null=True)
+    synced_lyrics = models.TextField(blank=True, null=True)
+    found = models.BooleanField(default=False)
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.title} - {self.artists} ({'found' if self.found else 'not found'})"
+
+    class Meta:
+        verbose_name_plural = "Lyrics Cache Entries"
+
+class MediaFileFingerprint(models.Model):
+    """Size and modification time of a media file when its tags were last read, so unchanged files are skipped."""
+    path = models.CharField(max_length=500, unique=True) # Relative to MEDIA_ROOT, like Song.file
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.size} bytes)"
+
+    class Meta:
+        verbose_name_plural = "Media File Fingerprints"
+
+class SongWaveform(models.Model):
+    """Downsampled min/max peaks of a song's audio for the seek bar (see player/waveform.py)."""
+    song = models.OneToOneField(Song, related_name='waveform', on_delete=models.CASCADE)
+    peaks = models.BinaryField(help_text="int8 min/max pairs, one pair per bucket")
+    buckets = models.PositiveIntegerField()
+    source_version = models.CharField(max_length=32, help_text="Version of the audio file the peaks were computed from")
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Waveform of song {self.song_id} ({self.buckets} buckets)"
+
+    class Meta:
+        verbose_name_plural = "Song Waveforms"
+
+class IngestJob(models.Model):
+    """A Spotify URL queued for ingest, processed by `manage.py run_ingest_worker`."""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ingest_jobs')
+    spotify_url = models.URLField(max_length=500)
+    content_type = models.CharField(max_length=20) # track, album, playlist or artist
+    spotify_id = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    worker_id = models.CharField(max_length=100, blank=True, null=True, help_text="Worker that claimed this job.")
+    total_tracks = models.PositiveIntegerField(default=0)
+    completed_tracks = models.PositiveIntegerField(default=0)
+    failed_tracks = models.PositiveIntegerField(default=0)
+    checkpoint_offset = models.PositiveIntegerField(default=0, help_text="Playlist offset up to which every page is committed, a resumed run starts here.")
+    attempts = models.PositiveIntegerField(default=0) # Times a worker claimed this job
+    log = models.TextField(blank=True, default='') # Processing log lines, newline separated
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.content_type} {self.spotify_id} ({self.status})"
+
+    @property
+    def processed_tracks(self):
+        return self.completed_tracks + self.failed_tracks
+
+    def percent_done(self):
+        if self.status == self.STATUS_DONE:
+            return 100.0
+        if not self.total_tracks:
+            return 0.0
+        return round(min(self.processed_tracks, self.total_tracks) * 100.0 / self.total_tracks, 1)
+
+    def eta_seconds(self):
+        """Estimates remaining seconds from the average time per processed track, or None if unknown."""
+        if self.status != self.STATUS_RUNNING or not self.started_at or not self.processed_tracks:
+            return None
+        remaining = max(self.total_tracks - self.processed_tracks, 0)
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        return round(elapsed / self.processed_tracks * remaining)
+
+    class Meta:
+        verbose_name_plural = "Ingest Jobs"
+        ordering = ['-created_at']
+
+class IngestJobTrack(models.Model):
+    """Per-track state of an IngestJob."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    job = models.ForeignKey(IngestJob, on_delete=models.CASCADE, related_name='tracks')
+    spotify_id = models.CharField(max_length=50)
+    title = models.CharField(max_length=200, blank=True, default='')
+    position = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    message = models.TextField(blank=True, default='')
+    song = models.ForeignKey(Song, on_delete=models.SET_NULL, null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.title or self.spotify_id} ({self.status}) in job {self.job_id}"
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ('job', 'spotify_id') # A track is processed once per job
+
 # Signal to create Library and Queue for new User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -0,0 +1,210 @@
+"""Rate-limit-aware Spotify client shared by the web and ingest workers.
+
+Every API call takes a token from a token bucket first. With REDIS_URL set the
+bucket lives in Redis, so all worker processes share one request budget; without
+it (or if Redis is unreachable) each process uses an in-memory bucket.
+A 429 response pauses every client sharing the bucket for the Retry-After time,
+and identical GET requests that are in flight at the same time are sent once.
+"""
+import copy
+import threading
+import time
+
+import spotipy
+from django.conf import settings
+
+try:
+    import redis
+except ImportError: # Redis is optional, the local bucket is used without it
+    redis = None
+
+
+class LocalRateLimiter:
+    """In-process token bucket."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns 0, or returns the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if self._blocked_until > now:
+                return self._blocked_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def block_for(self, seconds):
+        """Pauses all callers for `seconds` (after a 429)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+# KEYS: bucket hash, block key. ARGV: rate per second, capacity.
+# Returns 0 when a token was taken, otherwise the milliseconds to wait.
+# Uses the Redis clock so workers on different hosts agree on time.
+TOKEN_BUCKET_SCRIPT = """
+local blocked = redis.call('PTTL', KEYS[2])
+if blocked > 0 then return blocked end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RedisRateLimiter:
+    """Token bucket shared by every process that uses the same Redis key prefix."""
+
+    def __init__(self, client, rate, capacity, key_prefix='spotify:ratelimit'):
+        self.client = client
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.bucket_key = f"{key_prefix}:bucket"
+        self.block_key = f"{key_prefix}:blocked"
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._fallback = LocalRateLimiter(rate, capacity)
+
+    def acquire(self):
+        while True:
+            try:
+                wait_ms = int(self._script(keys=[self.bucket_key, self.block_key], args=[self.rate, self.capacity]))
+            except redis.RedisError as e:
+                print(f"Redis rate limiter unavailable ({e}), using the local bucket for this call.")
+                self._fallback.acquire()
+                return
+            if not wait_ms:
+                return
+            time.sleep(wait_ms / 1000)
+
+    def block_for(self, seconds):
+        self._fallback.block_for(seconds)
+        try:
+            # Only ever extend an existing block
+            if self.client.pttl(self.block_key) < seconds * 1000:
+                self.client.set(self.block_key, '1', px=max(1, int(seconds * 1000)))
+        except redis.RedisError as e:
+            print(f"Could not share Spotify backoff through Redis: {e}")
+
+
+def get_rate_limiter():
+    """Redis-backed limiter when REDIS_URL is configured and reachable, local one otherwise."""
+    rate, capacity = settings.SPOTIFY_RATE_LIMIT, settings.SPOTIFY_RATE_BURST
+    if settings.REDIS_URL and redis is not None:
+        try:
+            client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=5)
+            client.ping()
+            return RedisRateLimiter(client, rate, capacity)
+        except redis.RedisError as e:
+            print(f"WARNING: Could not connect to Redis at {settings.REDIS_URL} ({e}). Using a per-process Spotify rate limit.")
+    return LocalRateLimiter(rate, capacity)
+
+
+class _InflightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class RateLimitedSpotify(spotipy.Spotify):
+    """spotipy.Spotify with a shared token bucket, Retry-After backoff and GET coalescing."""
+
+    def __init__(self, *args, rate_limiter=None, max_rate_limit_retries=None, **kwargs):
+        # 429s are handled below (shared backoff), so keep them out of urllib3's retry loop
+        kwargs.setdefault('status_forcelist', (500, 502, 503, 504))
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter or LocalRateLimiter(settings.SPOTIFY_RATE_LIMIT, settings.SPOTIFY_RATE_BURST)
+        self.max_rate_limit_retries = settings.SPOTIFY_MAX_RETRIES if max_rate_limit_retries is None else max_rate_limit_retries
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _internal_call(self, method, url, payload, params):
+        if method != 'GET':
+            return self._call_with_backoff(method, url, payload, params)
+
+        key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._inflight[key] = _InflightCall()
+            else:
+                call.waiters += 1
+
+        if not is_leader:
+            # Same request already on the wire from another thread, share its response
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = self._call_with_backoff(method, url, payload, params)
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+                if call.waiters and call.error is None:
+                    # Waiters copy from a snapshot, the caller is free to mutate its own result
+                    call.result = copy.deepcopy(result)
+            call.done.set()
+
+    def _call_with_backoff(self, method, url, payload, params):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                # spotipy mutates params (content_type), give each attempt its own copy
+                return super()._internal_call(method, url, payload, dict(params or {}))
+            except spotipy.SpotifyException as e:
+                if e.http_status != 429 or attempt >= self.max_rate_limit_retries:
+                    raise
+                retry_after = self._retry_after_seconds(e, attempt)
+                if retry_after > settings.SPOTIFY_MAX_RETRY_AFTER:
+                    raise # Rather fail the track loudly than park every worker for hours
+                attempt += 1
+                print(f"Spotify rate limit hit on {url}, backing off {retry_after:.1f}s (attempt {attempt}/{self.max_rate_limit_retries})")
+                self.rate_limiter.block_for(retry_after)
+
+    @staticmethod
+    def _retry_after_seconds(error, attempt):
+        headers = getattr(error, 'headers', None) or {}
+        try:
+            return max(float(headers.get('Retry-After')), 0.5)
+        except (TypeError, ValueError):
+            return min(2 ** attempt, 30) # No header, exponential backoff
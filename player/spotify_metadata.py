@@ -0,0 +1,144 @@
+"""Batched, cached access to Spotify track and album metadata.
+
+Responses are kept in the 'spotify' cache (see CACHES in settings: Redis when
+REDIS_URL is set, otherwise files on disk), so re-ingesting or resyncing content
+mostly skips the API. Payloads that come embedded in other responses (album
+tracks, playlist items) are stored too, so a track already seen in an album or
+playlist is never fetched on its own.
+
+Django's FileBasedCache lists its whole directory on every write to decide
+whether to cull; with one file per track that is a scan of up to MAX_ENTRIES
+files per cached payload. SpotifyFileCache culls at most once every
+SPOTIFY_CACHE_CULL_INTERVAL seconds per process instead.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+TRACKS_PER_REQUEST = 50 # Limit of GET /tracks
+ALBUMS_PER_REQUEST = 20 # Limit of GET /albums
+ARTIST_ALBUMS_PER_PAGE = 50 # Limit of GET /artists/{id}/albums
+
+
+class SpotifyFileCache(FileBasedCache):
+    """FileBasedCache that doesn't scan its directory on every write, see the module docstring.
+    The cache may briefly go over MAX_ENTRIES between culls."""
+    _last_cull = {} # Cache directory -> time.monotonic() of the last cull in this process
+    _cull_lock = threading.Lock()
+
+    def _cull(self):
+        now = time.monotonic()
+        with self._cull_lock:
+            last = self._last_cull.get(self._dir)
+            if last is not None and now - last < settings.SPOTIFY_CACHE_CULL_INTERVAL:
+                return
+            self._last_cull[self._dir] = now
+        super()._cull()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SpotifyMetadata:
+    """Looks up track/album payloads through the cache first, then the multi-get endpoints."""
+
+    def __init__(self, client, cache_alias='spotify'):
+        self.client = client
+        self.cache = caches[cache_alias]
+        self.ttl = settings.SPOTIFY_CACHE_TTL
+
+    # --- Cache helpers ---
+    def _get_cached(self, kind, ids):
+        found = self.cache.get_many([f"{kind}:{item_id}" for item_id in ids])
+        return {key.split(':', 1)[1]: payload for key, payload in found.items()}
+
+    def _store(self, kind, payloads):
+        self.cache.set_many({f"{kind}:{p['id']}": p for p in payloads if p and p.get('id')}, timeout=self.ttl)
+
+    def prime_tracks(self, track_payloads):
+        """Stores full track payloads fetched elsewhere (e.g. playlist items)."""
+        self._store('track', track_payloads)
+
+    # --- Tracks ---
+    def tracks(self, track_ids):
+        """Returns {track_id: payload} for the given ids, fetching missing ones 50 at a time."""
+        track_ids = list(dict.fromkeys(track_ids))
+        results = self._get_cached('track', track_ids)
+        missing = [track_id for track_id in track_ids if track_id not in results]
+        for chunk in _chunks(missing, TRACKS_PER_REQUEST):
+            response = self.client.tracks(chunk)
+            fetched = [t for t in (response or {}).get('tracks', []) if t]
+            self._store('track', fetched)
+            results.update({t['id']: t for t in fetched})
+        return results
+
+    def track(self, track_id):
+        return self.tracks([track_id]).get(track_id)
+
+    # --- Albums ---
+    def albums(self, album_ids):
+        """Returns {album_id: payload} with the complete track list, fetching missing ones 20 at a time."""
+        album_ids = list(dict.fromkeys(album_ids))
+        results = self._get_cached('album', album_ids)
+        missing = [album_id for album_id in album_ids if album_id not in results]
+        for chunk in _chunks(missing, ALBUMS_PER_REQUEST):
+            response = self.client.albums(chunk)
+            fetched = [self._complete_album(a) for a in (response or {}).get('albums', []) if a]
+            self._store('album', fetched)
+            self.prime_tracks([track for album in fetched for track in self.album_track_payloads(album)])
+            results.update({a['id']: a for a in fetched})
+        return results
+
+    def album(self, album_id):
+        return self.albums([album_id]).get(album_id)
+
+    def _complete_album(self, album_info):
+        """Albums embed the first 50 tracks; follow the paging links for longer ones."""
+        tracks_page = album_info.get('tracks') or {}
+        items = list(tracks_page.get('items', []))
+        while tracks_page.get('next'):
+            tracks_page = self.client.next(tracks_page)
+            if not tracks_page:
+                break
+            items.extend(tracks_page.get('items', []))
+        album_info['tracks'] = {'items': items, 'total': len(items), 'next': None}
+        return album_info
+
+    @staticmethod
+    def album_track_payloads(album_info):
+        """Turns an album's simplified tracks into track payloads shaped like GET /tracks/{id}."""
+        album_summary = {key: value for key, value in album_info.items() if key != 'tracks'}
+        return [
+            {**track, 'album': album_summary}
+            for track in (album_info.get('tracks') or {}).get('items', [])
+            if track and track.get('id')
+        ]
+
+    # --- Artists ---
+    def artist_releases(self, artist_id, include_groups='album,single'):
+        """Pages through an artist's releases (EPs are listed as singles by Spotify) and
+        returns the simplified album objects without regional duplicates. Not cached, discographies change."""
+        releases = []
+        page = self.client.artist_albums(artist_id, include_groups=include_groups, limit=ARTIST_ALBUMS_PER_PAGE)
+        while page:
+            releases.extend(item for item in page.get('items', []) if item and item.get('id'))
+            page = self.client.next(page) if page.get('next') else None
+        return self.dedupe_releases(releases)
+
+    @staticmethod
+    def dedupe_releases(releases):
+        """Spotify lists the same release once per market group with different ids. Keeps one per
+        (name, type, track count), the one available in the most markets, in the original order."""
+        best = {}
+        for release in releases:
+            key = (' '.join(release.get('name', '').lower().split()), release.get('album_type'), release.get('total_tracks'))
+            current = best.get(key)
+            if current is None or len(release.get('available_markets') or []) > len(current.get('available_markets') or []):
+                best[key] = release
+        kept_ids = {release['id'] for release in best.values()}
+        return [release for release in releases if release['id'] in kept_ids]
@@ -57,6 +57,7 @@ async function loadContent(url, pushState = true) {
 
         // Re-initialize dynamic listeners if necessary (e.g., if loadContent replaces part of the page with new buttons)
         // setupDynamicEventListeners(); // Example call if needed
+        startIngestProgressPolling();
 
     } catch (error) {
         console.error('Failed to load content:', error);
@@ -159,6 +160,55 @@ function displayLyrics(lyricsData) {
 }
 // ... (other lyrics functions: toggleLyricsModal, setupLyricsEditing, saveLyrics, etc.) ...
 
+// --- Ingest Job Progress ---
+async function pollIngestProgress(container) {
+    // Polls the ingest job progress endpoint until the job is done or failed
+    const url = container.dataset.progressUrl;
+    const statusEl = container.querySelector('.ingest-status');
+    const summaryEl = container.querySelector('.ingest-summary');
+    const tracksEl = container.querySelector('.ingest-tracks');
+
+    try {
+        const response = await fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        const job = data.job;
+
+        statusEl.textContent = job.status;
+        let summary = `${job.completed_tracks + job.failed_tracks}/${job.total_tracks} tracks (${job.percent_done}%)`;
+        if (job.failed_tracks) summary += `, ${job.failed_tracks} failed`;
+        if (job.eta_seconds !== null) summary += `, about ${formatTime(job.eta_seconds)} left`;
+        if (job.error) summary += ` - ${job.error}`;
+        summaryEl.textContent = summary;
+
+        tracksEl.innerHTML = '';
+        job.tracks.forEach(track => {
+            const li = document.createElement('li');
+            li.textContent = `${track.position}. ${track.title || track.spotify_id} - ${track.status}`;
+            li.className = `ingest-track ingest-track-${track.status}`;
+            tracksEl.appendChild(li);
+        });
+
+        if (job.status === 'queued' || job.status === 'running') {
+            // Stop polling once the user navigates away (container is removed from the DOM)
+            if (document.body.contains(container)) {
+                setTimeout(() => pollIngestProgress(container), 2000);
+            }
+        }
+    } catch (error) {
+        console.error('Failed to fetch ingest progress:', error);
+        summaryEl.textContent = `Could not load progress (${error.message}).`;
+    }
+}
+
+function startIngestProgressPolling() {
+    document.querySelectorAll('.ingest-progress[data-progress-url]').forEach(container => {
+        pollIngestProgress(container);
+    });
+}
+
 // --- Library Functions ---
 async function addToLibrary(mediaType, mediaId, buttonElement) {
     // ... (implementation as before) ...
@@ -246,6 +296,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Fetch initial data
     fetchQueue();
+    startIngestProgressPolling();
 
     // Store the initial path for popstate handling
     // Note: Ensure this runs *after* potential initial content load if using server-side rendering + AJAX
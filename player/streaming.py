@@ -0,0 +1,215 @@
+"""Serving audio files with HTTP range support.
+
+Browsers seek in <audio> with Range requests. stream_file answers them with
+206 Partial Content (single ranges; multi-range requests get the whole file,
+which RFC 9110 allows), honours If-Range and If-None-Match, and sends whole
+files and ranges alike through FileResponse, so the WSGI server's
+wsgi.file_wrapper can use sendfile(). A range is the open file seeked to its
+start and limited to its length (FileRange); gunicorn sends Content-Length
+bytes from the file's position with sendfile(). Servers without a file_wrapper
+(runserver, some ASGI setups) read the file in Python, use AUDIO_STREAM_OFFLOAD
+there when zero-copy sending matters.
+
+With AUDIO_STREAM_OFFLOAD set, Django only checks access and hands the transfer
+to the front proxy:
+- 'x-accel-redirect' (nginx): needs an internal location, e.g.
+      location /protected-media/ { internal; alias /path/to/media/; }
+  with AUDIO_STREAM_ACCEL_PREFIX = '/protected-media/'.
+- 'x-sendfile' (Apache mod_xsendfile, lighttpd): the absolute path is sent.
+The proxy then does ranges and conditional requests itself.
+
+Song URLs carry a version (?v=, see song_stream_url) that changes with the
+file, and covers are stored under their sha256 (player/covers.py), so both are
+sent as immutable and browsers never revalidate them. Behind nginx the same
+headers for covers come from e.g.
+    location /media/covers/ { add_header Cache-Control "public, max-age=31536000, immutable"; }
+"""
+import hashlib
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.urls import reverse
+from django.utils.http import http_date
+from django.views.static import serve
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = 'max-age=31536000, immutable'
+# Media named after their sha256: covers/ab/<sha256>.jpg and its thumbnails <sha256>_<size>.webp
+CONTENT_HASHED_RE = re.compile(r'(^|/)[0-9a-f]{64}(_\d+)?\.\w+$')
+
+AUDIO_CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.aac': 'audio/aac',
+    '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg',
+    '.opus': 'audio/ogg', # Opus in an Ogg container
+    '.wav': 'audio/wav',
+}
+
+
+def file_etag(stat):
+    """Strong ETag from size and modification time, changes whenever the file is replaced."""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def file_version(path):
+    """Short token that changes whenever the file at `path` is replaced. None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+def song_stream_url(song):
+    """Versioned stream URL of a song, served as immutable while the file stays the same. None without a file."""
+    if not song.file:
+        return None
+    url = reverse('stream_song', args=[song.pk])
+    version = file_version(song.file.path)
+    return f"{url}?v={version}" if version else url
+
+
+def serve_media(request, path, document_root=None):
+    """django.views.static.serve for MEDIA_URL during development, with immutable caching of content-hashed files."""
+    response = serve(request, path, document_root=document_root or settings.MEDIA_ROOT)
+    if CONTENT_HASHED_RE.search(path):
+        response['Cache-Control'] = 'public, ' + IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match / If-Match style header lists `etag` (or is '*')."""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+def parse_range(header, size):
+    """Parses a Range header against a file of `size` bytes.
+    Returns (start, end) inclusive, None to serve the whole file (no, invalid or multi-range header)
+    or False when the range can't be satisfied (416)."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first: # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None # Syntactically invalid, ignore it
+    if start >= size:
+        return False
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """`length` bytes of an open file from its current position, for FileResponse.
+    Keeps fileno() so wsgi.file_wrapper can sendfile() it, while read() stops at the end of the range
+    for servers that iterate instead. No seek(), so FileResponse leaves Content-Length to the caller."""
+
+    def __init__(self, file, length):
+        self._file = file
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size) if size else b''
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+def _offload_response(path, content_type):
+    """Empty response telling the front proxy to send the file, or None if offloading is off or impossible."""
+    mode = (settings.AUDIO_STREAM_OFFLOAD or '').lower()
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    if mode == 'x-accel-redirect':
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        if relative_path.startswith('..'):
+            return None # Outside MEDIA_ROOT, the internal location can't reach it
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.AUDIO_STREAM_ACCEL_PREFIX + quote(relative_path.replace(os.sep, '/'))
+        return response
+    return None
+
+
+def stream_file(request, path, content_type=None, cache_control='private, max-age=3600'):
+    """Response for a GET/HEAD of the file at `path`, with Range, If-Range and If-None-Match support."""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    content_type = content_type or AUDIO_CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+
+    def _finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = cache_control
+        return response
+
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return _finish(HttpResponseNotModified())
+
+    offloaded = _offload_response(path, content_type)
+    if offloaded is not None:
+        return _finish(offloaded)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header:
+        if_range = request.headers.get('If-Range')
+        # A range is only valid for the version the client already has part of
+        if not if_range or if_range.strip() in (etag, last_modified):
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return _finish(response)
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+    length = end - start + 1 if size else 0
+
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type)
+    else:
+        f = open(path, 'rb')
+        if status == 206:
+            f.seek(start)
+            f = FileRange(f, length)
+        # wsgi.file_wrapper / sendfile, for ranges too
+        response = FileResponse(f, status=status, content_type=content_type, filename=os.path.basename(path))
+        response.block_size = CHUNK_SIZE # When the server iterates instead
+    response['Content-Length'] = str(length)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return _finish(response)
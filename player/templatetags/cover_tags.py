@@ -0,0 +1,24 @@
+from django import template
+
+from player.covers import cover_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag('cover_picture.html')
+def cover_picture(release, size, css_class='', alt=''):
+    """Renders a release cover as <picture> with WebP/JPEG srcsets, for display at `size` CSS pixels.
+    Usage: {% cover_picture album 40 "item-list-cover" album.title %}"""
+    return {
+        'cover': cover_sources(release, size),
+        'size': size,
+        'css_class': css_class,
+        'alt': alt,
+    }
+
+
+@register.simple_tag
+def cover_url(release, size):
+    """Single URL of the cover at about `size` pixels (e.g. for data-song-cover), '' without a cover."""
+    cover = cover_sources(release, size)
+    return cover['src'] if cover else ''
@@ -0,0 +1,12 @@
+from django import template
+
+from player.streaming import song_stream_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def stream_url(song):
+    """Versioned stream URL of a song (cacheable as immutable), '' without a file.
+    Usage: data-song-url="{% stream_url song %}" """
+    return song_stream_url(song) or ''
@@ -1,3 +1,1055 @@
-from django.test import TestCase
+import os
+import shutil
+import subprocess
+import tempfile
+from io import BytesIO, StringIO
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+import spotipy
+from mutagen.easyid3 import EasyID3
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.http import FileResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from syncedlyrics.utils import Lyrics
+
+from . import covers, loudness
+from .audio_store import audio_path_for_hash, hash_file, is_stored, store_file
+from .ingest import JobProgress, claim_next_job, run_job
+from .ingest_writer import sync_playlist_songs, write_track_batch
+from .lyrics import get_cached_lyrics, lyrics_lookup_key, store_cached_lyrics
+from .management.commands.import_folder import _read_and_place, release_kind
+from .models import (
+    EP, Album, Artist, DownloadedFile, IngestJob, IngestJobTrack, LyricsCacheEntry, MediaFileFingerprint, Playlist, PlaylistSong,
+    Queue, QueueItem, Song,
+)
+from .spotify_client import LocalRateLimiter, RateLimitedSpotify
+from .spotify_metadata import SpotifyFileCache, SpotifyMetadata
+from .streaming import file_etag, file_version, parse_range, song_stream_url, stream_file
+from .transcode import pick_variant
+from .views import (
+    download_songs_batch, find_complete_songs, ingest_track_batch, process_spotify_artist, process_spotify_track, run_spotdl_batch,
+    spotdl_target_path, sync_spotify_playlist,
+)
+
+
+class MediaRootMixin:
+    """Runs each test against an empty temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root, SPOTDL_DOWNLOAD_PATH=os.path.join(self.media_root, 'songs'))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def write_media(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+def fake_spotdl(skip=()):
+    """subprocess.run replacement writing {track-id}.mp3 into spotdl's --output pattern, except for `skip`."""
+    def run(cmd, **kwargs):
+        output = cmd[cmd.index('--output') + 1]
+        for url in cmd:
+            track_id = url.rsplit('/', 1)[-1] if url.startswith('https://open.spotify.com/track/') else None
+            if track_id and track_id not in skip:
+                with open(output.replace('{track-id}', track_id).replace('{output-ext}', 'mp3'), 'wb') as f:
+                    f.write(track_id.encode())
+        return subprocess.CompletedProcess(cmd, 1 if skip else 0, '', 'not found on YouTube' if skip else '')
+    return run
+
+
+class IngestJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ingester')
+        self.client.force_login(self.user)
+
+    def add(self, url='https://open.spotify.com/track/t1'):
+        return self.client.post(reverse('add_spotify_content'), {'spotify_url': url})
+
+    def test_add_only_queues(self):
+        with mock.patch('player.views.process_spotify_track') as process:
+            response = self.add()
+        self.assertEqual(response.status_code, 200)
+        process.assert_not_called() # Left to the workers
+        job = IngestJob.objects.get()
+        self.assertEqual((job.status, job.content_type, job.spotify_id), (IngestJob.STATUS_QUEUED, 'track', 't1'))
+
+    def test_run_track_job(self):
+        self.add()
+        song = Song.objects.create(title='One', spotify_id='t1', file='songs/one.mp3')
+        job = claim_next_job('worker-1')
+        self.assertEqual((job.status, job.worker_id, job.attempts), (IngestJob.STATUS_RUNNING, 'worker-1', 1))
+        self.assertIsNone(claim_next_job('worker-2'))
+        with mock.patch('player.views.process_spotify_track', return_value=(song, ['Downloaded'])) as process:
+            self.assertEqual(run_job(job), IngestJob.STATUS_DONE)
+        process.assert_called_once_with('t1', self.user)
+        job.refresh_from_db()
+        self.assertEqual((job.completed_tracks, job.total_tracks, job.percent_done()), (1, 1, 100.0))
+        self.assertIn('Downloaded', job.log)
+        self.assertEqual(IngestJobTrack.objects.get(job=job).song, song)
+
+    def test_failed_job_keeps_error(self):
+        self.add()
+        job = claim_next_job('worker-1')
+        with mock.patch('player.views.process_spotify_track', side_effect=RuntimeError('spotdl broke')):
+            self.assertEqual(run_job(job), IngestJob.STATUS_FAILED)
+        job.refresh_from_db()
+        self.assertIn('spotdl broke', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_progress(self):
+        self.add('https://open.spotify.com/playlist/p1')
+        job = IngestJob.objects.get()
+        IngestJob.objects.filter(pk=job.pk).update(status=IngestJob.STATUS_RUNNING, total_tracks=4, completed_tracks=1, failed_tracks=1)
+        IngestJobTrack.objects.create(job=job, spotify_id='t1', title='One', position=1, status=IngestJobTrack.STATUS_DONE)
+        data = self.client.get(reverse('ingest_job_progress', args=[job.pk])).json()['job']
+        self.assertEqual((data['status'], data['percent_done']), (IngestJob.STATUS_RUNNING, 50.0))
+        self.assertEqual([(t['spotify_id'], t['status']) for t in data['tracks']], [('t1', 'done')])
+
+    def test_progress_of_other_users_job(self):
+        self.add()
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(reverse('ingest_job_progress', args=[IngestJob.objects.get().pk])).status_code, 404)
+
+
+@override_settings(SPOTDL_BATCH_SIZE=2, AUDIO_CONTENT_ADDRESSED=False)
+class SpotdlBatchTests(MediaRootMixin, TestCase):
+    def targets(self, *track_ids):
+        return {track_id: spotdl_target_path(track_id, 'Title ' + track_id, 'AC/DC', 'Album?') for track_id in track_ids}
+
+    def test_one_process_per_batch(self):
+        with mock.patch('player.views.subprocess.run', side_effect=fake_spotdl()) as run:
+            found, _ = run_spotdl_batch(self.targets('t1', 't2', 't3'))
+        self.assertEqual(run.call_count, 2) # SPOTDL_BATCH_SIZE tracks per spotdl process
+        self.assertEqual([sum('/track/' in arg for arg in call.args[0]) for call in run.call_args_list], [2, 1])
+        self.assertEqual(found['t1'], os.path.join('songs', 'ACDC', 'Album', 'Title t1 [t1].mp3'))
+        for path in found.values():
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, path)))
+
+    def test_failed_track_keeps_the_rest(self):
+        with mock.patch('player.views.subprocess.run', side_effect=fake_spotdl(skip={'t2'})):
+            found, logs = run_spotdl_batch(self.targets('t1', 't2'))
+        self.assertEqual(set(found), {'t1'})
+        self.assertIn('1 missing', logs[-1])
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'songs', '.staging')), []) # Staging removed
+
+
+@override_settings(AUDIO_CONTENT_ADDRESSED=False)
+class DownloadManifestTests(MediaRootMixin, TestCase):
+    def test_files_mapped_by_track_id(self):
+        songs = {'t1': Song.objects.create(title='One', spotify_id='t1'), 't2': Song.objects.create(title='Two', spotify_id='t2')}
+        targets = {track_id: spotdl_target_path(track_id, song.title) for track_id, song in songs.items()}
+        with mock.patch('player.views.subprocess.run', side_effect=fake_spotdl()), mock.patch('player.views.schedule_waveform'):
+            linked, _ = download_songs_batch(songs, targets)
+        self.assertEqual(linked, {'t1', 't2'})
+        manifest = dict(DownloadedFile.objects.values_list('spotify_id', 'path'))
+        self.assertEqual(manifest['t2'], targets['t2'] + '.mp3')
+        self.assertEqual(Song.objects.get(spotify_id='t2').file.name, manifest['t2'])
+        self.assertEqual(DownloadedFile.objects.get(spotify_id='t2').size, 2)
+
+    def test_manifest_reused_without_spotdl(self):
+        self.write_media('songs/elsewhere/one.mp3', b'one')
+        DownloadedFile.objects.create(spotify_id='t1', path='songs/elsewhere/one.mp3')
+        with mock.patch('player.views.subprocess.run') as run:
+            found, _ = run_spotdl_batch({'t1': spotdl_target_path('t1', 'One')})
+        run.assert_not_called()
+        self.assertEqual(found, {'t1': 'songs/elsewhere/one.mp3'})
+
+    def test_missing_file_downloaded_again(self):
+        DownloadedFile.objects.create(spotify_id='t1', path='songs/deleted.mp3')
+        with mock.patch('player.views.subprocess.run', side_effect=fake_spotdl()) as run:
+            found, _ = run_spotdl_batch({'t1': spotdl_target_path('t1', 'One')})
+        run.assert_called_once()
+        self.assertEqual(DownloadedFile.objects.get(spotify_id='t1').path, found['t1'])
+
+
+class FakeSpotify:
+    """Records the ids asked for by the multi-get endpoints."""
+
+    def __init__(self, album_tracks=0):
+        self.calls = []
+        self.album_tracks = album_tracks
+
+    def tracks(self, ids):
+        self.calls.append(('tracks', list(ids)))
+        return {'tracks': [{'id': track_id, 'name': 'Track ' + track_id} for track_id in ids]}
+
+    def albums(self, ids):
+        self.calls.append(('albums', list(ids)))
+        items = [{'id': f'{album_id}-t{i}', 'name': f'Track {i}'} for album_id in ids for i in range(self.album_tracks)]
+        return {'albums': [{'id': album_id, 'name': 'Album ' + album_id,
+                            'tracks': {'items': items[:50], 'next': 'page-2' if len(items) > 50 else None, 'rest': items[50:]}}
+                           for album_id in ids]}
+
+    def next(self, page):
+        self.calls.append(('next', page['next']))
+        return {'items': page['rest'], 'next': None}
+
+
+class SpotifyMetadataTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        cache_settings = override_settings(CACHES={'spotify': {
+            'BACKEND': 'player.spotify_metadata.SpotifyFileCache', 'LOCATION': cache_dir, 'OPTIONS': {'MAX_ENTRIES': 5},
+        }})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.cache_dir = cache_dir
+
+    def test_tracks_fetched_in_chunks_and_cached(self):
+        client = FakeSpotify()
+        ids = [f't{i}' for i in range(60)]
+        self.assertEqual(len(SpotifyMetadata(client).tracks(ids + ['t0'])), 60)
+        self.assertEqual([len(ids) for _, ids in client.calls], [50, 10]) # GET /tracks takes 50 ids
+        client.calls.clear()
+        self.assertEqual(SpotifyMetadata(client).track('t59')['name'], 'Track t59')
+        self.assertEqual(client.calls, [])
+
+    def test_album_tracks_primed(self):
+        client = FakeSpotify(album_tracks=60)
+        album = SpotifyMetadata(client).album('a1')
+        self.assertEqual(len(album['tracks']['items']), 60) # Paged past the 50 embedded tracks
+        client.calls.clear()
+        track = SpotifyMetadata(client).track('a1-t55')
+        self.assertEqual(track['album']['name'], 'Album a1')
+        self.assertEqual(client.calls, [])
+
+    def test_file_cache_culls_on_interval(self):
+        cache = caches['spotify']
+        self.assertIsInstance(cache, SpotifyFileCache)
+        with mock.patch.object(FileBasedCache, '_cull') as cull:
+            cache.set_many({f'track:t{i}': {'id': i} for i in range(20)})
+        cull.assert_called_once() # Not once per payload
+        SpotifyFileCache._last_cull.clear()
+        cache.set('track:last', {})
+        self.assertLess(len(os.listdir(self.cache_dir)), 21) # Culled (a third of the entries) once the interval passed
+
+
+class RateLimiterTests(TestCase):
+    def test_token_bucket(self):
+        limiter = LocalRateLimiter(rate=10, capacity=2)
+        self.assertEqual((limiter._reserve(), limiter._reserve()), (0, 0)) # The burst
+        self.assertAlmostEqual(limiter._reserve(), 0.1, delta=0.02) # Then one token per 1/rate seconds
+        limiter.block_for(5)
+        self.assertGreater(limiter._reserve(), 4.9)
+
+
+def rate_limited(status=429, retry_after='1.5'):
+    return spotipy.SpotifyException(status, -1, 'Too many requests', headers={'Retry-After': retry_after} if retry_after else {})
+
+
+class RateLimitedSpotifyTests(TestCase):
+    def setUp(self):
+        self.limiter = mock.Mock()
+        self.client = RateLimitedSpotify(auth='token', rate_limiter=self.limiter, max_rate_limit_retries=2)
+
+    def test_backs_off_for_retry_after(self):
+        with mock.patch.object(spotipy.Spotify, '_internal_call', side_effect=[rate_limited(), {'id': 't1'}]) as call:
+            self.assertEqual(self.client.track('t1'), {'id': 't1'})
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(self.limiter.acquire.call_count, 2) # Every attempt takes a token
+        self.limiter.block_for.assert_called_once_with(1.5) # Shared with everyone using the bucket
+
+    def test_gives_up(self):
+        with mock.patch.object(spotipy.Spotify, '_internal_call', side_effect=[rate_limited()] * 3):
+            with self.assertRaises(spotipy.SpotifyException):
+                self.client.track('t1')
+        with mock.patch.object(spotipy.Spotify, '_internal_call', side_effect=[rate_limited(retry_after='86400')]) as call:
+            with self.assertRaises(spotipy.SpotifyException):
+                self.client.track('t1')
+        self.assertEqual(call.call_count, 1) # Longer than SPOTIFY_MAX_RETRY_AFTER, not waited for
+        with mock.patch.object(spotipy.Spotify, '_internal_call', side_effect=[rate_limited(status=404)]) as call:
+            with self.assertRaises(spotipy.SpotifyException):
+                self.client.track('t1')
+        self.assertEqual(call.call_count, 1)
+
+    def test_identical_gets_coalesced(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_call(*args):
+            entered.set()
+            release.wait(5)
+            return {'id': 't1', 'artists': []}
+
+        results = []
+        with mock.patch.object(spotipy.Spotify, '_internal_call', side_effect=slow_call) as call:
+            threads = [threading.Thread(target=lambda: results.append(self.client.track('t1'))) for _ in range(2)]
+            threads[0].start()
+            entered.wait(5)
+            threads[1].start()
+            while not any(inflight.waiters for inflight in list(self.client._inflight.values())):
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(results[0], results[1])
+        self.assertIsNot(results[0], results[1]) # Each caller gets its own copy
+
+
+def track_payload(track_id, name, album_id='al1', album_type='album', artist=('ar1', 'Artist'), track_number=1):
+    artist_data = {'id': artist[0], 'name': artist[1]}
+    return {
+        'id': track_id,
+        'name': name,
+        'artists': [artist_data],
+        'duration_ms': 180000,
+        'track_number': track_number,
+        'album': {
+            'id': album_id,
+            'name': 'Release ' + album_id,
+            'album_type': album_type,
+            'release_date': '2020-05',
+            'images': [],
+            'artists': [artist_data],
+        },
+    }
+
+
+class WriteTrackBatchTests(TestCase):
+    def test_creates_artists_releases_and_songs(self):
+        batch = write_track_batch([track_payload('t1', 'One'), track_payload('t2', 'Two', track_number=2),
+                                   track_payload('t3', 'Three', album_id='ep1', album_type='ep')])
+        self.assertEqual(set(batch.songs), {'t1', 't2', 't3'})
+        album = Album.objects.get(spotify_id='al1')
+        self.assertEqual(album.release_date.isoformat(), '2020-05-01')
+        self.assertEqual([a.spotify_id for a in album.artists.all()], ['ar1'])
+        self.assertEqual(Song.objects.get(spotify_id='t3').ep, EP.objects.get(spotify_id='ep1'))
+        self.assertEqual(Song.objects.get(spotify_id='t2').duration, timedelta(minutes=3))
+
+    def test_upsert_keeps_rows_and_local_fields(self):
+        first = write_track_batch([track_payload('t1', 'One')]).songs['t1']
+        Song.objects.filter(pk=first.pk).update(file='songs/one.mp3', lyrics='la la')
+        second = write_track_batch([track_payload('t1', 'One (Remastered)', artist=('ar2', 'Other'))]).songs['t1']
+        self.assertEqual(first.pk, second.pk)
+        song = Song.objects.get(pk=first.pk)
+        self.assertEqual(song.title, 'One (Remastered)')
+        self.assertEqual(song.file.name, 'songs/one.mp3')
+        self.assertEqual(song.lyrics, 'la la')
+        self.assertEqual([a.spotify_id for a in song.artists.all()], ['ar2']) # M2M diffed to the new credits
+        self.assertEqual(Song.objects.filter(spotify_id='t1').count(), 1)
+
+    def test_duplicate_and_local_tracks(self):
+        batch = write_track_batch([track_payload('t1', 'One'), track_payload('t1', 'One'), dict(track_payload('t9', 'Local'), is_local=True)])
+        self.assertEqual(list(batch.songs), ['t1'])
+
+
+def image_bytes(size=(400, 400), image_format='PNG', color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class FakeImageResponse:
+    def __init__(self, content, content_type):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.content is None:
+            raise requests.HTTPError('404 Not Found')
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FakeImageSession:
+    def __init__(self, images):
+        self.images = images # url -> (bytes or None for a 404, content type)
+
+    def get(self, url, **kwargs):
+        return FakeImageResponse(*self.images[url])
+
+
+@override_settings(COVER_THUMBNAIL_SIZES=(64, 160, 300))
+class CoverTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        covers._ready_covers.clear()
+
+    def fetch(self, images):
+        with mock.patch('player.covers.get_session', return_value=FakeImageSession(images)):
+            return covers.fetch_covers(list(images))
+
+    def test_same_artwork_stored_once(self):
+        art = image_bytes()
+        paths = self.fetch({
+            'https://i.scdn.co/image/album': (art, 'image/png'),
+            'https://i.scdn.co/image/single': (art, 'image/png; charset=binary'),
+            'https://i.scdn.co/image/gone': (None, 'text/html'),
+        })
+        self.assertEqual(set(paths), {'https://i.scdn.co/image/album', 'https://i.scdn.co/image/single'})
+        self.assertEqual(len(set(paths.values())), 1)
+        path = paths['https://i.scdn.co/image/album']
+        digest = os.path.splitext(os.path.basename(path))[0]
+        self.assertEqual(path, os.path.join('covers', digest[:2], digest + '.png'))
+        with open(os.path.join(self.media_root, path), 'rb') as f:
+            self.assertEqual(f.read(), art)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'covers', 'tmp')), [])
+
+
+    def test_thumbnails_and_srcset(self):
+        self.write_media('covers/ab/abcd.png', image_bytes(size=(200, 100)))
+        self.assertTrue(covers.generate_thumbnails('covers/ab/abcd.png'))
+        for size in (64, 160, 300):
+            for extension in ('.jpg', '.webp'):
+                with Image.open(os.path.join(self.media_root, f'covers/ab/abcd_{size}{extension}')) as thumbnail:
+                    self.assertEqual(max(thumbnail.size), min(size, 200)) # Fit in size x size, never upscaled
+        album = Album.objects.create(title='Album', cover_image='covers/ab/abcd.png')
+        sources = covers.cover_sources(album, 100)
+        self.assertEqual(sources['src'], '/media/covers/ab/abcd_160.jpg') # Smallest one at least 100px wide
+        self.assertEqual(sources['webp_srcset'], '/media/covers/ab/abcd_64.webp 64w, /media/covers/ab/abcd_160.webp 160w, /media/covers/ab/abcd_300.webp 300w')
+        html = Template('{% load cover_tags %}{% cover_picture album 40 "cover" album.title %}').render(Context({'album': album}))
+        self.assertIn('<source type="image/webp" srcset="/media/covers/ab/abcd_64.webp 64w', html)
+        self.assertIn('src="/media/covers/ab/abcd_64.jpg"', html)
+
+    def test_without_thumbnails(self):
+        album = Album.objects.create(title='Album', cover_image='covers/ab/missing.png')
+        self.assertEqual(covers.cover_sources(album, 40), {'src': '/media/covers/ab/missing.png', 'webp_srcset': '', 'jpeg_srcset': ''})
+        remote = Album.objects.create(title='Remote', cover_image_url='https://i.scdn.co/image/x')
+        self.assertEqual(covers.cover_sources(remote, 40)['src'], 'https://i.scdn.co/image/x')
+        self.assertIsNone(covers.cover_sources(Album.objects.create(title='None'), 40))
+        self.write_media('covers/ab/broken.png', b'not an image')
+        self.assertFalse(covers.generate_thumbnails('covers/ab/broken.png'))
+
+
+@override_settings(LYRICS_CACHE_TTL=None, LYRICS_NEGATIVE_CACHE_TTL=3600)
+class LyricsCacheTests(TestCase):
+    def setUp(self):
+        self.key, self.title, self.artists = lyrics_lookup_key('Song (feat. Guest) - Remastered 2011', ['Band'])
+
+    def age(self, seconds):
+        LyricsCacheEntry.objects.filter(lookup_key=self.key).update(checked_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_key_ignores_featuring_and_versions(self):
+        self.assertEqual(lyrics_lookup_key('song', ['band'])[0], self.key)
+
+    def test_hit_never_expires_without_ttl(self):
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics(synced='[00:01.00] la'))
+        self.age(10 * 365 * 24 * 3600)
+        self.assertEqual(get_cached_lyrics(self.key).synced_lyrics, '[00:01.00] la')
+
+    @override_settings(LYRICS_CACHE_TTL=60)
+    def test_hit_expires_with_ttl(self):
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics(unsynced='la'))
+        self.assertIsNotNone(get_cached_lyrics(self.key))
+        self.age(120)
+        self.assertIsNone(get_cached_lyrics(self.key))
+
+    def test_miss_is_cached_until_negative_ttl(self):
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics())
+        entry = get_cached_lyrics(self.key)
+        self.assertFalse(entry.found)
+        self.age(3599)
+        self.assertIsNotNone(get_cached_lyrics(self.key))
+        self.age(3601)
+        self.assertIsNone(get_cached_lyrics(self.key))
+
+    @override_settings(LYRICS_NEGATIVE_CACHE_TTL=0)
+    def test_misses_not_stored_with_zero_negative_ttl(self):
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics())
+        self.assertFalse(LyricsCacheEntry.objects.exists())
+
+    def test_hit_replaces_miss(self):
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics())
+        store_cached_lyrics(self.key, self.title, self.artists, Lyrics(unsynced='la'))
+        self.assertTrue(get_cached_lyrics(self.key).found)
+        self.assertEqual(LyricsCacheEntry.objects.count(), 1)
+
+
+class SyncPlaylistSongsTests(TestCase):
+    def setUp(self):
+        self.playlist = Playlist.objects.create(user=User.objects.create_user('listener'), name='Mix')
+        self.a, self.b, self.c = (Song.objects.create(title=title) for title in 'abc')
+
+    def positions(self):
+        return dict(PlaylistSong.objects.filter(playlist=self.playlist).values_list('song_id', 'position'))
+
+    def test_diff(self):
+        self.assertEqual(sync_playlist_songs(self.playlist, {self.a.pk: 0, self.b.pk: 1}), (2, 0, 0))
+        self.assertEqual(sync_playlist_songs(self.playlist, {self.b.pk: 0, self.c.pk: 1}), (1, 1, 1))
+        self.assertEqual(self.positions(), {self.b.pk: 0, self.c.pk: 1})
+        self.assertEqual(sync_playlist_songs(self.playlist, {self.b.pk: 0, self.c.pk: 1}), (0, 0, 0))
+
+    def test_page_keeps_other_songs(self):
+        sync_playlist_songs(self.playlist, {self.a.pk: 0, self.b.pk: 1})
+        self.assertEqual(sync_playlist_songs(self.playlist, {self.c.pk: 2}, remove_missing=False), (1, 0, 0))
+        self.assertEqual(self.positions(), {self.a.pk: 0, self.b.pk: 1, self.c.pk: 2})
+
+
+class JobProgressTests(TestCase):
+    def setUp(self):
+        self.job = IngestJob.objects.create(
+            user=User.objects.create_user('ingester'), spotify_url='https://open.spotify.com/playlist/p1',
+            content_type='playlist', spotify_id='p1', status=IngestJob.STATUS_RUNNING, attempts=1,
+        )
+
+    def test_checkpoint_and_resume(self):
+        progress = JobProgress(self.job)
+        progress.expect(4)
+        progress.add_tracks([('t1', 'One'), ('t2', 'Two')])
+        progress.track_started('t1')
+        progress.track_finished('t1', ok=True)
+        progress.checkpoint(2)
+        progress.add_tracks([('t3', 'Three'), ('t4', 'Four')])
+        progress.track_started('t3') # The worker dies while on this one
+
+        job = IngestJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.checkpoint_offset, job.completed_tracks, job.total_tracks), (2, 1, 4))
+        resumed = JobProgress(job)
+        resumed.resume()
+        self.assertEqual(resumed.checkpoint_offset, 2)
+        self.assertEqual(resumed.finished_tracks(), {'t1': None})
+        self.assertEqual(IngestJobTrack.objects.get(job=job, spotify_id='t3').status, IngestJobTrack.STATUS_PENDING)
+        # A resumed playlist registers its pages again, known tracks aren't added twice
+        resumed.expect(4)
+        resumed.add_tracks([('t3', 'Three'), ('t4', 'Four')])
+        self.assertEqual(IngestJobTrack.objects.filter(job=job).count(), 4)
+        self.assertEqual(IngestJob.objects.get(pk=job.pk).total_tracks, 4)
+
+    def test_resumed_pages_keep_the_total(self):
+        progress = JobProgress(self.job)
+        progress.expect(9)
+        progress.add_tracks([('t1', 'One'), ('t2', 'Two'), ('t2', 'Two again')])
+        progress.checkpoint(3)
+        progress.add_tracks([('t3', 'Three'), ('t4', 'Four'), ('t3', 'Three again')]) # Then the worker dies
+        self.assertEqual(IngestJob.objects.get(pk=self.job.pk).total_tracks, 7) # Duplicates taken off
+
+        resumed = JobProgress(IngestJob.objects.get(pk=self.job.pk))
+        resumed.resume()
+        resumed.expect(9)
+        resumed.add_tracks([('t3', 'Three'), ('t4', 'Four'), ('t3', 'Three again')]) # Registered by the first attempt
+        self.assertEqual(IngestJob.objects.get(pk=self.job.pk).total_tracks, 7)
+        resumed.add_tracks([('t5', 'Five'), ('t6', 'Six'), ('t5', 'Five again')])
+        self.assertEqual(IngestJob.objects.get(pk=self.job.pk).total_tracks, 6)
+
+    def test_finished_tracks_are_counted_once(self):
+        progress = JobProgress(self.job)
+        progress.add_tracks([('t1', 'One'), ('t1', 'One')])
+        progress.track_finished('t1', ok=False)
+        progress.track_finished('t1', ok=True)
+        job = IngestJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.completed_tracks, job.failed_tracks), (0, 1))
+
+
+class CompleteSongSkipTests(TestCase):
+    def setUp(self):
+        self.complete = Song.objects.create(title='One', spotify_id='t1', file='songs/one.mp3', synced_lyrics='[00:01.00] la')
+        Song.objects.create(title='Two', spotify_id='t2', file='songs/two.mp3') # No lyrics yet
+        Song.objects.create(title='Three', spotify_id='t3', lyrics='la') # No file
+
+    def test_find_complete_songs(self):
+        self.assertEqual(find_complete_songs(['t1', 't2', 't3', 't4']), {'t1': self.complete})
+
+    def test_complete_track_needs_no_spotify_call(self):
+        with mock.patch('player.views.spotify_metadata') as metadata:
+            song, logs = process_spotify_track('t1', None)
+        self.assertEqual(song, self.complete)
+        metadata.track.assert_not_called()
+
+    def test_complete_tracks_skip_the_batch(self):
+        job = IngestJob.objects.create(user=User.objects.create_user('ingester'), spotify_url='https://open.spotify.com/album/a1',
+                                       content_type='album', spotify_id='a1')
+        progress = JobProgress(job)
+        with mock.patch('player.views.write_track_batch') as write, mock.patch('player.views.subprocess.run') as run:
+            songs = ingest_track_batch([track_payload('t1', 'One')], [], progress)
+        self.assertEqual(songs, [self.complete])
+        write.assert_not_called()
+        run.assert_not_called()
+        self.assertEqual(IngestJobTrack.objects.get(job=job).status, IngestJobTrack.STATUS_DONE)
+        self.assertEqual(IngestJob.objects.get(pk=job.pk).completed_tracks, 1)
+
+
+def release(release_id, name, album_type='album', total_tracks=10, markets=('PL',)):
+    return {'id': release_id, 'name': name, 'album_type': album_type, 'total_tracks': total_tracks, 'available_markets': list(markets)}
+
+
+class ArtistIngestTests(TestCase):
+    def test_dedupe_releases(self):
+        releases = [
+            release('a-eu', 'Debut', markets=('PL', 'DE')),
+            release('s1', 'Debut', album_type='single', total_tracks=1),
+            release('a-world', 'debut ', markets=('PL', 'DE', 'US')), # Same album, listed for another market group
+            release('a-deluxe', 'Debut', total_tracks=14),
+            release('a-us', 'Debut', markets=('US',)),
+        ]
+        self.assertEqual([r['id'] for r in SpotifyMetadata.dedupe_releases(releases)], ['s1', 'a-world', 'a-deluxe'])
+
+    def test_releases_paged_and_deduped(self):
+        client = mock.Mock()
+        client.artist_albums.return_value = {'items': [release('a1', 'One')], 'next': 'page-2'}
+        client.next.return_value = {'items': [release('a2', 'One', markets=('PL', 'US')), release('a3', 'Two')], 'next': None}
+        self.assertEqual([r['id'] for r in SpotifyMetadata(client).artist_releases('ar1')], ['a2', 'a3'])
+
+    @override_settings(ARTIST_RELEASE_CONCURRENCY=2)
+    def test_every_release_ingested(self):
+        job = IngestJob.objects.create(user=User.objects.create_user('ingester'), spotify_url='https://open.spotify.com/artist/ar1',
+                                       content_type='artist', spotify_id='ar1')
+        progress = JobProgress(job)
+        releases = [release('a1', 'One', total_tracks=10), release('s1', 'Two', album_type='single', total_tracks=1), release('a2', 'Three', total_tracks=5)]
+        with mock.patch('player.views.sp') as sp, mock.patch('player.views.spotify_metadata') as metadata, \
+                mock.patch('player.views.process_spotify_album', side_effect=lambda album_id, user, progress: ([album_id], None if album_id == 's1' else album_id, [])) as process:
+            sp.artist.return_value = {'name': 'Band'}
+            metadata.artist_releases.return_value = releases
+            songs, artist, logs = process_spotify_artist('ar1', job.user, progress)
+        metadata.albums.assert_called_once_with(['a1', 's1', 'a2']) # One multi-get up front
+        self.assertEqual(sorted(call.args[0] for call in process.call_args_list), ['a1', 'a2', 's1'])
+        self.assertEqual(songs, ['a1', 's1', 'a2']) # In release order
+        self.assertEqual(artist, Artist.objects.get(spotify_id='ar1'))
+        self.assertIn("Could not process release 'Two' (s1).", logs)
+        self.assertEqual(IngestJob.objects.get(pk=job.pk).total_tracks, 16)
+
+
+class PlaylistResyncTests(TestCase):
+    def setUp(self):
+        self.playlist = Playlist.objects.create(user=User.objects.create_user('listener'), name='Mix', spotify_id='p1', snapshot_id='snap-1')
+        self.songs = {track_id: Song.objects.create(title=track_id, spotify_id=track_id) for track_id in ('t1', 't2')}
+
+    def header(self, snapshot_id):
+        return {'name': 'Mix', 'description': '', 'public': True, 'snapshot_id': snapshot_id, 'tracks': {'total': 2, 'limit': 100}}
+
+    def test_unchanged_snapshot(self):
+        with mock.patch('player.views.sp') as sp, mock.patch('player.views.ingest_track_batch') as ingest:
+            sp.playlist.return_value = self.header('snap-1')
+            self.assertEqual(sync_spotify_playlist(self.playlist)[0], False)
+        sp.playlist_items.assert_not_called()
+        ingest.assert_not_called()
+
+    def test_changed_snapshot_reuses_the_header(self):
+        items = {'items': [{'track': track_payload(track_id, track_id)} for track_id in ('t1', 't2')], 'next': None}
+        with mock.patch('player.views.sp') as sp, mock.patch('player.views.spotify_metadata'), \
+                mock.patch('player.views.ingest_track_batch', return_value=list(self.songs.values())):
+            sp.playlist.return_value = self.header('snap-2')
+            sp.playlist_items.return_value = items
+            changed, logs = sync_spotify_playlist(self.playlist)
+        self.assertTrue(changed)
+        sp.playlist.assert_called_once() # The snapshot check's response is the header of the resync
+        sp.playlist_items.assert_called_once_with('p1', limit=100, offset=0)
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.snapshot_id, 'snap-2')
+        self.assertEqual(list(PlaylistSong.objects.filter(playlist=self.playlist).values_list('song__spotify_id', flat=True)), ['t1', 't2'])
+
+    @override_settings(LYRICS_NEGATIVE_CACHE_TTL=3600)
+    def test_cached_lyrics_miss_counts_as_complete(self):
+        song = Song.objects.create(title='Instrumental', spotify_id='t9', file='songs/instrumental.mp3')
+        song.artists.add(Artist.objects.create(name='Band', spotify_id='ar1'))
+        self.assertEqual(find_complete_songs(['t9']), {})
+        key, title, artists = lyrics_lookup_key('Instrumental', ['Band'])
+        store_cached_lyrics(key, title, artists, Lyrics())
+        self.assertEqual(find_complete_songs(['t9']), {'t9': song})
+        LyricsCacheEntry.objects.update(checked_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(find_complete_songs(['t9']), {}) # Due for another search
+
+
+class ParseRangeTests(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+        self.assertEqual(parse_range('bytes=990-2000', 1000), (990, 999)) # End clamped to the file
+
+    def test_unsatisfiable(self):
+        self.assertIs(parse_range('bytes=1000-', 1000), False)
+        self.assertIs(parse_range('bytes=99999-', 1000), False)
+        self.assertIs(parse_range('bytes=-0', 1000), False)
+
+    def test_ignored(self):
+        self.assertIsNone(parse_range('', 1000))
+        self.assertIsNone(parse_range('bytes=50-10', 1000))
+        self.assertIsNone(parse_range('items=0-10', 1000))
+        self.assertIsNone(parse_range('bytes=0-10,20-30', 1000))
+
+
+class StreamFileTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 8
+        self.path = self.write_media('songs/a.mp3', self.content)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return stream_file(self.factory.get('/stream/1/', headers=headers), self.path)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+
+    def test_partial_content(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+    def test_range_can_be_sent_with_sendfile(self):
+        response = self.get(Range='bytes=100-')
+        self.assertIsInstance(response, FileResponse) # Handed to wsgi.file_wrapper like whole files
+        self.assertEqual(os.lseek(response.file_to_stream.fileno(), 0, os.SEEK_CUR), 100) # sendfile() starts here
+        self.assertEqual(response['Content-Length'], str(len(self.content) - 100)) # and stops after this many bytes
+        response.close()
+
+    def test_range_not_satisfiable(self):
+        response = self.get(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range(self):
+        etag = file_etag(os.stat(self.path))
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': etag}).status_code, 206)
+        # The client's part is of another version: the whole file, not a range of this one
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': '"stale"'}).status_code, 200)
+
+    def test_not_modified(self):
+        etag = file_etag(os.stat(self.path))
+        self.assertEqual(self.get(**{'If-None-Match': etag}).status_code, 304)
+
+
+class ClientHintTests(TestCase):
+    def test_pages_ask_for_hints(self):
+        self.client.force_login(User.objects.create_user('listener'))
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['Accept-CH'], 'ECT, Save-Data')
+        self.assertNotIn('Critical-CH', response) # No retried navigation just for a hint
+
+    @override_settings(TRANSCODE_DEFAULT_QUALITY='original', TRANSCODE_DEFAULT_CODEC='opus')
+    def test_pick_variant(self):
+        factory = RequestFactory()
+        self.assertIsNone(pick_variant(factory.get('/'))) # No hint yet: the default
+        self.assertEqual(pick_variant(factory.get('/', headers={'ECT': '3g'})), ('opus', 'low'))
+        self.assertEqual(pick_variant(factory.get('/', headers={'Save-Data': 'on', 'ECT': '4g'})), ('opus', 'low'))
+        self.assertIsNone(pick_variant(factory.get('/', headers={'ECT': '4g'})))
+        self.assertEqual(pick_variant(factory.get('/?quality=high&codec=aac', headers={'ECT': '2g'})), ('aac', 'high'))
+
+
+@override_settings(HLS_ENABLED=True, HLS_SEGMENT_WAIT=5)
+class HlsStreamTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_media('songs/a.mp3', b'\xff\xfb' * 500)
+        self.song = Song.objects.create(title='Long Song', file='songs/a.mp3')
+        self.client.force_login(User.objects.create_user('listener'))
+        self.resume = threading.Event()
+        for patcher in (
+            mock.patch('player.views.ffmpeg_available', return_value=True),
+            mock.patch('player.hls.ffmpeg_available', return_value=True),
+            mock.patch('player.hls.subprocess.run', self.fake_ffmpeg),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_ffmpeg(self, cmd, **kwargs):
+        """Writes one segment and its EVENT playlist, then the other two once the test resumes it."""
+        pattern, index = cmd[cmd.index('-hls_segment_filename') + 1], cmd[-1]
+        lines = ['#EXTM3U', '#EXT-X-PLAYLIST-TYPE:EVENT']
+        for i, duration in enumerate([6.016, 5.995, 2.5]):
+            if i == 1:
+                self.resume.wait(5)
+            with open(pattern % i, 'wb') as f:
+                f.write(b'TS%d' % i)
+            lines += [f'#EXTINF:{duration},', os.path.basename(pattern % i)]
+            with open(index, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def get(self, name, *args):
+        return self.client.get(reverse(name, args=[self.song.pk, 'low', *args]))
+
+    def test_playlist_grows_while_encoding(self):
+        response = self.get('stream_song_hls_playlist')
+        self.assertEqual(response.status_code, 200)
+        playlist = response.content.decode()
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:EVENT', playlist)
+        self.assertNotIn('#EXT-X-ENDLIST', playlist)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(b''.join(self.get('stream_song_hls_segment', 0).streaming_content), b'TS0') # Playable right away
+
+        self.resume.set()
+        self.assertEqual(b''.join(self.get('stream_song_hls_segment', 2).streaming_content), b'TS2') # Waits for it
+        for _ in range(50):
+            playlist = self.get('stream_song_hls_playlist').content.decode()
+            if '#EXT-X-ENDLIST' in playlist:
+                break
+            time.sleep(0.1)
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:VOD', playlist)
+        self.assertEqual(playlist.count('#EXTINF:'), 3)
+        self.assertEqual(self.get('stream_song_hls_segment', 3).status_code, 404)
+
+
+class ConditionalContentTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('listener')
+        self.client.force_login(self.user)
+
+    def test_unchanged_page_is_304(self):
+        first = self.client.get(reverse('home'))
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+        second = self.client.get(reverse('home'))
+        self.assertNotEqual(first.content, second.content) # The CSRF token is masked differently on each render
+        self.assertEqual(first['ETag'], second['ETag'])
+        response = self.client.get(reverse('home'), headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_json_etag_follows_content(self):
+        self.write_media('songs/a.mp3', b'\xff\xfb' * 10)
+        song = Song.objects.create(title='Song', file='songs/a.mp3')
+        etag = self.client.get(reverse('view_queue'))['ETag']
+        self.assertEqual(self.client.get(reverse('view_queue'), headers={'If-None-Match': etag}).status_code, 304)
+        QueueItem.objects.create(queue=Queue.objects.get(user=self.user), song=song, order=1)
+        response = self.client.get(reverse('view_queue'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_versioned_stream_is_immutable(self):
+        path = self.write_media('songs/a.mp3', b'\xff\xfb' * 10)
+        song = Song.objects.create(title='Song', file='songs/a.mp3')
+        url = song_stream_url(song)
+        self.assertTrue(url.endswith(f'?v={file_version(path)}'))
+        self.assertEqual(self.client.get(url)['Cache-Control'], 'private, max-age=31536000, immutable')
+        stale = self.client.get(reverse('stream_song', args=[song.pk]) + '?v=0000')
+        self.assertEqual(stale['Cache-Control'], 'private, no-cache')
+
+
+@override_settings(QUEUE_LOOKAHEAD=2, QUEUE_LOOKAHEAD_MAX=3)
+class QueueLookaheadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('listener')
+        self.client.force_login(self.user)
+        queue, _ = Queue.objects.get_or_create(user=self.user)
+        self.write_media('songs/a.mp3', b'\xff\xfb' * 10)
+        for order in range(1, 6):
+            QueueItem.objects.create(queue=queue, song=Song.objects.create(title=f'Song {order}', file='songs/a.mp3'), order=order)
+
+    def next(self, **params):
+        return self.client.get(reverse('get_next_in_queue'), params).json()
+
+    def test_returns_upcoming_items(self):
+        data = self.next()
+        self.assertEqual(data['song']['title'], 'Song 1')
+        self.assertEqual([item['order'] for item in data['upcoming']], [2, 3]) # QUEUE_LOOKAHEAD
+        self.assertEqual(data['upcoming'][0]['title'], 'Song 2')
+        self.assertTrue(data['upcoming'][0]['url'])
+        queue = Queue.objects.get(user=self.user)
+        self.assertEqual((queue.currently_playing_order, queue.current_track_index), (1, 2))
+
+    def test_lookahead_param(self):
+        self.assertEqual(self.next(lookahead=10)['upcoming'][-1]['order'], 4) # Capped at QUEUE_LOOKAHEAD_MAX
+        data = self.next(lookahead=0)
+        self.assertEqual((data['song']['title'], data['upcoming']), ('Song 2', []))
+        self.assertEqual(Queue.objects.get(user=self.user).current_track_index, 3) # Still advanced
+        self.assertEqual(len(self.next(lookahead='x')['upcoming']), 2)
+
+    def test_end_of_queue(self):
+        for _ in range(4):
+            self.next()
+        data = self.next()
+        self.assertEqual((data['song']['title'], data['upcoming']), ('Song 5', []))
+        self.assertEqual(self.next()['status'], 'end_of_queue')
+
+
+class FakeDecoder:
+    """subprocess.Popen replacement whose stdout is `audio` as ffmpeg's f32le output."""
+
+    def __init__(self, audio):
+        self.stdout = BytesIO(audio.astype('<f4').tobytes())
+        self.stderr = BytesIO(b'')
+        self.returncode = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class LoudnessTests(TestCase):
+    @override_settings(LOUDNESS_TARGET_LUFS=-18)
+    def test_replay_gain(self):
+        self.assertEqual(loudness.replay_gain(-9.5), -8.5)
+        self.assertEqual(loudness.replay_gain(-23.123), 5.12)
+        self.assertIsNone(loudness.replay_gain(None))
+
+    @skipUnless(loudness.loudness_available(), "NumPy is not installed")
+    def test_integrated_loudness_gates(self):
+        np = loudness.np
+        self.assertIsNone(loudness.integrated_loudness([0.1] * 3)) # Shorter than a 400 ms block
+        self.assertIsNone(loudness.integrated_loudness([0.0] * 50)) # Silence
+        self.assertAlmostEqual(loudness.integrated_loudness([0.5] * 50), -0.691 + 10 * np.log10(0.5))
+        # The quiet half (-50 LUFS) passes the absolute gate but not the relative one: only the 47 loud
+        # blocks and the 3 spanning the fade are averaged, not -6.7 LUFS over all of them
+        with_quiet = loudness.integrated_loudness([0.5] * 50 + [1e-5] * 50)
+        self.assertAlmostEqual(with_quiet, -0.691 + 10 * np.log10((47 * 0.5 + 0.375 + 0.25 + 0.125) / 50), places=4)
+
+    @skipUnless(loudness.loudness_available(), "NumPy is not installed")
+    def test_reference_sine(self):
+        """BS.1770: a full scale 997 Hz sine in one channel measures -3.01 LUFS."""
+        np = loudness.np
+        t = np.arange(loudness.SAMPLE_RATE * 5) / loudness.SAMPLE_RATE
+        audio = np.zeros((t.size, 2))
+        audio[:, 0] = np.sin(2 * np.pi * 997 * t)
+        with mock.patch('player.loudness.subprocess.Popen', return_value=FakeDecoder(audio)):
+            integrated, peak = loudness.analyze_file('song.mp3')
+        self.assertAlmostEqual(integrated, -3.01, delta=0.1)
+        self.assertAlmostEqual(peak, 1.0, places=3)
+
+
+# A few seconds of silent 128 kbps MPEG-1 Layer III frames, enough for mutagen to read duration and bitrate
+MP3_FRAMES = (b'\xff\xfb\x90\x64' + b'\x00' * 413) * 400
+
+
+class RescanMediaTests(MediaRootMixin, TransactionTestCase):
+    # TransactionTestCase: the command closes the connection before starting its worker processes
+
+    def rescan(self):
+        out = StringIO()
+        call_command('rescan_media', workers=1, stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_files_are_skipped(self):
+        self.write_media('songs/a.mp3', MP3_FRAMES)
+        song = Song.objects.create(title='A', file='songs/a.mp3')
+        self.assertIn('Updated: 1', self.rescan())
+        song.refresh_from_db()
+        self.assertEqual(song.bitrate, 128)
+        self.assertAlmostEqual(song.duration.total_seconds(), 10.4, delta=0.1)
+        self.assertIn('Skipped, file unchanged since last scan: 1', self.rescan())
+
+    def test_changed_file_is_read_again(self):
+        path = self.write_media('songs/a.mp3', MP3_FRAMES)
+        Song.objects.create(title='A', file='songs/a.mp3')
+        self.rescan()
+        with open(path, 'ab') as f:
+            f.write(MP3_FRAMES)
+        self.assertIn('Skipped, file unchanged since last scan: 0', self.rescan())
+
+    def test_song_newly_linked_to_a_scanned_file(self):
+        self.write_media('songs/a.mp3', MP3_FRAMES)
+        Song.objects.create(title='A', file='songs/a.mp3')
+        self.rescan()
+        shared = Song.objects.create(title='B', file='songs/a.mp3')
+        self.rescan()
+        shared.refresh_from_db()
+        self.assertEqual(shared.bitrate, 128)
+
+
+class ImportFolderTests(MediaRootMixin, TransactionTestCase):
+    # TransactionTestCase: the command closes the connection before starting its worker processes
+
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def write_song(self, name, **tags):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(MP3_FRAMES)
+        id3 = EasyID3()
+        id3.update(tags)
+        id3.save(path)
+        return path
+
+    def test_links_fall_back_to_hard_links_then_copies(self):
+        source = self.write_song('a.mp3', title='A')
+        with mock.patch('os.symlink', side_effect=OSError('symlinks need admin rights')):
+            self.assertIsNone(_read_and_place((source, 'imports/linked.mp3', 'symlink'))[-1])
+            with mock.patch('os.link', side_effect=OSError('other volume')):
+                self.assertIsNone(_read_and_place((source, 'imports/copied.mp3', 'symlink'))[-1])
+        linked = os.path.join(self.media_root, 'imports/linked.mp3')
+        copied = os.path.join(self.media_root, 'imports/copied.mp3')
+        self.assertFalse(os.path.islink(linked))
+        self.assertTrue(os.path.samefile(linked, source))
+        self.assertFalse(os.path.samefile(copied, source))
+        with open(copied, 'rb') as f, open(source, 'rb') as original:
+            self.assertEqual(f.read(), original.read())
+
+    def test_release_kind(self):
+        def tags(track_total=None, release_type=None):
+            return {'track_total': track_total, 'release_type': release_type}
+        self.assertEqual(release_kind([tags(2), tags(None), tags(12)]), 'album') # Largest track count
+        self.assertEqual(release_kind([tags(2), tags(2)]), 'single')
+        self.assertEqual(release_kind([tags(5), tags(12, 'ep')]), 'ep') # MusicBrainz type wins
+        self.assertEqual(release_kind([tags()]), 'album')
+
+    def test_album_files_share_one_release(self):
+        # Only the last file carries the real track count, the others would each look like a single
+        self.write_song('1.mp3', title='One', artist='Band', album='Live', tracknumber='1/2')
+        self.write_song('2.mp3', title='Two', artist='Band', album='Live', tracknumber='2/2')
+        self.write_song('3.mp3', title='Three', artist='Band', album='Live', tracknumber='3/12')
+        call_command('import_folder', self.folder, workers=1, stdout=StringIO())
+        album = Album.objects.get(title='Live')
+        self.assertEqual(sorted(Song.objects.filter(album=album).values_list('track_number', flat=True)), [1, 2, 3])
+        self.assertFalse(Song.objects.filter(single__isnull=False).exists())
+        self.assertEqual(list(album.artists.values_list('name', flat=True)), ['Band'])
+        self.assertTrue(os.path.islink(os.path.join(self.media_root, 'imports', os.path.basename(self.folder), '1.mp3')))
+
+
+class AudioStoreTests(MediaRootMixin, TestCase):
+    def test_identical_content_is_stored_once(self):
+        first = self.write_media('songs/A/one.mp3', b'same audio')
+        second = self.write_media('songs/B/two.MP3', b'same audio')
+        stored = store_file(first)
+        self.assertEqual(store_file(second, move=True), stored)
+        self.assertEqual(stored, audio_path_for_hash(hash_file(first), '.mp3'))
+        self.assertTrue(is_stored(stored))
+        self.assertTrue(os.path.exists(first)) # Left in place without move
+        self.assertFalse(os.path.exists(second))
+        digest = hash_file(first)
+        self.assertEqual(stored, f'audio/{digest[:2]}/{digest[2:4]}/{digest}.mp3')
+        self.assertFalse(is_stored('songs/A/one.mp3'))
+
+    def test_migrate_audio_storage(self):
+        self.write_media('songs/A/one.mp3', b'same audio')
+        self.write_media('songs/B/dup.mp3', b'same audio')
+        self.write_media('songs/B/other.flac', b'other audio')
+        one = Song.objects.create(title='One', file='songs/A/one.mp3')
+        dup = Song.objects.create(title='Dup', file='songs/B/dup.mp3')
+        other = Song.objects.create(title='Other', file='songs/B/other.flac')
+        missing = Song.objects.create(title='Missing', file='songs/B/gone.mp3')
+        DownloadedFile.objects.create(spotify_id='t1', path='songs/A/one.mp3')
+        MediaFileFingerprint.objects.create(path='songs/B/other.flac', size=11, mtime_ns=1)
+
+        call_command('migrate_audio_storage', batch_size=2, stdout=StringIO())
+
+        for song in (one, dup, other, missing):
+            song.refresh_from_db()
+        self.assertTrue(is_stored(one.file.name))
+        self.assertEqual(one.file.name, dup.file.name)
+        self.assertTrue(is_stored(other.file.name))
+        self.assertEqual(missing.file.name, 'songs/B/gone.mp3')
+        self.assertEqual(DownloadedFile.objects.get(spotify_id='t1').path, one.file.name)
+        self.assertEqual(list(MediaFileFingerprint.objects.values_list('path', flat=True)), [other.file.name])
+        with open(one.file.path, 'rb') as f:
+            self.assertEqual(f.read(), b'same audio')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'songs'))) # Old files and emptied folders removed
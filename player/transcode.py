@@ -0,0 +1,229 @@
+"""Smaller encodes of songs for slow connections.
+
+spotdl files range from 128k MP3 to FLAC. Every song can also be served as a
+low, medium or high bitrate Opus or AAC variant (TRANSCODE_LADDER), made by a
+local ffmpeg binary either ahead of time (manage.py transcode_songs) or the
+first time a client asks for one. On demand requests don't wait for ffmpeg:
+the original is streamed while a bounded pool of TRANSCODE_WORKERS threads
+makes the variant for next time.
+
+Variants live under MEDIA_ROOT/TRANSCODE_DIR/<song_id>/, named after the
+source's size and mtime so a replaced source never serves a stale encode.
+The directory is capped at TRANSCODE_CACHE_MAX_BYTES: every hit touches the
+file's access time and the least recently used variants are deleted first.
+Encodes add their size to a running total, so the cache is only walked when
+that total is over the limit or TRANSCODE_EVICT_INTERVAL has passed (other
+processes encode too), not after every encode.
+
+Browsers only send the ECT client hint after a response asked for it with
+Accept-CH; pages and streams do (advertise_client_hints). Requests before that
+(the first page of a session) get TRANSCODE_DEFAULT_QUALITY.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# codec -> (extension, content type, ffmpeg output arguments)
+CODECS = {
+    'opus': ('.opus', 'audio/ogg', ['-c:a', 'libopus', '-vbr', 'on', '-f', 'ogg']),
+    'aac': ('.m4a', 'audio/mp4', ['-c:a', 'aac', '-movflags', '+faststart', '-f', 'mp4']),
+}
+QUALITIES = ('low', 'medium', 'high')
+# Effective connection types (ECT client hint) that get the low variant
+SLOW_CONNECTION_TYPES = ('slow-2g', '2g', '3g')
+CLIENT_HINTS = 'ECT, Save-Data' # Read by pick_variant
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = set() # Variant paths being encoded right now
+_pending_lock = threading.Lock()
+_evict_lock = threading.Lock()
+_cache_bytes = None # Size at the last scan plus what was encoded since, None before the first scan
+_last_scan = 0.0 # time.monotonic() of the last scan
+_cache_size_lock = threading.Lock()
+
+
+def ffmpeg_available():
+    return shutil.which(settings.FFMPEG_BINARY) is not None
+
+
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, settings.TRANSCODE_DIR)
+
+
+def variant_path(song, codec, quality):
+    """Absolute path of a song's variant, tied to the current source file. Raises OSError without a source."""
+    stat = os.stat(song.file.path)
+    extension = CODECS[codec][0]
+    return os.path.join(cache_root(), str(song.pk), f"{stat.st_size:x}-{stat.st_mtime_ns:x}_{codec}_{quality}{extension}")
+
+
+def pick_variant(request):
+    """(codec, quality) the client asked for, or None for the original file.
+    Reads ?quality=low|medium|high|original and ?codec=opus|aac, then the Save-Data and ECT client hints."""
+    quality = request.GET.get('quality', '').lower()
+    if not quality:
+        if request.headers.get('Save-Data', '').lower() == 'on' or request.headers.get('ECT', '').lower() in SLOW_CONNECTION_TYPES:
+            quality = 'low'
+        else:
+            quality = settings.TRANSCODE_DEFAULT_QUALITY
+    if quality not in QUALITIES:
+        return None
+    codec = request.GET.get('codec', settings.TRANSCODE_DEFAULT_CODEC).lower()
+    if codec not in CODECS:
+        codec = settings.TRANSCODE_DEFAULT_CODEC
+    return codec, quality
+
+
+def advertise_client_hints(response):
+    """Asks the browser for the hints pick_variant reads, from the next request on. No Critical-CH:
+    it would make the browser retry the first navigation of every session just for a network hint."""
+    response['Accept-CH'] = CLIENT_HINTS
+    return response
+
+
+def touch(path):
+    """Marks a variant as just used (explicit atime update, works on noatime mounts too)."""
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns)) # mtime stays, it is part of the ETag
+    except OSError:
+        pass
+
+
+def transcode(song, codec, quality, force=False):
+    """Encodes one variant with ffmpeg. Returns its path, or None if ffmpeg failed."""
+    target = variant_path(song, codec, quality)
+    if not force and os.path.exists(target):
+        touch(target)
+        return target
+    song_dir = os.path.dirname(target)
+    os.makedirs(song_dir, exist_ok=True)
+    extension, _, codec_args = CODECS[codec]
+    tmp_path = f"{target}.{threading.get_ident()}.tmp"
+    command = [
+        settings.FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', song.file.path,
+        '-map', '0:a:0', '-vn', '-map_metadata', '-1',
+        *codec_args, '-b:a', settings.TRANSCODE_LADDER[codec][quality],
+        tmp_path,
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True, timeout=settings.TRANSCODE_TIMEOUT)
+        os.replace(tmp_path, target)
+    except (OSError, subprocess.SubprocessError) as e:
+        stderr = getattr(e, 'stderr', None) or ''
+        print(f"Error transcoding song {song.pk} to {codec}/{quality}: {e} {stderr.strip()[-500:]}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    # Encodes of an older version of the source are never served again
+    prefix = os.path.basename(target).split('_', 1)[0] + '_'
+    for entry in os.scandir(song_dir):
+        if not entry.name.startswith(prefix) and not entry.name.endswith('.tmp'):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    note_encoded(os.path.getsize(target))
+    return target
+
+
+def evict(max_bytes=None):
+    """Deletes least recently used variants until the cache fits in TRANSCODE_CACHE_MAX_BYTES.
+    Returns (files removed, bytes freed)."""
+    global _cache_bytes, _last_scan
+    max_bytes = settings.TRANSCODE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    root = cache_root()
+    if not os.path.isdir(root):
+        return 0, 0
+    with _evict_lock:
+        files = []
+        total = 0
+        for song_dir in os.scandir(root):
+            if not song_dir.is_dir():
+                continue
+            for entry in os.scandir(song_dir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_atime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        removed = freed = 0
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass # Removed by another process meanwhile
+            total -= size
+            removed += 1
+            freed += size
+        with _cache_size_lock:
+            _cache_bytes = total
+            _last_scan = time.monotonic()
+        return removed, freed
+
+
+def note_encoded(size):
+    """Adds newly encoded bytes to the cache total, and runs evict() only when the total is over
+    TRANSCODE_CACHE_MAX_BYTES or the last scan is older than TRANSCODE_EVICT_INTERVAL."""
+    global _cache_bytes
+    with _cache_size_lock:
+        if _cache_bytes is not None:
+            _cache_bytes += size
+        due = (_cache_bytes is None or _cache_bytes > settings.TRANSCODE_CACHE_MAX_BYTES
+               or time.monotonic() - _last_scan > settings.TRANSCODE_EVICT_INTERVAL)
+    if due:
+        evict()
+
+
+def get_pool():
+    """Pool shared by every background ffmpeg job (variants and HLS segments)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.TRANSCODE_WORKERS, thread_name_prefix='transcode')
+        return _pool
+
+
+def _run_scheduled(song, codec, quality, target):
+    try:
+        transcode(song, codec, quality)
+    finally:
+        with _pending_lock:
+            _pending.discard(target)
+
+
+def schedule_transcode(song, codec, quality):
+    """Queues a variant for background encoding. Returns the Future, or None when it is
+    already queued or ffmpeg isn't installed."""
+    if not ffmpeg_available():
+        return None
+    target = variant_path(song, codec, quality)
+    with _pending_lock:
+        if target in _pending:
+            return None
+        _pending.add(target)
+    return get_pool().submit(_run_scheduled, song, codec, quality, target)
+
+
+def cached_variant(song, codec, quality):
+    """Path of the variant if it has been made already (and marks it used), otherwise queues it and returns None."""
+    try:
+        target = variant_path(song, codec, quality)
+    except OSError:
+        return None
+    if os.path.exists(target):
+        touch(target)
+        return target
+    if settings.TRANSCODE_ON_DEMAND:
+        schedule_transcode(song, codec, quality)
+    return None
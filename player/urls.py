@@ -7,6 +7,12 @@ urlpatterns = [
     path('login/', views.login, name='login'),
     path('logout/', views.logout, name='logout'),
     path('add-spotify/', views.add_spotify_content, name='add_spotify_content'),
+    path('ingest/<int:job_id>/progress/', views.ingest_job_progress, name='ingest_job_progress'),
+    path('stream/<int:song_id>/', views.stream_song, name='stream_song'),
+    path('waveform/<int:song_id>/', views.song_waveform, name='song_waveform'),
+    path('stream/<int:song_id>/hls/master.m3u8', views.stream_song_hls, name='stream_song_hls'),
+    path('stream/<int:song_id>/hls/<str:quality>.m3u8', views.stream_song_hls_playlist, name='stream_song_hls_playlist'),
+    path('stream/<int:song_id>/hls/<str:quality>/<int:index>.ts', views.stream_song_hls_segment, name='stream_song_hls_segment'),
     path('browse/', views.browse_media, name='browse_media'), # Renamed from browse_songs
     # Remove URLs for adding/removing songs from library
     # path('library/add/<int:song_id>/', views.add_song_to_library, name='add_song_to_library'), # Removed
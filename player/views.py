@@ -1,26 +1,27 @@
 from django.shortcuts import render, redirect, get_object_or_404 # Add get_object_or_404
-from django.http import HttpResponse, HttpResponseServerError, HttpResponseRedirect, JsonResponse # Add JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseServerError, JsonResponse # Add JsonResponse
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt, csrf_protect # Import csrf_protect
 from django.views.decorators.http import require_POST, require_http_methods # Add require_POST, require_http_methods
 from django.conf import settings
-from django.utils.text import slugify
-from datetime import timedelta, date # Added date
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils import timezone
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import subprocess # For running spotdl
+import math
 import os
-import requests # For downloading images
-from django.core.files.base import ContentFile
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import re # For parsing URLs
-import unicodedata # Import for slugify improvement
-from django.db import transaction # Import transaction
+from django.db import transaction, connection # Import transaction
 from django.db.models import Max # Import Max
 import json # Add json import
 import traceback # Ensure traceback is imported if not already
-import syncedlyrics # Import the syncedlyrics library
 # --- MODIFICATION START: Import lyrics providers ---
 # Note: Direct import and use of providers might be complex.
 # Relying on spotdl command line with --lyrics is simpler.
@@ -30,7 +31,18 @@ from django.core.exceptions import ObjectDoesNotExist # Import ObjectDoesNotExis
 
 
 from .forms import LoginForm, SpotifyUrlForm # Import the new form
-from .models import Artist, Album, Song, EP, Single, Playlist, Library, Queue, QueueItem # Add Queue, QueueItem
+from .models import Artist, Album, Song, EP, Single, Playlist, Library, Queue, QueueItem, IngestJob, DownloadedFile, PlaylistSong # Add Queue, QueueItem
+from .ingest import enqueue_ingest_job
+from .spotify_metadata import SpotifyMetadata
+from .ingest_writer import write_track_batch, release_model_for, sync_playlist_songs
+from .covers import fetch_covers
+from .audio_store import store_file
+from .lyrics import schedule_lyrics, cached_misses, lyrics_lookup_key, NO_LYRICS
+from .spotify_client import RateLimitedSpotify, get_rate_limiter
+from .streaming import IMMUTABLE_CACHE_CONTROL, file_version, song_stream_url, stream_file
+from .transcode import CODECS, QUALITIES, advertise_client_hints, cached_variant, ffmpeg_available, pick_variant, touch
+from . import hls
+from .waveform import current_waveform, schedule_waveform
 from itertools import chain # Import chain
 
 # Spotify Client Setup
@@ -41,172 +53,178 @@ try:
         sp = None
     else:
         client_credentials_manager = SpotifyClientCredentials(client_id=settings.SPOTIPY_CLIENT_ID, client_secret=settings.SPOTIPY_CLIENT_SECRET)
-        sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+        # Shared token bucket (Redis when configured) with 429 backoff, see spotify_client.py
+        sp = RateLimitedSpotify(client_credentials_manager=client_credentials_manager, rate_limiter=get_rate_limiter())
 except Exception as e:
     print(f"Error initializing Spotify client: {e}")
     sp = None # Set sp to None if initialization fails
 
-# Helper function to download image - MODIFIED
-def download_image(url, obj, field_name, save_name):
-    """Downloads image, assigns ContentFile to obj.field_name, returns True on success."""
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+# Batched + cached metadata lookups, use this instead of calling sp.track()/sp.album() directly
+spotify_metadata = SpotifyMetadata(sp)
 
-        # Create a ContentFile from the response content
-        img_content = ContentFile(response.content)
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.flac', '.ogg', '.opus')
 
-        # --- MODIFICATION START: Set the name attribute on the ContentFile ---
-        img_content.name = save_name
-        # --- MODIFICATION END ---
+def safe_path_component(value, fallback):
+    """Makes a metadata value usable as a single directory or file name."""
+    value = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '', str(value or '')).strip().strip('.')
+    return value[:100] or fallback
 
-        # Assign the ContentFile to the object's field attribute directly
-        # The actual saving to storage happens when obj.save() is called later
-        setattr(obj, field_name, img_content)
-        # Store the intended save name separately if needed, though Django handles naming
-        # obj._image_save_name = save_name # Example if needed elsewhere
 
-        print(f"Image content prepared for {field_name} on object {obj.pk or '(unsaved)'} with name '{save_name}'")
-        return True # Indicate success in preparing the image content
+def spotdl_target_path(track_id, title=None, artist=None, album=None):
+    """Final location (relative to MEDIA_ROOT, without extension) for a downloaded track.
+    Same layout spotdl used to produce: {artist}/{album}/{title} [{track-id}]"""
+    download_dir = os.path.relpath(settings.SPOTDL_DOWNLOAD_PATH, settings.MEDIA_ROOT)
+    return os.path.join(
+        download_dir,
+        safe_path_component(artist, 'Unknown Artist'),
+        safe_path_component(album, 'Unknown Album'),
+        f"{safe_path_component(title, 'Unknown Title')} [{track_id}]",
+    )
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading image {url}: {e}")
-        return False
-    except Exception as e:
-        print(f"Error preparing image content for {url}: {e}")
-        return False
 
-# Helper function to parse release date
-def parse_release_date(release_date_str):
-    if not release_date_str:
-        return None
+# Helper function to run SpotDL and find file - MODIFIED
+def run_spotdl_and_get_path(spotify_url, track_id, expected_title=None, expected_artist=None, expected_album=None):
+    """Runs spotdl for one track and returns the downloaded file relative to MEDIA_ROOT."""
+    found_paths, batch_logs = run_spotdl_batch({track_id: spotdl_target_path(track_id, expected_title, expected_artist, expected_album)})
+    for log_line in batch_logs:
+        print(log_line)
+    if track_id not in found_paths:
+        raise FileNotFoundError(f"SpotDL ran, but no audio file was produced for ID '{track_id}'. Check SpotDL logs.")
+    return found_paths[track_id]
+
+
+def run_spotdl_batch(track_targets):
+    """Downloads {track_id: target path from spotdl_target_path} with one spotdl process per SPOTDL_BATCH_SIZE tracks.
+    Returns ({track_id: path relative to MEDIA_ROOT}, logs) for the files that were downloaded."""
+    batch_logs = []
+    found_paths = {}
+    to_download = []
+    manifest = dict(DownloadedFile.objects.filter(spotify_id__in=list(track_targets)).values_list('spotify_id', 'path'))
+    for track_id in track_targets:
+        existing_path = manifest.get(track_id)
+        if existing_path and os.path.exists(os.path.join(settings.MEDIA_ROOT, existing_path)):
+            found_paths[track_id] = existing_path # Downloaded before (e.g. the Song row was recreated)
+        else:
+            to_download.append(track_id)
+    if found_paths:
+        batch_logs.append(f"Reused {len(found_paths)} previously downloaded files from the download manifest.")
+    if not to_download:
+        return found_paths, batch_logs
+
+    # spotdl writes into a private staging directory as {track-id}.{ext}, so each
+    # output file is known up front and no directory scan is needed to find it
+    staging_dir = os.path.join(settings.SPOTDL_DOWNLOAD_PATH, '.staging', uuid.uuid4().hex)
+    os.makedirs(staging_dir, exist_ok=True)
+    output_format = os.path.join(staging_dir, "{track-id}.{output-ext}")
+    batch_size = max(1, settings.SPOTDL_BATCH_SIZE)
+
     try:
-        parts = release_date_str.split('-')
-        if len(parts) == 1: # YYYY
-            return date(int(parts[0]), 1, 1)
-        elif len(parts) == 2: # YYYY-MM
-            return date(int(parts[0]), int(parts[1]), 1)
-        else: # YYYY-MM-DD
-            return date(int(parts[0]), int(parts[1]), int(parts[2]))
-    except (ValueError, TypeError):
-        print(f"Could not parse date: {release_date_str}")
-        return None # Invalid date format or type
-
-# Slightly improved slugify function (handles Unicode better)
-def better_slugify(value):
-    """
-    Convert spaces or repeated dashes to single dashes. Remove characters that
-    aren't alphanumerics, underscores, or hyphens. Convert to lowercase. Also strip leading/trailing whitespace.
-    Handles Unicode characters.
-    """
-    value = str(value)
-    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
-    value = re.sub(r'[^\w\s-]', '', value).strip().lower()
-    return re.sub(r'[-\s]+', '-', value)
+        for start in range(0, len(to_download), batch_size):
+            chunk = to_download[start:start + batch_size]
+            cmd = ['spotdl', 'download']
+            cmd.extend(f"https://open.spotify.com/track/{track_id}" for track_id in chunk)
+            cmd.extend(['--output', output_format, '--threads', str(settings.SPOTDL_THREADS)])
+            print(f"Running spotdl for {len(chunk)} tracks (batch {start // batch_size + 1})")
+            try:
+                # No check=True: a failed track shouldn't throw away the rest of the batch
+                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace',
+                                        timeout=settings.SPOTDL_TIMEOUT)
+            except FileNotFoundError:
+                raise Exception("SpotDL command not found. Is spotdl installed and in your system's PATH?")
+            except subprocess.TimeoutExpired:
+                # Killed, whatever it finished before that is already in the staging directory
+                result = None
+                batch_logs.append(f"SpotDL timed out after {settings.SPOTDL_TIMEOUT}s for a batch of {len(chunk)} tracks.")
+            if result is not None:
+                print(f"SpotDL Output:\n{result.stdout}")
+            if result is not None and result.returncode != 0:
+                print(f"SpotDL Error Output:\n{result.stderr}")
+                batch_logs.append(f"SpotDL exited with code {result.returncode} for a batch of {len(chunk)} tracks. Error hint: {result.stderr[:500]}")
+
+            manifest_entries = []
+            for track_id in chunk:
+                staged_file = next((os.path.join(staging_dir, track_id + ext) for ext in AUDIO_EXTENSIONS
+                                    if os.path.exists(os.path.join(staging_dir, track_id + ext))), None)
+                if not staged_file:
+                    continue
+                if settings.AUDIO_CONTENT_ADDRESSED:
+                    relative_path = store_file(staged_file, move=True) # ab/cd/<sha256>.ext, shared by identical downloads
+                    final_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+                else:
+                    relative_path = track_targets[track_id] + os.path.splitext(staged_file)[1]
+                    final_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+                    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                    os.replace(staged_file, final_path)
+                manifest_entries.append(DownloadedFile(spotify_id=track_id, path=relative_path, size=os.path.getsize(final_path)))
+                found_paths[track_id] = relative_path
+            DownloadedFile.objects.bulk_create(
+                manifest_entries, update_conflicts=True, unique_fields=['spotify_id'], update_fields=['path', 'size', 'downloaded_at']
+            )
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
+    missing = len(track_targets) - len(found_paths)
+    batch_logs.append(f"SpotDL batch finished: {len(found_paths)} of {len(track_targets)} tracks available" + (f", {missing} missing." if missing else "."))
+    return found_paths, batch_logs
 
-# Helper function to run SpotDL and find file - MODIFIED
-def run_spotdl_and_get_path(spotify_url, track_id, expected_title=None, expected_artist=None):
-    """Runs spotdl and attempts to find the downloaded file relative to MEDIA_ROOT."""
-    os.makedirs(settings.SPOTDL_DOWNLOAD_PATH, exist_ok=True)
-    # Try using {track-id} instead of {id}. If spotdl errors, remove it.
-    # If removing, the finding logic will rely more heavily on title/artist matching.
-    output_format = os.path.join(settings.SPOTDL_DOWNLOAD_PATH, "{artist}/{album}/{title} [{track-id}].{output-ext}")
-    # Alternative if {track-id} causes errors:
-    # output_format = os.path.join(settings.SPOTDL_DOWNLOAD_PATH, "{artist}/{album}/{title}.{output-ext}")
-
-    cmd = [
-        'spotdl',
-        spotify_url,
-        '--output', output_format,
-        # --- REMOVED: '--lyrics', 'musixmatch', ---
-        # '--log-level', 'DEBUG'
-    ]
-    print(f"Running command: {' '.join(cmd)}")
+
+def song_needs_download(song):
+    """Returns (needs_download, reason) for a Song, checking that its file still exists in storage."""
+    if not song.file:
+        return True, f"Song '{song.title}' has no file assigned."
+    # Use try-except for storage.exists as it might fail if song.file.name is invalid
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, encoding='utf-8', errors='replace')
-        print(f"SpotDL Success Output:\n{result.stdout}") # Print full stdout
-    except subprocess.CalledProcessError as e:
-        print(f"SpotDL Error Output:\n{e.stderr}") # Print full stderr
-        # Check if error is due to invalid output format placeholder
-        if "ValueError: Invalid format specifier" in e.stderr or "unknown placeholder" in e.stderr.lower():
-             print("WARNING: SpotDL output format might be invalid (e.g., {track-id} not supported). Consider simplifying the format string.")
-        raise Exception(f"SpotDL failed (return code {e.returncode}). Check logs. Error hint: {e.stderr[:500]}...")
-    except FileNotFoundError:
-        raise Exception("SpotDL command not found. Is spotdl installed and in your system's PATH?")
-
-
-    # --- File Finding Logic ---
-    search_dir = settings.SPOTDL_DOWNLOAD_PATH
-    found_file_relative_path = None
-    print(f"\nSearching for file containing ID '{track_id}' in '{search_dir}' and subdirectories...")
-
-    slug_title = better_slugify(expected_title) if expected_title else None
-    slug_artist = better_slugify(expected_artist) if expected_artist else None
-
-    possible_matches = []
-    checked_files_count = 0
-
-    for root, dirs, files in os.walk(search_dir):
-        # print(f"Checking directory: {root}") # Verbose logging
-        for file in files:
-            checked_files_count += 1
-            full_path = os.path.join(root, file)
-            # Check if it's an audio file first
-            if not file.lower().endswith(('.mp3', '.m4a', '.flac', '.ogg', '.opus')):
-                continue
-
-            # Primary check: Spotify ID in filename (if format included it)
-            # If format didn't include {track-id}, this check might always fail.
-            id_in_filename = track_id in file
-
-            # Secondary check: Title/Artist slugs in path/filename
-            relative_path_check = os.path.relpath(full_path, settings.MEDIA_ROOT)
-            path_slug = better_slugify(relative_path_check)
-            title_match = slug_title and slug_title in path_slug
-            artist_match = slug_artist and slug_artist in path_slug
-
-            # Decide if it's a potential match
-            # Require ID match if {track-id} was expected, otherwise rely on title/artist
-            is_potential_match = False
-            match_score = 0
-            # If you removed {track-id} from output_format, adjust this logic:
-            if id_in_filename:
-                is_potential_match = True
-                match_score += 2 # Higher score for ID match
-                if title_match: match_score += 1
-                if artist_match: match_score += 1
-            elif title_match and artist_match: # Fallback if ID not in name
-                 is_potential_match = True
-                 match_score += 1 # Lower score for non-ID match
-
-            if is_potential_match:
-                 possible_matches.append({'path': relative_path_check, 'score': match_score, 'fullpath': full_path})
-                 print(f"  Potential match: {relative_path_check} (Score: {match_score}, ID in name: {id_in_filename}, Title Match: {title_match}, Artist Match: {artist_match})")
-
-
-    print(f"Checked {checked_files_count} files total.")
-    if not possible_matches:
-         # Check spotdl stdout for clues if possible
-         stdout_lines = result.stdout.splitlines()
-         downloaded_line = next((line for line in stdout_lines if "Downloaded" in line), None)
-         if downloaded_line:
-             print(f"SpotDL reported: {downloaded_line}")
-         else:
-             print("Could not find 'Downloaded' line in spotdl output.")
-         raise FileNotFoundError(f"SpotDL ran, but failed to find a matching audio file for ID '{track_id}' in '{search_dir}'. Searched {checked_files_count} files. Check SpotDL output format and logs.")
-
-    # Select the best match (highest score)
-    possible_matches.sort(key=lambda x: x['score'], reverse=True)
-    found_file_relative_path = possible_matches[0]['path']
-    print(f"Selected best match based on score: {found_file_relative_path}")
-
-    # Extra check: Verify the selected file actually exists (sanity check)
-    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, found_file_relative_path)):
-        print(f"ERROR: Selected file path does not exist: {os.path.join(settings.MEDIA_ROOT, found_file_relative_path)}")
-        raise FileNotFoundError(f"Internal error: Selected file path '{found_file_relative_path}' does not seem to exist.")
-
-    return found_file_relative_path
+        if not song.file.storage.exists(song.file.name):
+            return True, f"File '{song.file.name}' for song '{song.title}' not found in storage."
+    except Exception as e:
+        return True, f"Error checking storage for '{song.file.name}': {e}. Assuming download needed."
+    return False, f"File '{song.file.name}' already exists for song '{song.title}'. Skipping download."
+
+
+def find_complete_songs(track_ids):
+    """Returns {spotify_id: Song} for the tracks that already have a file and lyrics, or whose lyrics
+    lookup is a cached miss not due for another search yet, in a few queries.
+    Those need no Spotify, storage or lyrics work at all when they are added again."""
+    with_file = Song.objects.filter(spotify_id__in=list(track_ids)).exclude(file='').exclude(file__isnull=True)
+    complete = with_file.exclude(NO_LYRICS).in_bulk(field_name='spotify_id')
+    lookup_keys = {
+        song: lyrics_lookup_key(song.title, [artist.name for artist in song.artists.all()])[0]
+        for song in with_file.filter(NO_LYRICS).prefetch_related('artists')
+    }
+    misses = cached_misses(lookup_keys.values())
+    complete.update({song.spotify_id: song for song, key in lookup_keys.items() if key in misses})
+    return complete
+
+
+def download_songs_batch(songs_by_track_id, track_targets=None):
+    """Downloads the files for {track_id: Song} in one spotdl batch and links them.
+    track_targets ({track_id: spotdl_target_path(...)}) saves looking up artist/release names.
+    Returns (set of linked track ids, logs)."""
+    if not songs_by_track_id:
+        return set(), []
+    track_targets = dict(track_targets or {})
+    for track_id, song in songs_by_track_id.items():
+        if track_id in track_targets:
+            continue
+        release = song.get_release()
+        first_artist = song.artists.first()
+        track_targets[track_id] = spotdl_target_path(
+            track_id, song.title, first_artist.name if first_artist else None, release.title if release else None
+        )
+    found_paths, batch_logs = run_spotdl_batch(track_targets)
+    linked_ids = set()
+    for track_id, song in songs_by_track_id.items():
+        relative_file_path = found_paths.get(track_id)
+        if not relative_file_path:
+            batch_logs.append(f"Failed to download or link file for song '{song.title}' (ID: {track_id}): no output file found.")
+            continue
+        song.file.name = relative_file_path # Assign relative path from MEDIA_ROOT
+        linked_ids.add(track_id)
+        batch_logs.append(f"Successfully linked downloaded file for '{song.title}': {song.file.name}")
+    Song.objects.bulk_update([songs_by_track_id[track_id] for track_id in linked_ids], ['file'], batch_size=500)
+    for track_id in linked_ids:
+        schedule_waveform(songs_by_track_id[track_id]) # Seek bar peaks, computed in the background
+    return linked_ids, batch_logs
 
 
 # Existing views (home, register, login, logout)
@@ -476,9 +494,10 @@ def add_to_library(request):
 @login_required
 @csrf_protect # Use CSRF protection
 def add_spotify_content(request):
-    """View to add content from Spotify using a URL."""
+    """View to add content from Spotify using a URL. Processing is queued as an IngestJob."""
     form = SpotifyUrlForm()
     logs = [] # Collect logs to display on the template
+    job = None
     if request.method == 'POST':
         form = SpotifyUrlForm(request.POST)
         if (form.is_valid()):
@@ -492,55 +511,10 @@ def add_spotify_content(request):
                 content_id = match.group(2)
                 logs.append(f"Detected type: {content_type}, ID: {content_id}") # Log detection
 
-                if content_type == 'track':
-                    # Wrap processing in try-except to catch potential errors
-                    try:
-                        song, track_logs = process_spotify_track(content_id, request.user)
-                        logs.extend(track_logs) # Add track processing logs
-                        if song:
-                            logs.append(f"Successfully processed track: {song.title}")
-                            # Optionally redirect or just show success on the same page
-                            # return redirect('browse_songs')
-                        else:
-                            logs.append("Track processing finished, but no song object returned.")
-                    except Exception as e:
-                        logs.append(f"Error during track processing: {e}")
-                        import traceback
-                        logs.append(traceback.format_exc()) # Add full traceback to logs for debugging
-
-                elif content_type == 'album':
-                    # Wrap processing in try-except
-                    try:
-                        songs, release_obj, album_logs = process_spotify_album(content_id, request.user)
-                        logs.extend(album_logs) # Add album processing logs
-                        if release_obj:
-                            logs.append(f"Successfully processed album: {release_obj.title} ({len(songs)} tracks)")
-                            # return redirect('browse_songs')
-                        else:
-                            logs.append("Album processing finished, but no release object returned.")
-                    except Exception as e:
-                        logs.append(f"Error during album processing: {e}")
-                        import traceback
-                        logs.append(traceback.format_exc())
-
-                elif content_type == 'playlist':
-                     # Wrap processing in try-except
-                    try:
-                        songs, playlist_obj, playlist_logs = process_spotify_playlist(content_id, request.user)
-                        logs.extend(playlist_logs) # Add playlist processing logs
-                        if playlist_obj:
-                            logs.append(f"Successfully processed playlist: {playlist_obj.name} ({len(songs)} tracks)")
-                            # return redirect('browse_songs')
-                        else:
-                            logs.append("Playlist processing finished, but no playlist object returned.")
-                    except Exception as e:
-                        logs.append(f"Error during playlist processing: {e}")
-                        import traceback
-                        logs.append(traceback.format_exc())
-
-                # Handle Artist type if needed (currently not processed)
-                elif content_type == 'artist':
-                    logs.append("Artist URL detected, but processing not implemented yet.")
+                if content_type in ('track', 'album', 'playlist', 'artist'):
+                    # Downloads can take minutes, so hand the work to the ingest workers
+                    job = enqueue_ingest_job(request.user, spotify_url, content_type, content_id)
+                    logs.append(f"Queued {content_type} for processing (job {job.id}).")
                 else:
                     # This case should ideally not be reached with the regex used
                     logs.append(f"Unsupported Spotify URL type: {content_type}")
@@ -554,13 +528,196 @@ def add_spotify_content(request):
         else:
              logs.append("Form is invalid. Please check the URL.")
 
+    recent_jobs = IngestJob.objects.filter(user=request.user)[:10]
 
     # Always render the template, showing the form and any logs/errors
-    return render(request, 'add_spotify_content.html', {'form': form, 'logs': logs})
+    return render(request, 'add_spotify_content.html', {'form': form, 'logs': logs, 'job': job, 'recent_jobs': recent_jobs})
+
+
+@login_required
+def ingest_job_progress(request, job_id):
+    """Returns the progress of an ingest job as JSON: per-track state, percent done and ETA."""
+    job = get_object_or_404(IngestJob, id=job_id, user=request.user)
+    tracks_data = [
+        {
+            'spotify_id': track.spotify_id,
+            'title': track.title,
+            'position': track.position,
+            'status': track.status,
+            'message': track.message,
+            'song_id': track.song_id,
+        }
+        for track in job.tracks.all()
+    ]
+    return JsonResponse({
+        'status': 'success',
+        'job': {
+            'id': job.id,
+            'status': job.status,
+            'content_type': job.content_type,
+            'spotify_id': job.spotify_id,
+            'total_tracks': job.total_tracks,
+            'completed_tracks': job.completed_tracks,
+            'failed_tracks': job.failed_tracks,
+            'percent_done': job.percent_done(),
+            'eta_seconds': job.eta_seconds(),
+            'error': job.error,
+            'logs': job.log.splitlines() if job.log else [],
+            'created_at': job.created_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'tracks': tracks_data,
+        },
+    })
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def stream_song(request, song_id):
+    """Serves a song's audio file with Range support, so the player can seek without downloading it all.
+    A transcoded variant is sent instead when the client hints at one and it has been made already."""
+    song = get_object_or_404(Song, pk=song_id)
+    if not song.file:
+        raise Http404("Song has no audio file.")
+    # A URL with the current ?v= never changes content, so browsers don't have to revalidate it
+    versioned = request.GET.get('v') and request.GET.get('v') == file_version(song.file.path)
+    cache_control = 'private, ' + IMMUTABLE_CACHE_CONTROL if versioned else 'private, no-cache'
+    variant = pick_variant(request)
+    if variant:
+        variant_file = cached_variant(song, *variant)
+        if variant_file:
+            try:
+                response = stream_file(request, variant_file, content_type=CODECS[variant[0]][1], cache_control=cache_control)
+                patch_vary_headers(response, ('Save-Data', 'ECT'))
+                return advertise_client_hints(response)
+            except FileNotFoundError:
+                pass # Evicted just now, fall back to the original
+        cache_control = 'private, no-cache' # The variant replaces this response once it's ready
+    try:
+        return advertise_client_hints(stream_file(request, song.file.path, cache_control=cache_control))
+    except FileNotFoundError:
+        print(f"Audio file for song {song_id} is missing: {song.file.name}")
+        raise Http404("Audio file is missing.")
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def song_waveform(request, song_id):
+    """Waveform peaks of a song as int8 min/max pairs (application/octet-stream), for drawing the seek bar.
+    404 while they are still being computed."""
+    song = get_object_or_404(Song, pk=song_id)
+    if not song.file:
+        raise Http404("Song has no audio file.")
+    waveform = current_waveform(song)
+    if waveform is None:
+        raise Http404("Waveform is not ready yet.")
+    etag = f'"{waveform.source_version}-{waveform.buckets}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    response = HttpResponse(bytes(waveform.peaks), content_type='application/octet-stream')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Waveform-Buckets'] = str(waveform.buckets)
+    return response
+
+
+def get_hls_song(song_id):
+    """The song behind an HLS request, 404 when HLS is off or there is nothing to segment."""
+    if not settings.HLS_ENABLED or not ffmpeg_available():
+        raise Http404("HLS streaming is not enabled.")
+    song = get_object_or_404(Song, pk=song_id)
+    if not song.file or not os.path.exists(song.file.path):
+        raise Http404("Song has no audio file.")
+    return song
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def stream_song_hls(request, song_id):
+    """HLS master playlist listing the quality levels of a song. Queues their encodes."""
+    song = get_hls_song(song_id)
+    hls.prefetch_variants(song)
+    return HttpResponse(hls.master_playlist(song), content_type=hls.PLAYLIST_CONTENT_TYPE)
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def stream_song_hls_playlist(request, song_id, quality):
+    """HLS media playlist of one quality. While its encode runs in the background this is an EVENT
+    playlist of the segments finished so far, which the player reloads."""
+    song = get_hls_song(song_id)
+    if quality not in QUALITIES:
+        raise Http404("Unknown quality.")
+    segments, complete = hls.current_segments(song, quality)
+    if not complete:
+        hls.schedule_encode(song, quality)
+        segments, complete = hls.wait_for_segments(song, quality, settings.HLS_SEGMENT_WAIT)
+    if segments is None:
+        return HttpResponseServerError("Could not encode stream.")
+    response = HttpResponse(hls.media_playlist(song, quality, segments, complete), content_type=hls.PLAYLIST_CONTENT_TYPE)
+    if not complete:
+        response['Cache-Control'] = 'no-cache' # Grows on every reload
+    return response
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def stream_song_hls_segment(request, song_id, quality, index):
+    """One HLS segment, from the encoded quality or a running encode (encoded again if it was evicted)."""
+    song = get_hls_song(song_id)
+    if quality not in QUALITIES:
+        raise Http404("No such segment.")
+    path = hls.segment_file(song, quality, index)
+    if path is None:
+        segments, complete = hls.current_segments(song, quality)
+        if complete and index not in dict(segments):
+            raise Http404("No such segment.")
+        hls.schedule_encode(song, quality)
+        path = hls.wait_for_segment(song, quality, index, settings.HLS_SEGMENT_WAIT)
+    if path is None:
+        response = HttpResponse("Segment is not encoded yet.", status=503, content_type='text/plain')
+        response['Retry-After'] = str(math.ceil(settings.HLS_SEGMENT_SECONDS))
+        return response
+    touch(path)
+    try:
+        return stream_file(request, path, content_type=hls.SEGMENT_CONTENT_TYPE)
+    except FileNotFoundError:
+        path = hls.segment_file(song, quality, index) # Moved out of the running encode's directory meanwhile
+        if path is None:
+            raise Http404("Segment was just evicted, retry.")
+        return stream_file(request, path, content_type=hls.SEGMENT_CONTENT_TYPE)
 
 
 # --- Queue Management Views ---
 
+def queue_song_data(song):
+    """What the player needs to play a song: stream URLs, cover, duration and byte size (for preloading)."""
+    release = song.get_release()
+    cover_url = ''
+    if release:
+        cover_url = release.cover_image.url if release.cover_image else release.cover_image_url
+    size = None
+    if song.file:
+        try:
+            size = song.file.size
+        except OSError:
+            pass # Missing on disk, the stream endpoint answers 404
+    return {
+        'id': song.id,
+        'title': song.title,
+        'artist': ", ".join([a.name for a in song.artists.all()]),
+        'url': song_stream_url(song),
+        'hls_url': reverse('stream_song_hls', args=[song.id]) if song.file and settings.HLS_ENABLED else None,
+        'cover': cover_url or settings.STATIC_URL + 'placeholder-cover.png', # Fallback
+        'waveform_url': reverse('song_waveform', args=[song.id]) if song.file else None,
+        'duration': song.duration.total_seconds() if song.duration else None, # Seconds
+        'size': size, # Bytes of the original file
+        'replay_gain': song.replay_gain, # dB, None until analyze_loudness has run
+        'loudness_peak': song.loudness_peak, # Linear, for limiting the gain so it doesn't clip
+    }
+
+
 @login_required
 @require_POST # Expect POST, could also use PUT
 @csrf_protect
@@ -588,8 +745,13 @@ def add_to_queue(request, song_id):
 def get_next_in_queue(request):
     """Gets the next song in the queue based on the current index and advances the index."""
     queue, _ = Queue.objects.get_or_create(user=request.user)
+    try:
+        lookahead = min(max(int(request.GET.get('lookahead', settings.QUEUE_LOOKAHEAD)), 0), settings.QUEUE_LOOKAHEAD_MAX)
+    except ValueError:
+        lookahead = settings.QUEUE_LOOKAHEAD
 
     next_song_data = None
+    upcoming_data = []
     status = 'error' # Default status
     message = 'An unexpected error occurred.' # Default message
 
@@ -599,23 +761,19 @@ def get_next_in_queue(request):
             next_item = queue.items.filter(order__gt=queue.currently_playing_order).order_by('order').first()
 
             if next_item:
-                song = next_item.song
-                release = song.get_release()
-                cover_url = ''
-                if release:
-                    cover_url = release.cover_image.url if release.cover_image else release.cover_image_url
-
-                next_song_data = {
-                    'id': song.id,
-                    'title': song.title,
-                    'artist': ", ".join([a.name for a in song.artists.all()]),
-                    'url': song.file.url if song.file else None,
-                    'cover': cover_url or settings.STATIC_URL + 'placeholder-cover.png', # Fallback
-                }
+                next_song_data = queue_song_data(next_item.song)
+                # The items after it, so the player can preload the next track and switch without a gap
+                upcoming_items = list(
+                    queue.items.filter(order__gt=next_item.order)
+                    .select_related('song__album', 'song__ep', 'song__single')
+                    .prefetch_related('song__artists')
+                    .order_by('order')[:max(1, lookahead)]
+                )
+                upcoming_data = [dict(queue_song_data(item.song), order=item.order) for item in upcoming_items[:lookahead]]
                 # Update currently playing and the next index
                 queue.currently_playing_order = next_item.order
-                # Find the item after this one to set the next index correctly
-                next_next_item = queue.items.filter(order__gt=next_item.order).order_by('order').first()
+                # The item after this one sets the next index
+                next_next_item = upcoming_items[0] if upcoming_items else None
                 queue.current_track_index = next_next_item.order if next_next_item else next_item.order # Point to next or stay if last
                 queue.save(update_fields=['currently_playing_order', 'current_track_index', 'updated_at'])
 
@@ -647,6 +805,7 @@ def get_next_in_queue(request):
     response_data = {'status': status, 'message': message}
     if status == 'success':
         response_data['song'] = next_song_data
+        response_data['upcoming'] = upcoming_data
 
     return JsonResponse(response_data)
 
@@ -689,18 +848,7 @@ def get_previous_in_queue(request):
 
             if previous_item:
                 song = previous_item.song
-                release = song.get_release()
-                cover_url = ''
-                if release:
-                    cover_url = release.cover_image.url if release.cover_image else release.cover_image_url
-
-                previous_song_data = {
-                    'id': song.id,
-                    'title': song.title,
-                    'artist': ", ".join([a.name for a in song.artists.all()]),
-                    'url': song.file.url if song.file else None,
-                    'cover': cover_url or settings.STATIC_URL + 'placeholder-cover.png',
-                }
+                previous_song_data = queue_song_data(song)
                 # Update currently playing to this previous item's order
                 # --- MODIFICATION START ---
                 # If we came from order 0, the 'next' index doesn't make sense as the old order 0.
@@ -796,20 +944,7 @@ def view_queue(request):
                 # Use filter().first() instead of get() to avoid errors if order is invalid
                 current_item = items.filter(order=queue.currently_playing_order).first()
                 if current_item:
-                    song = current_item.song
-                    release = song.get_release()
-                    cover_url = ''
-                    if release:
-                        cover_url = release.cover_image.url if release.cover_image else release.cover_image_url
-
-                    currently_playing_song_data = {
-                        'id': song.id,
-                        'title': song.title,
-                        'artist': ", ".join([a.name for a in song.artists.all()]),
-                        'url': song.file.url if song.file else None,
-                        'cover': cover_url or settings.STATIC_URL + 'placeholder-cover.png',
-                        'order': current_item.order, # Include order
-                    }
+                    currently_playing_song_data = dict(queue_song_data(current_item.song), order=current_item.order) # Include order
             except QueueItem.DoesNotExist:
                  print(f"Warning: currently_playing_order {queue.currently_playing_order} not found in queue items for user {request.user.id}")
                  # Reset currently_playing_order if it's invalid?
@@ -942,13 +1077,48 @@ def set_currently_playing(request, song_id):
 # --- MODIFICATION END ---
 
 
-# --- Processing Functions (Called by add_spotify_content) ---
+# --- Processing Functions (Called by the ingest workers, see ingest.py) ---
+
+def download_missing_covers(releases, logs):
+    """Fetches covers for releases that only have a cover_image_url so far.
+    Downloads run concurrently (covers.fetch_covers) and identical artwork is stored once."""
+    missing = [release_obj for release_obj in releases if release_obj.cover_image_url and not release_obj.cover_image]
+    if not missing:
+        return
+    cover_urls = {release_obj.cover_image_url for release_obj in missing}
+
+    # Artwork already stored for another release (e.g. the album of a single) is reused as is
+    known_paths = {}
+    for model in (Album, EP, Single):
+        known_paths.update(
+            model.objects.filter(cover_image_url__in=cover_urls).exclude(cover_image='')
+            .values_list('cover_image_url', 'cover_image')
+        )
+    fetched_paths = fetch_covers([url for url in cover_urls if url not in known_paths])
+    known_paths.update(fetched_paths)
+
+    updated_by_model = {}
+    for release_obj in missing:
+        cover_path = known_paths.get(release_obj.cover_image_url)
+        if not cover_path:
+            logs.append(f"Error downloading cover image for {release_obj._meta.verbose_name} '{release_obj.title}'")
+            continue
+        release_obj.cover_image.name = cover_path
+        updated_by_model.setdefault(type(release_obj), []).append(release_obj)
+    for model, release_objs in updated_by_model.items():
+        model.objects.bulk_update(release_objs, ['cover_image'])
+    logs.append(f"Saved cover images for {sum(len(objs) for objs in updated_by_model.values())} releases ({len(fetched_paths)} downloaded).")
+
 
 def process_spotify_track(track_id, user):
-    """Gets track info, fetches lyrics, downloads audio, saves to DB, returns Song object or None."""
+    """Gets track info, queues a lyrics lookup, downloads audio, saves to DB, returns Song object or None."""
     track_logs = [] # Collect logs specific to track processing
+    complete_song = find_complete_songs([track_id]).get(track_id)
+    if complete_song:
+        track_logs.append(f"Song '{complete_song.title}' already has a file and lyrics, nothing to do.")
+        return complete_song, track_logs
     try:
-        track_info = sp.track(track_id)
+        track_info = spotify_metadata.track(track_id)
         if not track_info:
             track_logs.append(f"Could not fetch track info for ID: {track_id}")
             return None, track_logs
@@ -956,315 +1126,217 @@ def process_spotify_track(track_id, user):
         track_logs.append(f"Spotify API error fetching track {track_id}: {e}")
         return None, track_logs
 
-    # --- Get/Create Artists ---
-    artists = []
-    artist_names_for_path = [] # Store names for spotdl path finding
-    artist_names_for_lyrics = [] # Store names for syncedlyrics search
-    for artist_data in track_info['artists']:
-        artist, created = Artist.objects.update_or_create(
-            spotify_id=artist_data['id'],
-            defaults={'name': artist_data['name']}
-        )
-        artists.append(artist)
-        artist_names_for_path.append(artist.name)
-        artist_names_for_lyrics.append(artist.name) # Add for lyrics search
-
-    # --- Get/Create Album/EP/Single (Release) ---
-    # ... (keep existing release object creation logic) ...
-    album_info = track_info['album']
-    release_spotify_id = album_info['id']
-    release_date_val = parse_release_date(album_info.get('release_date')) # Renamed variable
-    cover_url = album_info['images'][0]['url'] if album_info['images'] else None
-    album_type = album_info.get('album_type', 'album')
-
-    release_model = Album
-    if album_type == 'ep': release_model = EP
-    elif album_type == 'single': release_model = Single
-
-    release_defaults = {
-        'title': album_info['name'],
-        'release_date': release_date_val,
-        'cover_image_url': cover_url,
-    }
-
-    release_obj, created = release_model.objects.update_or_create(
-        spotify_id=release_spotify_id,
-        defaults=release_defaults
-    )
-    release_obj.artists.set(artists) # Associate artists
-
-    # Download cover image if URL exists and image not already set
-    image_updated = False
-    if release_obj.cover_image_url and not release_obj.cover_image:
-        img_name = f"{better_slugify(release_obj.title)}_{release_obj.spotify_id}.jpg"
-        # Call download_image - it now returns True/False
-        if download_image(release_obj.cover_image_url, release_obj, 'cover_image', img_name):
-             image_updated = True # Mark that image content is ready to be saved
-
-    # Save the release object *if* it was newly created OR if the image was updated
-    if created or image_updated:
-        try:
-            release_obj.save()
-            track_logs.append(f"Saved {release_obj._meta.verbose_name} '{release_obj.title}' (Created: {created}, Image Updated: {image_updated})")
-        except Exception as e:
-            track_logs.append(f"Error saving release object {release_obj.title}: {e}")
-            # Decide if this is critical - maybe proceed without cover image?
-
-
-    # --- Get/Create Song ---
-    song_defaults = {
-        'title': track_info['name'],
-        'duration': timedelta(milliseconds=track_info['duration_ms']),
-        'release_date': release_obj.release_date, # Use release's date
-        'album': release_obj if isinstance(release_obj, Album) else None,
-        'ep': release_obj if isinstance(release_obj, EP) else None,
-        'single': release_obj if isinstance(release_obj, Single) else None,
-        # --- MODIFICATION START: Add track_number ---
-        'track_number': track_info.get('track_number'), # Get track number from Spotify data
-        # --- MODIFICATION END ---
-        # Initialize lyrics fields as empty, they will be fetched next
-        'lyrics': None,
-        'synced_lyrics': None,
-    }
-    # Use update_or_create for the song as well
-    song, song_created = Song.objects.update_or_create(
-        spotify_id=track_id,
-        defaults=song_defaults
-    )
-    song.artists.set(artists) # Associate artists
-
-    # --- MODIFICATION START: Fetch Lyrics using syncedlyrics ---
-    lyrics_fetched = False
-    synced_lyrics_fetched = False
-    update_fields_lyrics = [] # Track which lyrics fields need saving
-
-    # Only fetch if lyrics fields are currently empty
-    if not song.lyrics and not song.synced_lyrics:
-        try:
-            search_term = f"{song.title} {' '.join(artist_names_for_lyrics)}"
-            track_logs.append(f"Searching lyrics for: '{search_term}'")
-            # --- MODIFICATION: Remove allow_plain=True ---
-            lrc_result = syncedlyrics.search(search_term, save_path=None) # Don't save to file here
-            # --- MODIFICATION END ---
-
-            if lrc_result:
-                # Check if the result is a string (likely plain lyrics)
-                if isinstance(lrc_result, str):
-                    # Check if it looks like LRC format - if so, treat as synced
-                    if re.match(r'\[\d{2}:\d{2}\.\d{2,3}\]', lrc_result.strip()):
-                        song.synced_lyrics = lrc_result
-                        synced_lyrics_fetched = True
-                        update_fields_lyrics.append('synced_lyrics')
-                        track_logs.append(f"Found synced lyrics (returned as string) for '{song.title}'.")
-                    else: # Otherwise, assume it's plain text
-                        song.lyrics = lrc_result
-                        lyrics_fetched = True
-                        update_fields_lyrics.append('lyrics')
-                        track_logs.append(f"Found plain lyrics for '{song.title}'.")
-                # If it's not a string, assume it's synced (or handle object if library changes)
-                # This part might need adjustment based on how syncedlyrics returns synced results
-                # For now, let's assume if it's not a string and not None, it's synced.
-                elif lrc_result is not None: # Check explicitly for not None
-                    # Assuming the result itself is the synced lyrics string if not plain text
-                    # This might need refinement based on library's actual return type for synced.
-                    song.synced_lyrics = str(lrc_result) # Convert just in case it's an object
-                    synced_lyrics_fetched = True
-                    update_fields_lyrics.append('synced_lyrics')
-                    track_logs.append(f"Found synced lyrics (returned as non-string) for '{song.title}'.")
-                else: # lrc_result was None or empty
-                     track_logs.append(f"No lyrics found for '{song.title}'.")
-
-            else: # lrc_result was None or empty
-                track_logs.append(f"No lyrics found for '{song.title}'.")
-
-        except Exception as lyr_e:
-            track_logs.append(f"Error fetching lyrics for '{song.title}': {lyr_e}")
-            track_logs.append(traceback.format_exc()) # Add traceback for lyrics error
-
-        # Save lyrics if fetched
-        if update_fields_lyrics:
-            try:
-                song.save(update_fields=update_fields_lyrics)
-                track_logs.append(f"Saved fetched lyrics fields: {', '.join(update_fields_lyrics)}")
-            except Exception as save_lyr_e:
-                 track_logs.append(f"Error saving fetched lyrics for '{song.title}': {save_lyr_e}")
-    else:
-        track_logs.append(f"Lyrics already exist for '{song.title}'. Skipping fetch.")
-    # --- MODIFICATION END ---
+    # --- Save Artists, Release and Song ---
+    batch = write_track_batch([track_info])
+    track_logs.extend(batch.logs)
+    song = batch.songs.get(track_info['id'])
+    if not song:
+        track_logs.append(f"Could not save track {track_id}.")
+        return None, track_logs
+    download_missing_covers(batch.releases.values(), track_logs)
 
+    artist_names = [artist_data['name'] for artist_data in track_info['artists']]
+    if schedule_lyrics(song, artist_names): # Filled in by the lyrics pool, doesn't hold up the download
+        track_logs.append(f"Queued lyrics lookup for '{song.title}'.")
 
     # --- Download File (if needed) ---
-    # ... (keep existing download check logic) ...
-    needs_download = False
-    if not song.file:
-        needs_download = True
-        track_logs.append(f"Song '{song.title}' has no file assigned.")
-    # Use try-except for storage.exists as it might fail if song.file.name is invalid
-    else:
-        try:
-            if not song.file.storage.exists(song.file.name):
-                needs_download = True
-                track_logs.append(f"File '{song.file.name}' for song '{song.title}' not found in storage.")
-            else:
-                 track_logs.append(f"File '{song.file.name}' already exists for song '{song.title}'. Skipping download.")
-        except Exception as e:
-            track_logs.append(f"Error checking storage for '{song.file.name}': {e}. Assuming download needed.")
-            needs_download = True
-
+    needs_download, download_reason = song_needs_download(song)
+    track_logs.append(download_reason)
 
     if needs_download:
         track_logs.append(f"Attempting download for song '{song.title}'...")
-        spotify_track_url = f"https://open.spotify.com/track/{track_id}"
+        spotify_track_url = f"https://open.spotify.com/track/{song.spotify_id}"
+        release = song.get_release()
         try:
-            # Pass expected title/artist to help finding function
             relative_file_path = run_spotdl_and_get_path(
                 spotify_track_url,
-                track_id,
+                song.spotify_id,
                 expected_title=song.title,
-                expected_artist=artist_names_for_path[0] if artist_names_for_path else None # Use first artist name
+                expected_artist=artist_names[0] if artist_names else None, # Use first artist name
+                expected_album=release.title if release else None,
             )
             song.file.name = relative_file_path # Assign relative path from MEDIA_ROOT
-
-            # --- REMOVED: Lyrics File Checking Logic ---
-            # The logic to find and read .lrc/.synced.lrc files is removed
-            # as lyrics are now fetched directly via syncedlyrics library.
-
-            # Save song with file path
-            update_fields = ['file']
-            track_logs.append(f"DEBUG: Saving song with update_fields: {update_fields}")
-            song.save(update_fields=update_fields)
+            song.save(update_fields=['file'])
             track_logs.append(f"Successfully linked downloaded file for '{song.title}': {song.file.name}")
-
+            schedule_waveform(song) # Seek bar peaks, computed in the background
         except Exception as e:
+            # File field remains empty/unchanged, the song row is still useful (artists/album/lyrics)
             track_logs.append(f"Failed to download or link file for song '{song.title}' (ID: {track_id}): {e}")
-            # File field remains empty/unchanged
-            # Save song object even if download failed (artists/album/lyrics links might be useful)
-            # Check if lyrics were fetched and need saving even if download failed
-            if update_fields_lyrics and not all(field in ['lyrics', 'synced_lyrics'] for field in song._meta.fields):
-                 try:
-                     song.save(update_fields=update_fields_lyrics)
-                     track_logs.append(f"Saved fetched lyrics fields after download failure: {', '.join(update_fields_lyrics)}")
-                 except Exception as save_lyr_e:
-                     track_logs.append(f"Error saving fetched lyrics after download failure for '{song.title}': {save_lyr_e}")
-            elif song_created and not update_fields_lyrics: # Save if newly created but no lyrics fetched
-                 song.save()
-
-            return song, track_logs # Return song even if download failed
-
-    # If download wasn't needed, but song was created OR lyrics were fetched, save it.
-    elif song_created or update_fields_lyrics:
-        fields_to_save = []
-        if song_created: fields_to_save = None # Save all fields if new
-        elif update_fields_lyrics: fields_to_save = update_fields_lyrics # Only save lyrics fields if existing
-
-        if fields_to_save is None or fields_to_save: # Check if there's anything to save
-            try:
-                song.save(update_fields=fields_to_save)
-                log_msg = "Saved new song metadata" if song_created else f"Saved updated lyrics fields: {', '.join(update_fields_lyrics)}"
-                track_logs.append(f"{log_msg} for '{song.title}' (file already existed).")
-            except Exception as save_e:
-                 track_logs.append(f"Error saving song metadata/lyrics for '{song.title}': {save_e}")
-
 
     return song, track_logs
 
 
-def process_spotify_album(album_id, user):
-    """Gets album info, processes each track. Returns list of processed Song objects and the release object."""
+def finish_batch_downloads(pending_downloads, logs, progress=None, track_targets=None):
+    """Downloads {track_id: Song} in one spotdl batch, appends to logs and reports per-track results."""
+    if not pending_downloads:
+        return
+    logs.append(f"Downloading {len(pending_downloads)} tracks in one spotdl batch...")
+    try:
+        linked_ids, batch_logs = download_songs_batch(pending_downloads, track_targets)
+        logs.extend(batch_logs)
+        error_message = "No output file found after spotdl batch."
+    except Exception as e:
+        linked_ids = set()
+        error_message = f"SpotDL batch failed: {e}"
+        logs.append(error_message)
+    if progress:
+        for track_id, song in pending_downloads.items():
+            if track_id in linked_ids:
+                progress.track_finished(track_id, song=song, ok=True, message=f"Downloaded {song.file.name}")
+            else:
+                progress.track_finished(track_id, song=song, ok=False, message=error_message)
+
+
+def ingest_track_batch(track_payloads, logs, progress=None):
+    """Saves a batch of full track payloads (an album or a playlist page), queues lyrics lookups and
+    downloads the missing audio in one spotdl batch. Returns the Song objects of the batch."""
+    track_payloads = [t for t in track_payloads if t and t.get('id') and not t.get('is_local')]
+    if progress:
+        # Tracks finished by an earlier (crashed) attempt of the job are not looked at again
+        finished = progress.finished_tracks([t['id'] for t in track_payloads])
+        track_payloads = [t for t in track_payloads if t['id'] not in finished]
+    # Songs we already have in full (file and lyrics) skip the writes, covers, lyrics and storage checks
+    complete_songs = find_complete_songs(t['id'] for t in track_payloads)
+    if complete_songs:
+        logs.append(f"{len(complete_songs)} of {len(track_payloads)} tracks are already complete, skipping them.")
+    if progress:
+        progress.add_tracks([(t['id'], t.get('name')) for t in track_payloads], done_songs=complete_songs, message="Already complete, skipped.")
+    songs = list({t['id']: complete_songs[t['id']] for t in track_payloads if t['id'] in complete_songs}.values())
+    track_payloads = [t for t in track_payloads if t['id'] not in complete_songs]
+    if not track_payloads:
+        return songs
+    try:
+        batch = write_track_batch(track_payloads)
+    except Exception as e:
+        logs.append(f"Error saving batch of {len(track_payloads)} tracks: {e}")
+        if progress:
+            for track in track_payloads:
+                progress.track_finished(track['id'], ok=False, message=str(e))
+        return songs
+    logs.extend(batch.logs)
+    download_missing_covers(batch.releases.values(), logs)
+
+    seen_ids = set()
+    pending_downloads = {} # track_id -> Song, downloaded together after the metadata pass
+    track_targets = {}
+    for track in track_payloads:
+        song = batch.songs.get(track['id'])
+        if song is None or track['id'] in seen_ids:
+            continue # Listed twice (playlists), already handled
+        seen_ids.add(track['id'])
+        if progress: progress.track_started(track['id'])
+        track_logs = []
+        try:
+            if schedule_lyrics(song, [a['name'] for a in track['artists']]):
+                track_logs.append(f"Queued lyrics lookup for '{song.title}'.")
+            songs.append(song)
+            needs_download, download_reason = song_needs_download(song)
+            track_logs.append(download_reason)
+            logs.extend(track_logs) # Add logs from processing each track
+            if needs_download:
+                pending_downloads[track['id']] = song
+                track_targets[track['id']] = spotdl_target_path(
+                    track['id'], track['name'], track['artists'][0]['name'] if track['artists'] else None, track['album']['name']
+                )
+            elif progress:
+                progress.track_finished(track['id'], song=song, ok=True, message="\n".join(track_logs))
+        except Exception as e:
+            logs.append(f"Error processing track {track['id']}: {e}")
+            if progress: progress.track_finished(track['id'], ok=False, message=str(e))
+            # Continue processing other tracks
+
+    finish_batch_downloads(pending_downloads, logs, progress, track_targets)
+    return songs
+
+
+def process_spotify_album(album_id, user, progress=None):
+    """Gets album info, processes each track. Returns list of processed Song objects and the release object.
+    `progress` is an optional ingest.JobProgress that receives per-track updates."""
     processed_songs = []
     release_obj = None
     album_logs = [] # Collect logs specific to album processing
     try:
-        album_info = sp.album(album_id)
+        album_info = spotify_metadata.album(album_id) # Includes every track, cached
         if not album_info:
              album_logs.append(f"Could not fetch album info for ID: {album_id}")
              return [], None, album_logs
 
-        # --- Create the Album/EP/Single object ---
-        # ... (keep existing release object creation logic) ...
-        release_spotify_id = album_info['id']
-        release_date_val = parse_release_date(album_info.get('release_date')) # Renamed
-        cover_url = album_info['images'][0]['url'] if album_info['images'] else None
-        album_type = album_info.get('album_type', 'album')
-        artist_info_list = album_info['artists']
-
-        release_model = Album
-        if album_type == 'ep': release_model = EP
-        elif album_type == 'single': release_model = Single
-
-        release_defaults = {
-            'title': album_info['name'],
-            'release_date': release_date_val,
-            'cover_image_url': cover_url,
-        }
-        release_obj, created = release_model.objects.update_or_create(
-            spotify_id=release_spotify_id,
-            defaults=release_defaults
-        )
-
-        release_artists = []
-        for artist_data in artist_info_list:
-            artist, _ = Artist.objects.update_or_create(
-                spotify_id=artist_data['id'],
-                defaults={'name': artist_data['name']}
-            )
-            release_artists.append(artist)
-        release_obj.artists.set(release_artists)
-
-        # Download cover image if needed
-        image_updated = False
-        if release_obj.cover_image_url and not release_obj.cover_image:
-             img_name = f"{better_slugify(release_obj.title)}_{release_obj.spotify_id}.jpg"
-             if download_image(release_obj.cover_image_url, release_obj, 'cover_image', img_name):
-                 image_updated = True
-
-        # Save the release object if created or image updated
-        if created or image_updated:
-            try:
-                release_obj.save()
-                album_logs.append(f"Saved {release_obj._meta.verbose_name} '{release_obj.title}' (Created: {created}, Image Updated: {image_updated})")
-            except Exception as e:
-                album_logs.append(f"Error saving release object {release_obj.title}: {e}")
-
-
-        # --- Process Tracks ---
-        # ... (keep existing track processing loop using process_spotify_track) ...
-        album_tracks = sp.album_tracks(album_id) # Fetch tracks again (or pass from album_info if available)
-        if not album_tracks:
+        # Album responses carry simplified tracks, turned into full payloads without extra calls
+        track_payloads = SpotifyMetadata.album_track_payloads(album_info)
+        if not track_payloads:
             album_logs.append(f"Could not fetch tracks for album ID: {album_id}")
-            return [], release_obj, album_logs
+            return [], None, album_logs
 
-        print(f"Processing {len(album_tracks['items'])} tracks for {album_type} '{release_obj.title}'")
-        for track_item in album_tracks['items']:
-            if track_item and track_item.get('id'):
-                try:
-                    song, track_logs = process_spotify_track(track_item['id'], user)
-                    if song:
-                        processed_songs.append(song)
-                        album_logs.extend(track_logs) # Add logs from processing each track
-                except Exception as e:
-                    album_logs.append(f"Error processing track {track_item.get('id')} from album {album_id}: {e}")
-                    # Continue processing other tracks
+        print(f"Processing {len(track_payloads)} tracks for {album_info.get('album_type', 'album')} '{album_info['name']}'")
+        processed_songs = ingest_track_batch(track_payloads, album_logs, progress)
+        release_obj = release_model_for(album_info).objects.filter(spotify_id=album_info['id']).first()
 
     except spotipy.SpotifyException as e:
          album_logs.append(f"Spotify API error fetching album {album_id}: {e}")
          return [], None, album_logs
     except Exception as e:
         album_logs.append(f"Unexpected error processing album {album_id}: {e}")
-        import traceback
         traceback.print_exc()
         return [], release_obj, album_logs
 
     return processed_songs, release_obj, album_logs
 
 
-def process_spotify_playlist(playlist_id, user):
-    """Gets playlist info, processes each track. Returns list of processed Song objects and the Playlist object."""
+def process_spotify_artist(artist_id, user, progress=None):
+    """Ingests an artist's albums, singles and EPs. Releases go through process_spotify_album,
+    ARTIST_RELEASE_CONCURRENCY at a time. Returns list of processed Song objects and the Artist object."""
+    processed_songs = []
+    artist_logs = []
+    try:
+        artist_info = sp.artist(artist_id)
+        if not artist_info:
+            artist_logs.append(f"Could not fetch artist info for ID: {artist_id}")
+            return [], None, artist_logs
+        artist_obj, _ = Artist.objects.update_or_create(spotify_id=artist_id, defaults={'name': artist_info['name'][:100]})
+
+        releases = spotify_metadata.artist_releases(artist_id)
+        print(f"Processing {len(releases)} releases for artist '{artist_obj.name}'")
+        if progress: progress.expect(sum(release.get('total_tracks') or 0 for release in releases))
+        # Full album payloads 20 per request up front, the album workers then read them from the cache
+        spotify_metadata.albums([release['id'] for release in releases])
+    except spotipy.SpotifyException as e:
+        artist_logs.append(f"Spotify API error fetching artist {artist_id}: {e}")
+        return [], None, artist_logs
+
+    def _process_release(release):
+        try:
+            return process_spotify_album(release['id'], user, progress)
+        finally:
+            connection.close() # Each pool thread has its own DB connection
+
+    with ThreadPoolExecutor(max_workers=max(1, min(settings.ARTIST_RELEASE_CONCURRENCY, len(releases) or 1))) as pool:
+        for release, (songs, release_obj, album_logs) in zip(releases, pool.map(_process_release, releases)):
+            processed_songs.extend(songs)
+            artist_logs.extend(album_logs)
+            if release_obj is None:
+                artist_logs.append(f"Could not process release '{release.get('name')}' ({release['id']}).")
+
+    print(f"Finished processing artist '{artist_obj.name}'. Processed {len(processed_songs)} tracks.")
+    return processed_songs, artist_obj, artist_logs
+
+
+# Playlist fields without any tracks, enough to check the snapshot and start paging
+PLAYLIST_HEADER_FIELDS = 'name,description,public,snapshot_id,tracks(total,limit)'
+
+def process_spotify_playlist(playlist_id, user, progress=None, playlist_info=None):
+    """Gets playlist info, processes each track. Returns list of processed Song objects and the Playlist object.
+    `progress` is an optional ingest.JobProgress that receives per-track updates.
+    Pass playlist_info when the playlist (or its PLAYLIST_HEADER_FIELDS) was just fetched."""
     processed_songs = []
     playlist_obj = None
     playlist_logs = [] # Collect logs specific to playlist processing
+    start_offset = progress.checkpoint_offset if progress else 0 # Resumed jobs skip committed pages
     try:
-        playlist_info = sp.playlist(playlist_id)
+        if playlist_info is None and start_offset:
+            # The first page of items isn't needed when resuming past it
+            playlist_info = sp.playlist(playlist_id, fields=PLAYLIST_HEADER_FIELDS)
+        elif playlist_info is None:
+            playlist_info = sp.playlist(playlist_id)
         if not playlist_info:
             playlist_logs.append(f"Could not fetch playlist info for ID: {playlist_id}")
             return [], None, playlist_logs
@@ -1275,7 +1347,7 @@ def process_spotify_playlist(playlist_id, user):
             'description': playlist_info['description'],
             'user': user, # Assign to the current user
             'public': playlist_info['public'],
-            # TODO: Handle playlist cover image download using download_image logic
+            # TODO: Handle playlist cover image download using covers.fetch_cover
         }
         playlist_obj, created = Playlist.objects.update_or_create(
             spotify_id=playlist_id,
@@ -1284,44 +1356,80 @@ def process_spotify_playlist(playlist_id, user):
         # TODO: Save playlist_obj if cover image was updated
 
         # --- Process Tracks ---
-        offset = 0
+        offset = start_offset
         limit = 100
         total = playlist_info['tracks']['total']
         print(f"Processing {total} tracks for playlist '{playlist_obj.name}'")
+        if progress: progress.expect(total)
+        positions = {} # Song pk -> index in the Spotify playlist, for every track seen so far
+        listing_complete = True # Memberships are only removed when every track was seen
+        finished = {} # Track id -> song pk of tracks an earlier attempt of the job already finished
+        if start_offset:
+            finished = progress.finished_tracks()
+            listing_complete = None not in finished.values() # A track before the checkpoint failed to save
+            positions = dict(PlaylistSong.objects.filter(playlist=playlist_obj, song_id__in=finished.values())
+                             .values_list('song_id', 'position'))
+            playlist_logs.append(f"Resuming playlist at offset {start_offset} with {len(finished)} tracks already done.")
 
         while offset < total:
-            try:
-                playlist_items = sp.playlist_items(playlist_id, limit=limit, offset=offset)
-            except spotipy.SpotifyException as e:
-                playlist_logs.append(f"Spotify API error fetching playlist items (offset {offset}) for {playlist_id}: {e}")
-                break
+            if offset == 0 and playlist_info['tracks'].get('items'):
+                playlist_items = playlist_info['tracks'] # sp.playlist() already includes the first page
+                limit = playlist_items.get('limit') or limit
+            else:
+                try:
+                    playlist_items = sp.playlist_items(playlist_id, limit=limit, offset=offset)
+                except spotipy.SpotifyException as e:
+                    playlist_logs.append(f"Spotify API error fetching playlist items (offset {offset}) for {playlist_id}: {e}")
+                    listing_complete = False
+                    break
 
             if not playlist_items or not playlist_items['items']:
+                listing_complete = False
                 break
 
-            for item in playlist_items['items']:
-                track = item.get('track')
-                if track and track.get('id') and not track.get('is_local'):
-                    try:
-                        song, track_logs = process_spotify_track(track['id'], user)
-                        if song:
-                            processed_songs.append(song)
-                            playlist_obj.songs.add(song) # Add song to the playlist M2M
-                            playlist_logs.extend(track_logs) # Add logs from processing each track
-                    except Exception as e:
-                        playlist_logs.append(f"Error processing track {track.get('id')} from playlist {playlist_id}: {e}")
-                        # Continue processing other tracks
-                elif track and track.get('is_local'):
+            page_tracks = [item.get('track') for item in playlist_items['items']]
+            for track in page_tracks:
+                if track and track.get('is_local'):
                     playlist_logs.append(f"Skipping local track '{track.get('name')}' in playlist {playlist_id}")
-
-            offset += limit # Move to the next page
+            if progress:
+                progress.skip_expected(sum(1 for t in page_tracks if not t or not t.get('id') or t.get('is_local')))
+            # Playlist items carry full track objects, keep them so tracks are never fetched one by one
+            spotify_metadata.prime_tracks([t for t in page_tracks if t and not t.get('is_local')])
+
+            page_songs = ingest_track_batch(page_tracks, playlist_logs, progress)
+            processed_songs.extend(page_songs)
+            song_ids = {song.spotify_id: song.pk for song in page_songs}
+            if progress:
+                finished.update(progress.finished_tracks([t['id'] for t in page_tracks if t and t.get('id') and t['id'] not in song_ids]))
+            page_positions = {}
+            for index, track in enumerate(page_tracks):
+                if not track or not track.get('id') or track.get('is_local'):
+                    continue
+                song_id = song_ids.get(track['id']) or finished.get(track['id'])
+                if song_id is None:
+                    listing_complete = False # Couldn't be saved, keep whatever membership it had
+                elif song_id not in positions: # First occurrence wins for duplicates
+                    positions[song_id] = page_positions[song_id] = offset + index
+
+            offset += len(playlist_items['items']) # Move to the next page
+            # Commit the page's memberships together with the checkpoint, a restart continues after it
+            with transaction.atomic():
+                sync_playlist_songs(playlist_obj, page_positions, remove_missing=False)
+                if progress: progress.checkpoint(offset)
+
+        added, moved, removed = sync_playlist_songs(playlist_obj, positions, remove_missing=listing_complete)
+        playlist_logs.append(f"Playlist memberships: {len(positions)} songs, {removed} removed.")
+        if listing_complete:
+            # sync_playlists skips the playlist until Spotify reports a new version
+            playlist_obj.snapshot_id = playlist_info.get('snapshot_id')
+            playlist_obj.last_synced_at = timezone.now()
+            playlist_obj.save(update_fields=['snapshot_id', 'last_synced_at'])
 
     except spotipy.SpotifyException as e:
          playlist_logs.append(f"Spotify API error fetching playlist {playlist_id}: {e}")
          return [], None, playlist_logs
     except Exception as e:
         playlist_logs.append(f"Unexpected error processing playlist {playlist_id}: {e}")
-        import traceback
         traceback.print_exc()
         return [], playlist_obj, playlist_logs # Return potentially partial list and the playlist obj if created
 
@@ -1329,6 +1437,22 @@ def process_spotify_playlist(playlist_id, user):
     return processed_songs, playlist_obj, playlist_logs
 
 
+def sync_spotify_playlist(playlist_obj, force=False):
+    """Brings an imported playlist up to date. Returns (changed, logs).
+    Costs one small API call (the playlist without its tracks) when Spotify's snapshot_id is unchanged.
+    Otherwise the playlist is re-read from that header: known complete tracks are skipped, only added
+    tracks are processed/downloaded and memberships of removed tracks are dropped."""
+    try:
+        current = sp.playlist(playlist_obj.spotify_id, fields=PLAYLIST_HEADER_FIELDS)
+    except spotipy.SpotifyException as e:
+        return False, [f"Spotify API error checking playlist {playlist_obj.spotify_id}: {e}"]
+    snapshot_id = (current or {}).get('snapshot_id')
+    if not force and snapshot_id and snapshot_id == playlist_obj.snapshot_id:
+        return False, [f"Playlist '{playlist_obj.name}' is unchanged."]
+    songs, synced_playlist, logs = process_spotify_playlist(playlist_obj.spotify_id, playlist_obj.user, playlist_info=current)
+    return synced_playlist is not None, logs
+
+
 # --- MODIFICATION START: Add get_lyrics view ---
 @login_required
 def get_lyrics(request, song_id):
@@ -0,0 +1,144 @@
+"""Waveform peaks for the seek bar.
+
+Each song is decoded once by ffmpeg into mono float samples at
+WAVEFORM_SAMPLE_RATE and streamed through NumPy in chunks: every block of
+BLOCK_SAMPLES samples is reduced to its min and max, then the blocks are
+folded into WAVEFORM_BUCKETS buckets. The result is stored as int8 min/max
+pairs (2 bytes per bucket, 2 KB for the default 1000 buckets) in
+SongWaveform, so the UI draws the waveform from one small cached request
+instead of downloading and decoding the whole file.
+
+Peaks are computed right after a download (on the transcode pool) and for
+existing songs by `manage.py compute_waveforms`. SongWaveform.source_version
+is the file version (player/streaming.py) they were computed from, so a
+replaced file gets new peaks and an unchanged one is never decoded twice.
+"""
+import subprocess
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from .models import SongWaveform
+from .streaming import file_version
+from .transcode import ffmpeg_available, get_pool
+
+try:
+    import numpy as np
+except ImportError: # Optional, waveforms are skipped without it
+    np = None
+
+BLOCK_SAMPLES = 64
+READ_BYTES = BLOCK_SAMPLES * 4 * 4096 # Whole float32 blocks, about 1 MB per read
+
+_pending = set() # Song ids queued or being computed
+_pending_lock = threading.Lock()
+
+
+def waveforms_available():
+    return np is not None and ffmpeg_available()
+
+
+def compute_peaks(path, buckets=None, sample_rate=None):
+    """Decodes the audio file at `path` and returns its peaks as bytes (int8 min/max pairs).
+    Returns None for files without audio. Raises RuntimeError when ffmpeg fails.
+    Doesn't touch the database, so it can run in worker processes."""
+    buckets = buckets or settings.WAVEFORM_BUCKETS
+    sample_rate = sample_rate or settings.WAVEFORM_SAMPLE_RATE
+    command = [
+        settings.FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', path, '-map', '0:a:0', '-vn', '-ac', '1', '-ar', str(sample_rate),
+        '-f', 'f32le', '-',
+    ]
+    block_mins, block_maxs = [], []
+    leftover = b''
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(READ_BYTES)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % (BLOCK_SAMPLES * 4)
+            leftover = data[usable:]
+            if usable:
+                blocks = np.frombuffer(data[:usable], dtype='<f4').reshape(-1, BLOCK_SAMPLES)
+                block_mins.append(blocks.min(axis=1))
+                block_maxs.append(blocks.max(axis=1))
+        stderr = process.stderr.read().decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.strip()[-500:]}")
+    tail = np.frombuffer(leftover[:len(leftover) - len(leftover) % 4], dtype='<f4')
+    if tail.size:
+        block_mins.append(tail.min(keepdims=True))
+        block_maxs.append(tail.max(keepdims=True))
+    if not block_mins:
+        return None
+
+    block_mins = np.concatenate(block_mins)
+    block_maxs = np.concatenate(block_maxs)
+    buckets = min(buckets, block_mins.size)
+    edges = np.arange(buckets) * block_mins.size // buckets # First block of every bucket
+    peaks = np.empty(buckets * 2, dtype=np.int8)
+    peaks[0::2] = np.clip(np.rint(np.minimum.reduceat(block_mins, edges) * 127), -127, 127)
+    peaks[1::2] = np.clip(np.rint(np.maximum.reduceat(block_maxs, edges) * 127), -127, 127)
+    return peaks.tobytes()
+
+
+def store_waveforms(results):
+    """Saves [(song_id, peaks, source_version)] in one upsert."""
+    SongWaveform.objects.bulk_create([
+        SongWaveform(song_id=song_id, peaks=peaks, buckets=len(peaks) // 2, source_version=version)
+        for song_id, peaks, version in results
+    ], update_conflicts=True, unique_fields=['song'], update_fields=['peaks', 'buckets', 'source_version', 'computed_at'])
+
+
+def compute_waveform_for_song(song_id, path):
+    """Computes and saves the peaks of one song file. Returns True if saved."""
+    try:
+        version = file_version(path)
+        peaks = compute_peaks(path)
+        if not peaks or not version:
+            print(f"No audio to draw a waveform from for song {song_id}.")
+            return False
+        store_waveforms([(song_id, peaks, version)])
+        return True
+    except Exception as e:
+        print(f"Error computing waveform for song {song_id}: {e}")
+        return False
+    finally:
+        connection.close() # Pool threads outlive the job
+
+
+def _run_scheduled(song_id, path):
+    try:
+        return compute_waveform_for_song(song_id, path)
+    finally:
+        with _pending_lock:
+            _pending.discard(song_id)
+
+
+def _submit(song):
+    if not waveforms_available() or not song.file:
+        return None
+    with _pending_lock:
+        if song.pk in _pending:
+            return None
+        _pending.add(song.pk)
+    return get_pool().submit(_run_scheduled, song.pk, song.file.path)
+
+
+def schedule_waveform(song):
+    """Queues the peaks of a freshly downloaded song on the transcode pool. Returns the Future,
+    or None when WAVEFORM_ON_INGEST is off, NumPy/ffmpeg are missing or it's already queued."""
+    if not settings.WAVEFORM_ON_INGEST:
+        return None
+    return _submit(song)
+
+
+def current_waveform(song):
+    """The stored waveform of a song if it matches the current file. A missing or outdated one is
+    queued for computing and None is returned (or the outdated one, while the new one is made)."""
+    waveform = SongWaveform.objects.filter(song=song).first()
+    if waveform is None or waveform.source_version != file_version(song.file.path):
+        _submit(song)
+    return waveform